@@ -0,0 +1,199 @@
+from collections import Counter
+from .matcher import Matcher
+
+
+class RuleResult:
+    """How one rule would have done against the transactions that are already categorized.
+
+    Args:
+        match_pattern: The MatchPattern, bound to the book.
+        target_split_count: How many of the splits tested are in the account the rule points to (integer).
+    """
+    def __init__(self, match_pattern, target_split_count):
+        self.match_pattern = match_pattern
+        self.target_split_count = target_split_count
+        # How many splits the rule matched, and how many of them are in the account it points to
+        self.matched_count = 0
+        self.correct_count = 0
+        # The number of splits the rule matched that are in other accounts, keyed by account guid
+        self.wrong_account_counts = Counter()
+
+    @property
+    def precision(self):
+        """The fraction of the splits the rule matched that are in the account it points to,
+        or None if it matched none.
+        """
+        if not self.matched_count:
+            return None
+        return self.correct_count / self.matched_count
+
+    @property
+    def coverage(self):
+        """The fraction of the splits in the account the rule points to that the rule matched,
+        or None if there are none.
+        """
+        if not self.target_split_count:
+            return None
+        return self.correct_count / self.target_split_count
+
+    def __repr__(self):
+        return '{cls}({rule_id}, matched={matched}, correct={correct})'.format(
+            cls=self.__class__.__name__, rule_id=self.match_pattern.rule_id, matched=self.matched_count,
+            correct=self.correct_count)
+
+
+class BacktestResult:
+    """How the rules for one uncategorized account would have done against the transactions
+    that are already categorized.
+
+    Args:
+        account_name: Full name of the uncategorized account (string).
+        rule_results: List of RuleResults, in config order.
+        split_count: How many splits were tested (integer).
+    """
+    def __init__(self, account_name, rule_results, split_count):
+        self.account_name = account_name
+        self.rule_results = rule_results
+        self.split_count = split_count
+
+    @property
+    def matched_count(self):
+        return sum(rule_result.matched_count for rule_result in self.rule_results)
+
+    @property
+    def correct_count(self):
+        return sum(rule_result.correct_count for rule_result in self.rule_results)
+
+
+class Backtester:
+    """Tries the rules against the transactions that are already categorized, to show what a
+    rule would have done before it is used on the uncategorized accounts.
+
+    The rules for each uncategorized account are tried against every split in the accounts
+    they point to, and each match is checked against the account the split is actually in.
+    Splits in other accounts, such as the bank account on the other side of each transaction,
+    are left out, as no rule could be right about them.
+
+    The splits are read in bulk, straight from the database, and counted by account and
+    description, so each description is only matched once per account however many splits
+    share it.  Each description is then only tried against the rules it could match (see
+    _PatternIndex), with the same result as the Matcher.
+
+    Usage:
+
+        for result in Backtester(config, book).run():
+            ...
+
+    Args:
+        config: Config object.
+        book: Book object.
+        account_names: Optional list of the uncategorized accounts whose rules to test (strings).
+                       Defaults to all of them.
+        start_date: Optional earliest post date of the splits to test against (date).
+        end_date: Optional latest post date of the splits to test against (date).
+
+    Raises:
+        AccountsNotFound, if any of the accounts are not in the book.
+    """
+    def __init__(self, config, book, account_names=None, start_date=None, end_date=None):
+        self._book = book
+        self._normalizer = config.get_normalizer()
+        self._matcher = Matcher(config, book=book)
+        self._account_names = account_names or self._matcher.get_uncategorized_account_names()
+        self._start_date = start_date
+        self._end_date = end_date
+
+    def run(self):
+        """Returns:
+            List of BacktestResults, one for each uncategorized account tested.
+        """
+        patterns_by_account_name = {account_name: self._matcher.get_patterns(account_name)
+                                    for account_name in self._account_names}
+        target_account_guids = {pattern.account.guid
+                                for patterns in patterns_by_account_name.values() for pattern in patterns}
+        split_counts = Counter(
+            (row.account_guid, row.description or '')
+            for row in self._book.get_split_rows(account_guids=sorted(target_account_guids),
+                                                 start_date=self._start_date, end_date=self._end_date)
+        )
+        split_counts_by_account_guid = Counter()
+        for (account_guid, _), count in split_counts.items():
+            split_counts_by_account_guid[account_guid] += count
+
+        return [self._test_rules(account_name, patterns, split_counts, split_counts_by_account_guid)
+                for account_name, patterns in patterns_by_account_name.items()]
+
+    def _test_rules(self, account_name, patterns, split_counts, split_counts_by_account_guid):
+        """Tries the rules for one uncategorized account against the splits in the accounts they point to.
+
+        Args:
+            account_name: Full name of the uncategorized account (string).
+            patterns: List of the account's MatchPatterns, bound to the book.
+            split_counts: Counter of splits, keyed by (account guid, description) two-tuples.
+            split_counts_by_account_guid: Counter of splits, keyed by account guid.
+
+        Returns:
+            BacktestResult.
+        """
+        rule_results = [RuleResult(pattern, split_counts_by_account_guid[pattern.account.guid])
+                        for pattern in patterns]
+        rule_results_by_pattern = {}
+        for rule_result in rule_results:
+            rule_results_by_pattern.setdefault(rule_result.match_pattern, rule_result)
+        target_account_guids = {pattern.account.guid for pattern in patterns}
+        pattern_index = _PatternIndex(patterns)
+
+        split_count = 0
+        for (account_guid, description), count in split_counts.items():
+            if account_guid not in target_account_guids:
+                continue
+            split_count += count
+            match_pattern = pattern_index.get_match(self._normalizer.normalize(description))
+            if match_pattern is None:
+                continue
+            rule_result = rule_results_by_pattern[match_pattern]
+            rule_result.matched_count += count
+            if account_guid == match_pattern.account.guid:
+                rule_result.correct_count += count
+            else:
+                rule_result.wrong_account_counts[account_guid] += count
+        return BacktestResult(account_name, rule_results, split_count)
+
+
+class _PatternIndex:
+    """The patterns for one uncategorized account, in a trie of their literal prefixes (see
+    MatchPattern.literal_prefix), so that each description is only tried against the patterns
+    whose literal prefix it starts with, rather than all of them.
+
+    The patterns are still tried in order of precedence, so the first match is the same as the Matcher's.
+
+    Args:
+        patterns: List of MatchPatterns, in order of precedence.
+    """
+    # The key in each node of the trie for the positions of the patterns whose literal prefix ends there
+    _POSITIONS = None
+
+    def __init__(self, patterns):
+        self._patterns = patterns
+        self._root = {}
+        for position, pattern in enumerate(patterns):
+            node = self._root
+            for character in pattern.literal_prefix:
+                node = node.setdefault(character, {})
+            node.setdefault(self._POSITIONS, []).append(position)
+
+    def get_match(self, normalized_description):
+        """Returns:
+            The first MatchPattern that matches the normalized description, or None.
+        """
+        node = self._root
+        positions = list(node.get(self._POSITIONS, ()))
+        for character in normalized_description:
+            node = node.get(character)
+            if node is None:
+                break
+            positions.extend(node.get(self._POSITIONS, ()))
+        for position in sorted(positions):
+            if self._patterns[position].is_match(normalized_description):
+                return self._patterns[position]
+        return None
@@ -1,32 +1,87 @@
+import hashlib
+import re
+from collections import defaultdict, namedtuple
+from fractions import Fraction
 import piecash
-from moneyed import Money, GBP
-from builtins import NotImplementedError
+from sqlalchemy import event, select, and_
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import contains_eager, object_session
+from moneyed import Money, Currency, get_currency
+from moneyed.classes import CurrencyDoesNotExist
+
+
+# A lightweight copy of a split's data, read without loading the split into the session
+SplitRow = namedtuple('SplitRow', ['guid', 'account_guid', 'date', 'value', 'description'])
+# All the data of a split needed to make a snapshot of the book (see SnapshotBook), with the
+# value and quantity as they are stored: a numerator and denominator each
+SnapshotRow = namedtuple('SnapshotRow', ['transaction_guid', 'guid', 'account_guid', 'date', 'value_num',
+                                         'value_denom', 'quantity_num', 'quantity_denom', 'description'])
 
 
 class Book:
     """Adapter for the entire account GnuCash book.
+
+    The book may be an SQLite file, or a database on a server, such as PostgreSQL or MySQL,
+    given by its SQLAlchemy URI, e.g. 'postgresql://user@localhost/accounts'.
+
+    Args:
+        filename: The filename and path to the Gnucash accounts file, or the URI of its database (string).
+        read_only: Whether to open the book just for reading, for commands that do not save changes to it
+                   (boolean).  Read only books are not backed up, and can be read while GnuCash has them open.
     """
     # The character used to separate account names when specifying the full account name
     ACCOUNT_NAME_SEPARATOR = ':'
+    # The maximum number of guids to put in a single IN clause
+    GUIDS_PER_QUERY = 500
+    # Options for the connection pool of books on database servers: connections are checked before
+    # they are used, and replaced after an hour, so that a long running command survives the server
+    # closing idle connections.
+    POOL_OPTIONS = {'pool_pre_ping': True, 'pool_recycle': 3600}
 
-    def __init__(self, filename):
+    def __init__(self, filename, read_only=False):
+        # Whether changes can be saved to the book
+        self.read_only = read_only
         self._load_from_file(filename)
 
     def _load_from_file(self, filename):
-        """Opens and initializes the Gnucash file.
+        """Opens and initializes the Gnucash file or database.
         """
-        self._piecash_book = piecash.open_book(filename, readonly=False)
+        is_uri = is_database_uri(filename)
+        is_server = is_uri and make_url(filename).get_backend_name() != 'sqlite'
+        options = {'uri_conn': filename} if is_uri else {'sqlite_file': filename}
+        if is_server:
+            options.update(self.POOL_OPTIONS)
+        if self.read_only:
+            self._piecash_book = piecash.open_book(readonly=True, open_if_lock=True, do_backup=False, **options)
+        elif is_server:
+            # piecash can only back up SQLite files, so back up server databases with their own tools.
+            self._piecash_book = piecash.open_book(readonly=False, do_backup=False, **options)
+        else:
+            self._piecash_book = piecash.open_book(readonly=False, **options)
+        self._currencies_by_account_guid = None
+
+    def refresh(self):
+        """Discards any unsaved changes, so that the book is read again from the database
+        the next time it is used, picking up any changes made by other programs.
+        """
+        self._piecash_book.session.rollback()
+
+    def listen_for_statements(self, callback):
+        """Calls the callback, with no arguments, each time an SQL statement is run against the book.
+        """
+        event.listen(self._piecash_book.session.get_bind(), 'before_cursor_execute',
+                     lambda *args, **kwargs: callback())
 
     def get_accounts(self, account_names):
         """Args:
             account_names: list of account names, e.g. 'Equity:Opening Balances'
         Returns:
-            Account object.
+            List of Account objects, in the same order.
+        Raises:
+            AccountsNotFound, listing every name that is not in the book.
         """
-        accounts = []
-        for name in account_names:
-            accounts.append(self.get_account(name))
-        return accounts
+        accounts_by_name = self.get_accounts_by_name(account_names)
+        return [accounts_by_name[name] for name in account_names]
 
     def get_account(self, name):
         """Gets an Account by colon-separated name.
@@ -34,9 +89,57 @@ class Book:
             name: the name of the account, e.g. 'Equity:Opening Balances'
         Returns:
             Account object.
+        Raises:
+            AccountsNotFound, if there is no account with that name.
+        """
+        try:
+            piecash_account = self._get_piecash_account_from_name(name)
+        except ValueError:
+            raise AccountsNotFound([name])
+        return Account(piecash_account, currency=self.get_currencies_by_account_guid().get(piecash_account.guid))
+
+    def get_accounts_by_name(self, account_names):
+        """Gets several accounts at once, reading all the accounts in the book in a single query
+        rather than walking down the account tree for each name.
+
+        Args:
+            account_names: iterable of account names, e.g. 'Equity:Opening Balances'
+        Returns:
+            Dictionary of Account objects, keyed by account name.
+        Raises:
+            AccountsNotFound, listing every name that is not in the book.
+        """
+        account_names = set(account_names)
+        currencies_by_account_guid = self.get_currencies_by_account_guid()
+        accounts_by_name = {}
+        for piecash_account in self._piecash_book.accounts:
+            name = piecash_account.fullname
+            if name in account_names:
+                accounts_by_name[name] = Account(piecash_account,
+                                                 currency=currencies_by_account_guid.get(piecash_account.guid))
+        missing_account_names = account_names - set(accounts_by_name)
+        if missing_account_names:
+            raise AccountsNotFound(missing_account_names)
+        return accounts_by_name
+
+    def get_currencies_by_account_guid(self):
+        """Gets the currency of every account, looking up all the accounts' commodities in a single
+        query the first time it is called.
+
+        Returns:
+            Dictionary of moneyed Currency objects, keyed by account guid.
         """
-        piecash_account = self._get_piecash_account_from_name(name)
-        return Account(piecash_account)
+        if self._currencies_by_account_guid is None:
+            accounts = piecash.Account.__table__
+            commodities = piecash.Commodity.__table__
+            query = select([accounts.c.guid, commodities.c.mnemonic]).select_from(
+                accounts.join(commodities, accounts.c.commodity_guid == commodities.c.guid)
+            )
+            self._currencies_by_account_guid = {
+                account_guid: get_currency_for_commodity(mnemonic)
+                for account_guid, mnemonic in self._piecash_book.session.execute(query)
+            }
+        return self._currencies_by_account_guid
 
     def _get_piecash_account_from_name(self, name):
         """Args:
@@ -67,10 +170,314 @@ class Book:
             splits.extend(account.splits)
         return splits
 
+    def get_split_chunks_from_accounts(self, accounts, chunk_size, release=False, split_filter=None):
+        """Gets any splits that are assigned to any of the supplied list of accounts,
+        loading them from the database a chunk at a time.
+
+        Args:
+            accounts: List of Account objects.
+            chunk_size: The maximum number of splits in each chunk (integer).
+            release: Whether to release the database objects once each chunk has been
+                     loaded (see Account.get_split_chunks).
+            split_filter: Optional SplitFilter; only the splits it matches are loaded.
+
+        Yields:
+            Lists of Split objects.
+        """
+        for account in accounts:
+            yield from account.get_split_chunks(chunk_size, release=release, split_filter=split_filter)
+
+    def get_split_rows(self, account_guids=None, exclude_account_guids=None, start_date=None, end_date=None):
+        """Gets the data of splits in bulk, straight from the database, streamed using a server-side
+        cursor where the database supports it.
+
+        Args:
+            account_guids: Optional list of account guids; if given, only splits in these accounts are included.
+            exclude_account_guids: Optional list of account guids to leave out.
+            start_date: Optional earliest post date to include (date).
+            end_date: Optional latest post date to include (date).
+
+        Yields:
+            SplitRow named tuples, with the value as a Fraction.
+        """
+        splits = piecash.Split.__table__
+        transactions = piecash.Transaction.__table__
+        conditions = []
+        if account_guids is not None:
+            conditions.append(splits.c.account_guid.in_(account_guids))
+        if exclude_account_guids:
+            conditions.append(splits.c.account_guid.notin_(exclude_account_guids))
+        if start_date is not None:
+            conditions.append(transactions.c.post_date >= start_date)
+        if end_date is not None:
+            conditions.append(transactions.c.post_date <= end_date)
+        query = select([
+            splits.c.guid, splits.c.account_guid, transactions.c.post_date,
+            splits.c.value_num, splits.c.value_denom, transactions.c.description,
+        ]).select_from(
+            splits.join(transactions, splits.c.tx_guid == transactions.c.guid)
+        )
+        for condition in conditions:
+            query = query.where(condition)
+
+        rows = self._piecash_book.session.execute(query.execution_options(stream_results=True))
+        for guid, account_guid, post_date, value_num, value_denom, description in rows:
+            yield SplitRow(guid=guid, account_guid=account_guid, date=post_date,
+                           value=Fraction(value_num, value_denom), description=description)
+
+    def get_snapshot_rows(self):
+        """Gets the data of every split in the book in bulk, straight from the database, with the
+        splits of each transaction together.  The rows are streamed in the same way as get_split_rows.
+
+        Yields:
+            SnapshotRow named tuples.
+        """
+        splits = piecash.Split.__table__
+        transactions = piecash.Transaction.__table__
+        query = select([
+            transactions.c.guid, splits.c.guid, splits.c.account_guid, transactions.c.post_date,
+            splits.c.value_num, splits.c.value_denom, splits.c.quantity_num, splits.c.quantity_denom,
+            transactions.c.description,
+        ]).select_from(
+            splits.join(transactions, splits.c.tx_guid == transactions.c.guid)
+        ).order_by(splits.c.tx_guid).execution_options(stream_results=True)
+        for row in self._piecash_book.session.execute(query):
+            yield SnapshotRow(*row)
+
+    def get_account_names_by_guid(self):
+        """Returns:
+            Dictionary of the full names of all the accounts in the book, keyed by guid.
+        """
+        return {piecash_account.guid: piecash_account.fullname for piecash_account in self._piecash_book.accounts}
+
+    def get_fingerprint(self, account_guids):
+        """Gets a fingerprint of the splits in the supplied accounts, which will change if any
+        of the splits are added, removed, moved or edited.
+
+        Args:
+            account_guids: List of account guids (strings).
+
+        Returns:
+            Hex digest (string).
+        """
+        splits = piecash.Split.__table__
+        transactions = piecash.Transaction.__table__
+        query = select([
+            splits.c.guid, splits.c.account_guid, splits.c.value_num, splits.c.value_denom,
+            transactions.c.description,
+        ]).select_from(
+            splits.join(transactions, splits.c.tx_guid == transactions.c.guid)
+        ).where(
+            splits.c.account_guid.in_(account_guids)
+        ).order_by(splits.c.guid).execution_options(stream_results=True)
+
+        rows = self._piecash_book.session.execute(query)
+        return fingerprint_rows(
+            (split_guid, account_guid, Fraction(value_num, value_denom), description)
+            for split_guid, account_guid, value_num, value_denom, description in rows
+        )
+
+    def update_split_accounts(self, changes):
+        """Moves splits to new accounts, all in a single database transaction.
+
+        The changes are grouped by account, and made with set based UPDATE statements
+        directly on the splits table, rather than loading and saving each split.
+        Each split is only moved if it is still in the account it is expected to be in.
+        As the UPDATE statements do not convert the splits' quantities, splits can only be moved
+        between accounts in the same currency or other commodity.
+
+        Args:
+            changes: Iterable of three-tuples of guids (strings):
+                - The split to move.
+                - The account the split is expected to be in.
+                - The account to move the split to.
+
+        Raises:
+            UnexpectedRowCount, if not every split could be moved; none of the changes will have been made.
+            CommodityMismatch, if any of the splits would be moved to an account in a different commodity;
+            none of the changes will have been made.
+        """
+        split_guids_by_accounts = defaultdict(list)
+        for split_guid, old_account_guid, new_account_guid in changes:
+            split_guids_by_accounts[(old_account_guid, new_account_guid)].append(split_guid)
+        self._check_commodities(split_guids_by_accounts)
+
+        session = self._piecash_book.session
+        splits = piecash.Split.__table__
+        expected_count, actual_count = 0, 0
+        try:
+            for (old_account_guid, new_account_guid), split_guids in split_guids_by_accounts.items():
+                for start in range(0, len(split_guids), self.GUIDS_PER_QUERY):
+                    chunk = split_guids[start:start + self.GUIDS_PER_QUERY]
+                    statement = splits.update().where(
+                        and_(splits.c.guid.in_(chunk), splits.c.account_guid == old_account_guid)
+                    ).values(account_guid=new_account_guid)
+                    expected_count += len(chunk)
+                    actual_count += session.execute(statement).rowcount
+            if actual_count != expected_count:
+                raise UnexpectedRowCount('Expected to move {} splits, but {} could be moved.'.format(
+                    expected_count, actual_count))
+        except Exception:
+            session.rollback()
+            raise
+        self._piecash_book.save()
+
+    def _check_commodities(self, account_guid_pairs):
+        """Args:
+            account_guid_pairs: Iterable of two-tuples of the guids of the accounts splits are to be moved
+                                from and to (strings).
+        Raises:
+            CommodityMismatch, if any of the pairs of accounts are in different commodities.
+        """
+        currencies_by_account_guid = self.get_currencies_by_account_guid()
+        mismatched_pairs = [
+            (old_account_guid, new_account_guid) for old_account_guid, new_account_guid in account_guid_pairs
+            if currencies_by_account_guid.get(old_account_guid) != currencies_by_account_guid.get(new_account_guid)
+        ]
+        if mismatched_pairs:
+            account_names_by_guid = self.get_account_names_by_guid()
+            raise CommodityMismatch('Splits cannot be moved between accounts in different commodities: {}.'.format(
+                ', '.join('{} to {}'.format(account_names_by_guid.get(old_account_guid, old_account_guid),
+                                            account_names_by_guid.get(new_account_guid, new_account_guid))
+                          for old_account_guid, new_account_guid in sorted(mismatched_pairs))))
+
+
+def is_database_uri(location):
+    """Returns:
+        Whether the location of a book is the URI of a database, e.g. 'postgresql://localhost/accounts',
+        rather than a filename (boolean).
+    """
+    return re.match(r'[a-z][a-z0-9+.-]*://', location, re.IGNORECASE) is not None
+
+
+def get_currency_for_commodity(mnemonic):
+    """Args:
+        mnemonic: The mnemonic of a GnuCash commodity, e.g. 'EUR' (string).
+    Returns:
+        The moneyed Currency, or a new Currency if the commodity is not a known currency, e.g. shares.
+    """
+    try:
+        return get_currency(mnemonic)
+    except CurrencyDoesNotExist:
+        return Currency(code=mnemonic)
+
+
+class SplitFilter:
+    """Narrows down which uncategorized splits are loaded and matched.  Each limit is optional.
+
+    Book turns the dates and description pattern into conditions in the query that loads the
+    splits, so the splits that are left out are never read from the database.
+
+    Args:
+        account_names: Optional list of the uncategorized accounts to load splits from (strings).
+        start_date: Optional earliest post date to include (date).
+        end_date: Optional latest post date to include (date).
+        description_like: Optional pattern the description must match, as in SQL LIKE: '%' matches
+                          any number of characters and '_' a single character, ignoring case (string).
+    """
+    def __init__(self, account_names=None, start_date=None, end_date=None, description_like=None):
+        self.account_names = account_names
+        self.start_date = start_date
+        self.end_date = end_date
+        self.description_like = description_like
+        self._description_regex = None
+
+    def filter_accounts(self, accounts):
+        """Args:
+            accounts: List of the uncategorized accounts.
+        Returns:
+            List of the accounts to load splits from, in the same order.
+        Raises:
+            AccountsNotFound, if any of the account names are not among the accounts.
+        """
+        if self.account_names is None:
+            return accounts
+        filtered_accounts = [account for account in accounts if account.name in self.account_names]
+        missing_account_names = set(self.account_names) - {account.name for account in filtered_accounts}
+        if missing_account_names:
+            raise AccountsNotFound(missing_account_names)
+        return filtered_accounts
+
+    def matches(self, date, description):
+        """Checks a split against the dates and description pattern, for books that cannot
+        filter the splits as they are read.
+
+        Args:
+            date: The post date of the split's transaction (date).
+            description: The description of the split's transaction (string).
+
+        Returns:
+            Whether the split should be included (boolean).
+        """
+        if self.start_date is not None and date < self.start_date:
+            return False
+        if self.end_date is not None and date > self.end_date:
+            return False
+        if self.description_like is not None:
+            return self._get_description_regex().fullmatch(description or '') is not None
+        return True
+
+    def _get_description_regex(self):
+        """Returns:
+            Compiled regular expression equivalent to the LIKE pattern.
+        """
+        if self._description_regex is None:
+            wildcards = {'%': '.*', '_': '.'}
+            regex = ''.join(wildcards.get(character, re.escape(character)) for character in self.description_like)
+            self._description_regex = re.compile(regex, re.IGNORECASE | re.DOTALL)
+        return self._description_regex
+
+
+class AccountsNotFound(Exception):
+    """Raised when some of the accounts asked for are not in the book.
+
+    Args:
+        account_names: the names that could not be found (iterable of strings).
+    """
+    def __init__(self, account_names):
+        self.account_names = sorted(account_names)
+        super().__init__('Could not find accounts: {}.'.format(', '.join(self.account_names)))
+
+
+class UnexpectedRowCount(Exception):
+    """Raised when a bulk update to the book would not have changed the expected number of rows.
+    """
+    pass
+
+
+class CommodityMismatch(Exception):
+    """Raised when splits would be moved to an account in a different currency or other commodity.
+    """
+    pass
+
+
+def fingerprint_rows(rows):
+    """Gets a fingerprint of some rows of split data, to detect if any of the splits change.
+
+    Args:
+        rows: Iterable of (split guid, account guid, value, description) four-tuples, in guid order.
+              The value may be a Fraction or anything Fraction accepts, e.g. '3000/100'.
+
+    Returns:
+        Hex digest (string).
+    """
+    fingerprint = hashlib.sha1()
+    for split_guid, account_guid, value, description in rows:
+        row = '\x1f'.join([split_guid, account_guid, str(Fraction(value)), description or ''])
+        fingerprint.update(row.encode('utf-8'))
+        fingerprint.update(b'\n')
+    return fingerprint.hexdigest()
+
 
 class Account:
-    def __init__(self, piecash_account):
+    """Args:
+        piecash_account: piecash.Account object.
+        currency: Optional moneyed Currency of the account, if already known.  Otherwise it
+                  is looked up from the account's commodity when needed.
+    """
+    def __init__(self, piecash_account, currency=None):
         self._piecash_account = piecash_account
+        self._currency = currency
 
     @property
     def splits(self):
@@ -85,12 +492,94 @@ class Account:
             splits.append(split)
         return splits
 
+    def get_split_chunks(self, chunk_size, release=False, split_filter=None):
+        """Gets the splits that are assigned to the account, a chunk at a time.
+
+        The splits are streamed from the database using a server-side cursor where the
+        database supports it, and each split's transaction is loaded in the same query,
+        so reading the date or description of the splits does not go back to the database.
+        The other splits in the transactions, and their accounts, are loaded in one further
+        query per chunk, so the splits are grouped by transaction in a single pass.
+
+        Args:
+            chunk_size: The maximum number of splits in each chunk (integer).
+            release: Whether to release the database objects once each chunk has been
+                     loaded, so that the database session does not grow with the size of the
+                     account.  The splits keep a copy of their data (see Split.release).
+            split_filter: Optional SplitFilter, whose dates and description pattern are added
+                          to the query.
+
+        Yields:
+            Lists of Split objects.
+        """
+        session = self._get_session()
+        query = session.query(piecash.Split).join(piecash.Split.transaction).filter(
+            piecash.Split.account == self._piecash_account
+        ).options(
+            contains_eager(piecash.Split.transaction).selectinload(
+                piecash.Transaction.splits
+            ).joinedload(piecash.Split.account)
+        ).execution_options(stream_results=True)
+        if split_filter is not None:
+            if split_filter.start_date is not None:
+                query = query.filter(piecash.Transaction.post_date >= split_filter.start_date)
+            if split_filter.end_date is not None:
+                query = query.filter(piecash.Transaction.post_date <= split_filter.end_date)
+            if split_filter.description_like is not None:
+                query = query.filter(piecash.Transaction.description.ilike(split_filter.description_like))
+
+        chunk = []
+        for piecash_split in query.yield_per(chunk_size):
+            chunk.append(Split(piecash_split, account=self))
+            if len(chunk) == chunk_size:
+                yield self._finish_chunk(chunk, session, release)
+                chunk = []
+        if chunk:
+            yield self._finish_chunk(chunk, session, release)
+
+    def _finish_chunk(self, chunk, session, release):
+        """Args:
+            chunk: List of Split objects.
+            session: The SQLAlchemy session the splits were loaded from.
+            release: Whether to release the database objects of the splits.
+        Returns:
+            The chunk.
+        """
+        if release:
+            for split in chunk:
+                split.release(session)
+        return chunk
+
+    def _get_session(self):
+        """Returns:
+            The SQLAlchemy session the account belongs to.
+        """
+        return object_session(self._piecash_account)
+
+    @property
+    def guid(self):
+        return self._piecash_account.guid
+
+    @property
+    def currency(self):
+        """Returns:
+            The moneyed Currency of the account.
+        """
+        if self._currency is None:
+            self._currency = get_currency_for_commodity(self._piecash_account.commodity.mnemonic)
+        return self._currency
+
     @property
     def name(self):
         """Returns:
             The full name of the account.
         """
-        return self._piecash_account.fullname
+        # The full name is built by walking up the parent accounts, so only do it once.
+        try:
+            return self._name
+        except AttributeError:
+            self._name = self._piecash_account.fullname
+            return self._name
 
     def __str__(self):
         return self.name
@@ -109,6 +598,8 @@ class Split:
     def __init__(self, piecash_split, account):
         self._piecash_split = piecash_split
         self._account = account
+        # A copy of the split's data, once it has been released
+        self._released_data = None
 
     @property
     def account(self):
@@ -117,24 +608,96 @@ class Split:
         """
         return self._account
 
+    @property
+    def guid(self):
+        if self._released_data:
+            return self._released_data['guid']
+        return self._piecash_split.guid
+
     @property
     def date(self):
+        if self._released_data:
+            return self._released_data['date']
         return self._piecash_split.transaction.post_date
 
     @property
     def description(self):
+        if self._released_data:
+            return self._released_data['description']
         return self._piecash_split.transaction.description
 
+    @property
+    def opposite_account(self):
+        """The account on the other side of the transaction.
+
+        Returns:
+            Account object.
+        Raises:
+            OppositeAccountNotDetermined, if the other splits in the transaction are not all in the same account.
+        """
+        other_split_accounts = self._get_other_split_accounts()
+        if len({account.guid for account in other_split_accounts}) != 1:
+            raise OppositeAccountNotDetermined
+        return other_split_accounts[0]
+
+    def _get_other_split_accounts(self):
+        """Returns:
+            List of the Accounts of the other splits in the split's transaction.
+        """
+        if self._released_data:
+            return self._released_data['other_split_accounts']
+        piecash_split = self._piecash_split
+        return [Account(other.account) for other in piecash_split.transaction.splits
+                if other.guid != piecash_split.guid]
+
     @property
     def amount(self):
-        # TODO - check currency
-        return Money(self._piecash_split.value, GBP)
+        """Returns:
+            The amount of the split, in the currency of its account (Money).
+        """
+        if self._released_data:
+            quantity = self._released_data['quantity']
+        else:
+            quantity = self._piecash_split.quantity
+        return Money(quantity, self._account.currency)
+
+    def release(self, session):
+        """Keeps a copy of the data needed from the split, and removes the split and its transaction
+        from the session, so they can be garbage collected.  The split is loaded again if it is updated.
+
+        Args:
+            session: The SQLAlchemy session the split was loaded from.
+        """
+        piecash_split = self._piecash_split
+        piecash_transaction = piecash_split.transaction
+        self._released_data = {
+            'guid': piecash_split.guid,
+            'date': piecash_transaction.post_date,
+            'description': piecash_transaction.description,
+            'quantity': piecash_split.quantity,
+            'other_split_accounts': self._get_other_split_accounts(),
+        }
+        self._piecash_split = None
+        # The transaction may already have been released with another of its splits
+        for instance in (piecash_split, piecash_transaction):
+            if instance in session:
+                session.expunge(instance)
 
     def update_account(self, account):
         """Saves the split with the new account.
         Args:
             account: Account object.
         """
+        piecash_split = self._get_piecash_split()
         # TODO - should not use a private property
-        self._piecash_split.account = account._piecash_account
-        self._piecash_split.book.save()
+        piecash_split.account = account._piecash_account
+        piecash_split.book.save()
+
+    def _get_piecash_split(self):
+        """Returns:
+            The piecash.Split, loading it again if it was released.
+        """
+        if self._released_data:
+            session = self._account._get_session()
+            return session.query(piecash.Split).filter(piecash.Split.guid == self.guid).one()
+        return self._piecash_split
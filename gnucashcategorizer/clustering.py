@@ -0,0 +1,178 @@
+from collections import Counter
+from decimal import Decimal
+from .config import MatchPattern
+
+
+class Cluster:
+    """Transactions without suggestions whose descriptions share a literal prefix, with a pattern
+    proposed to match them all.
+
+    Args:
+        pattern: The proposed pattern, which matches every normalized description in the cluster (string).
+        descriptions: Dictionary of the _DescriptionGroups in the cluster, keyed by normalized description.
+    """
+    def __init__(self, pattern, descriptions):
+        self.pattern = pattern
+        self.descriptions = sorted(descriptions, key=lambda description: descriptions[description].split_count,
+                                   reverse=True)
+        self.split_count = 0
+        # The total amount of the splits for each currency code, and the size of all of them, to rank by
+        self._total_amounts = {}
+        self.absolute_total = Decimal(0)
+        # The number of splits in each uncategorized account
+        self.account_name_counts = Counter()
+        for description in self.descriptions:
+            description_group = descriptions[description]
+            self.split_count += description_group.split_count
+            self.absolute_total += description_group.absolute_total
+            self.account_name_counts.update(description_group.account_name_counts)
+            for currency_code, amount in description_group.total_amounts.items():
+                self._total_amounts[currency_code] = self._total_amounts.get(currency_code, 0) + amount
+
+    @property
+    def total_amounts(self):
+        """Returns:
+            List of the total amount of the splits in each currency (Money), starting with the currency
+            of the most common description.
+        """
+        return list(self._total_amounts.values())
+
+    def __repr__(self):
+        return "{cls}(pattern='{pattern}', split_count={split_count})".format(
+            cls=self.__class__.__name__, pattern=self.pattern, split_count=self.split_count)
+
+
+class DescriptionClusterer:
+    """Groups the transactions that no rule matched into clusters of similar descriptions, so that
+    the next rules to write are the ones that would categorize the most transactions.
+
+    The descriptions are normalized in the same way as for matching, and the splits counted by
+    normalized description in one pass.  Each distinct description is then added, word by word,
+    to a trie, which is walked once to cluster them.  Wherever the trie forks into branches of
+    more than one word, such as 'DD BRITISH GAS' and 'DD COUNCIL TAX', the branches are clustered
+    separately.  Only descriptions that differ in just their last word, such as the store or
+    reference at the end of 'CARD PAYMENT TO TESCO 1234', are clustered together, under the words
+    they share followed by a wildcard.  Even then, the words they share must be at least
+    MIN_PREFIX_WORDS words and MIN_PREFIX_LENGTH characters long, so that no catch-all pattern
+    such as 'DD *' is proposed; otherwise each description is a cluster of its own.
+
+    Each split and each character of each distinct description is only visited a fixed number of
+    times, so the clustering takes time in proportion to the number of splits.
+
+    Usage:
+
+        clusters = DescriptionClusterer(config.get_normalizer()).get_clusters(splits)
+
+    Args:
+        normalizer: DescriptionNormalizer to normalize the descriptions with.
+    """
+    # The key in each node of the trie for the description that ends there
+    _DESCRIPTION = None
+    # How long the words shared by a cluster's descriptions must be to propose a wildcard pattern for them
+    MIN_PREFIX_WORDS = 2
+    MIN_PREFIX_LENGTH = 8
+
+    def __init__(self, normalizer):
+        self._normalizer = normalizer
+
+    def get_clusters(self, splits):
+        """Args:
+            splits: Iterable of Splits, e.g. from Suggester.get_splits_without_suggestions.
+        Returns:
+            List of Clusters, ranked by number of splits and then by total amount, largest first.
+        """
+        description_groups = {}
+        for split in splits:
+            normalized_description = self._normalizer.normalize(split.description or '')
+            try:
+                description_group = description_groups[normalized_description]
+            except KeyError:
+                description_group = description_groups[normalized_description] = _DescriptionGroup()
+            description_group.add(split)
+
+        root = {}
+        for normalized_description in description_groups:
+            node = root
+            for word in normalized_description.split(' '):
+                node = node.setdefault(word, {})
+            node[self._DESCRIPTION] = normalized_description
+
+        clusters = []
+        branches = [([word], node) for word, node in root.items()]
+        while branches:
+            words, node = branches.pop()
+            clusters.extend(self._get_clusters_for_branch(words, node, description_groups, branches))
+        return sorted(clusters, key=lambda cluster: (cluster.split_count, cluster.absolute_total), reverse=True)
+
+    def _get_clusters_for_branch(self, words, node, description_groups, branches):
+        """Follows a branch of the trie down to where it forks or ends.
+
+        Args:
+            words: The words on the way to the branch's node (list of strings).
+            node: The node of the trie the branch starts at.
+            description_groups: Dictionary of _DescriptionGroups, keyed by normalized description.
+            branches: List of the (words, node) branches still to be clustered, to add the branches
+                      below a fork to.
+        Returns:
+            List of the Clusters made at the end of the branch.
+        """
+        while len(node) == 1 and self._DESCRIPTION not in node:
+            [(word, node)] = node.items()
+            words = words + [word]
+        prefix = ' '.join(words)
+        children = {word: child for word, child in node.items() if word is not self._DESCRIPTION}
+
+        if not children:
+            description = node[self._DESCRIPTION]
+            return [Cluster(escape_pattern(description), {description: description_groups[description]})]
+
+        if self._is_clusterable(prefix, words, children):
+            descriptions = {child[self._DESCRIPTION]: description_groups[child[self._DESCRIPTION]]
+                            for child in children.values()}
+            if self._DESCRIPTION in node:
+                # One of the descriptions is just the prefix, so the wildcard has to match nothing too
+                descriptions[node[self._DESCRIPTION]] = description_groups[node[self._DESCRIPTION]]
+                return [Cluster(escape_pattern(prefix) + '*', descriptions)]
+            return [Cluster(escape_pattern(prefix) + ' *', descriptions)]
+
+        branches.extend((words + [word], child) for word, child in children.items())
+        if self._DESCRIPTION in node:
+            description = node[self._DESCRIPTION]
+            return [Cluster(escape_pattern(description), {description: description_groups[description]})]
+        return []
+
+    def _is_clusterable(self, prefix, words, children):
+        """Returns:
+            Whether the descriptions below a fork only differ in their last word, and share enough
+            words to propose a wildcard pattern for them.
+        """
+        return (len(words) >= self.MIN_PREFIX_WORDS and len(prefix) >= self.MIN_PREFIX_LENGTH
+                and all(list(child) == [self._DESCRIPTION] for child in children.values()))
+
+
+class _DescriptionGroup:
+    """The splits with the same normalized description.
+    """
+    def __init__(self):
+        self.split_count = 0
+        # The total amount of the splits, keyed by currency code
+        self.total_amounts = {}
+        self.absolute_total = Decimal(0)
+        self.account_name_counts = Counter()
+
+    def add(self, split):
+        amount = split.amount
+        self.split_count += 1
+        self.total_amounts[amount.currency.code] = self.total_amounts.get(amount.currency.code, 0) + amount
+        self.absolute_total += abs(amount.amount)
+        self.account_name_counts[str(split.account)] += 1
+
+
+def escape_pattern(text):
+    """Args:
+        text: Text for a pattern to match literally (string).
+    Returns:
+        Pattern that only matches the text (string).
+    """
+    return ''.join('[{}]'.format(character) if character in MatchPattern.WILDCARDS else character
+                   for character in text)
@@ -1,10 +1,26 @@
-from argparse import ArgumentParser
-from moneyed import GBP
+import sys
+from argparse import ArgumentParser, ArgumentTypeError
+from datetime import date
+from decimal import Decimal
+from moneyed import Money, GBP, EUR, USD
 from moneyed.localization import (format_money, _format as set_money_format,
                                   _sign as set_currency_sign)
 from .config import Config
-from .book import Book
+from .book import Book, AccountsNotFound, CommodityMismatch, SplitFilter, UnexpectedRowCount, is_database_uri
+from .snapshot import SnapshotBook
+from .xmlbook import XmlBook
 from gnucashcategorizer.suggester import Suggester
+from .plan import Plan, PlanEntry, BookChanged
+from .journal import Journal, RunNotFound
+from .watcher import Watcher
+from .server import make_server
+from .duplicates import DuplicateDetector
+from .review import review_suggestions
+from .metrics import RunMetrics, time_phase
+from .matcher import Matcher
+from .backtest import Backtester
+from .clustering import DescriptionClusterer
+from .statements import StatementAnnotator, InvalidStatement
 from decimal import ROUND_HALF_UP
 from termcolor import colored, cprint
 
@@ -13,7 +29,14 @@ set_money_format('en_GB', group_size=3, group_separator=",", decimal_point=".",
                  positive_sign="", trailing_positive_sign="",
                  negative_sign="-", trailing_negative_sign="",
                  rounding_method=ROUND_HALF_UP)
-set_currency_sign('en_GB', GBP, prefix='£')
+# Other currencies are shown with their code, e.g. '10.00 CHF'
+CURRENCY_PREFIXES = [
+    (GBP, '£'),
+    (EUR, '€'),
+    (USD, 'US$'),
+]
+for currency, prefix in CURRENCY_PREFIXES:
+    set_currency_sign('en_GB', currency, prefix=prefix)
 
 
 class CommandOptions:
@@ -21,11 +44,91 @@ class CommandOptions:
 
     Args:
         config_filename: The filename and path to the config yaml file (string).
-        book_filename: The filename and path to the Gnucash accounts file (string).
+        book_filename: The filename and path to the Gnucash accounts file, or the URI of its database (string).
+        memory_limit: Optional memory ceiling for the chunks of splits being loaded and matched, in megabytes
+                      (integer).
+        command: Which command to run, e.g. COMMAND_CATEGORIZE.
+        plan_filename: The filename and path to the plan file, for the plan and apply commands (string).
+        poll_interval: How often to check the book for changes in watch mode, in seconds (number).
+        host: The host name or address for the server to listen on (string).
+        port: The port for the server to listen on (integer).
+        skip_duplicates: Whether to leave likely duplicate transactions out of the suggestions (boolean).
+        review: Whether to let the user accept or reject each suggestion interactively (boolean).
+        account_names: Optional list of the uncategorized accounts to categorize (strings).
+        start_date: Optional earliest post date of the transactions to categorize (date).
+        end_date: Optional latest post date of the transactions to categorize (date).
+        description_like: Optional SQL LIKE pattern the descriptions to categorize must match (string).
+        run_id: The id of the run in the journal, for the undo command (string).
+        explain_sample: Optional fraction of the transactions to explain the matching of, between 0 and 1 (number).
+        metrics_filename: Optional filename and path to write metrics about the run to (string).
+        statement_account_name: The uncategorized account whose patterns to annotate a statement with (string).
+        statement_filename: The filename and path to the bank statement file to annotate (string).
+        annotated_filename: The filename and path to write the annotated statement to (string).
+        encoding: Optional text encoding of the statement file (string).
+        description_column: Optional name of the CSV column containing the descriptions (string).
+        snapshot_filename: The filename and path to write the snapshot of the book to (string).
+        cluster_limit: Optional number of the largest clusters to show, for the cluster command (integer).
     """
-    def __init__(self, config_filename, book_filename):
+    # Preview the suggestions, and save them if the user accepts them
+    COMMAND_CATEGORIZE = 'categorize'
+    # Preview the suggestions, and save them to a plan file
+    COMMAND_PLAN = 'plan'
+    # Apply a plan file to the book
+    COMMAND_APPLY = 'apply'
+    # Keep running, saving suggestions for new transactions whenever the book changes
+    COMMAND_WATCH = 'watch'
+    # Serve the matching over HTTP to other programs
+    COMMAND_SERVE = 'serve'
+    # Undo the changes saved by an earlier run
+    COMMAND_UNDO = 'undo'
+    # Categorize the transactions in a bank statement file before it is imported
+    COMMAND_ANNOTATE = 'annotate'
+    # Write a snapshot of the book, to run the other commands from without opening the book
+    COMMAND_SNAPSHOT = 'snapshot'
+    # Show what the rules would have done to the transactions that are already categorized
+    COMMAND_BACKTEST = 'backtest'
+    # Group the transactions without suggestions by description, with a pattern proposed for each group
+    COMMAND_CLUSTER = 'cluster'
+    COMMANDS = (COMMAND_CATEGORIZE, COMMAND_PLAN, COMMAND_APPLY, COMMAND_WATCH, COMMAND_SERVE, COMMAND_UNDO,
+                COMMAND_ANNOTATE, COMMAND_SNAPSHOT, COMMAND_BACKTEST, COMMAND_CLUSTER)
+    # The commands that save changes to the book; the others open it just for reading
+    WRITING_COMMANDS = (COMMAND_CATEGORIZE, COMMAND_APPLY, COMMAND_WATCH, COMMAND_UNDO)
+
+    def __init__(self, config_filename, book_filename, memory_limit=None,
+                 command=COMMAND_CATEGORIZE, plan_filename=None, poll_interval=None,
+                 host=None, port=None, skip_duplicates=False, review=False, account_names=None,
+                 start_date=None, end_date=None, description_like=None, run_id=None, explain_sample=None,
+                 metrics_filename=None, statement_account_name=None, statement_filename=None,
+                 annotated_filename=None, encoding=None, description_column=None, snapshot_filename=None,
+                 cluster_limit=None):
         self._config_filename = config_filename
         self._book_filename = book_filename
+        self.memory_limit = memory_limit
+        self.command = command
+        self.plan_filename = plan_filename
+        self.poll_interval = poll_interval
+        self.host = host
+        self.port = port
+        self.skip_duplicates = skip_duplicates
+        self.review = review
+        self.account_names = account_names
+        self.start_date = start_date
+        self.end_date = end_date
+        self.description_like = description_like
+        self.run_id = run_id
+        self.explain_sample = explain_sample
+        self.metrics_filename = metrics_filename
+        self.statement_account_name = statement_account_name
+        self.statement_filename = statement_filename
+        self.annotated_filename = annotated_filename
+        self.encoding = encoding
+        self.description_column = description_column
+        self.snapshot_filename = snapshot_filename
+        self.cluster_limit = cluster_limit
+
+    @property
+    def book_filename(self):
+        return self._book_filename
 
     def get_config(self):
         """Gets the Config object from the config filename.
@@ -35,13 +138,57 @@ class CommandOptions:
         """
         return Config(filename=self._config_filename)
 
+    def get_split_filter(self):
+        """Returns:
+            SplitFilter for the accounts, dates and description given, or None if none were given.
+        """
+        if (self.account_names, self.start_date, self.end_date, self.description_like) == (None, None, None, None):
+            return None
+        return SplitFilter(account_names=self.account_names, start_date=self.start_date,
+                           end_date=self.end_date, description_like=self.description_like)
+
+    def get_journal(self):
+        """Returns:
+            The Journal of the changes saved to the book.
+        """
+        return Journal.for_book(self._book_filename)
+
+    def get_metrics(self):
+        """Gets the RunMetrics to record the run in, counting the SQL statements run against the book
+        from then on.  The metrics are only made once.
+
+        Returns:
+            RunMetrics object, or None if no metrics filename was given.
+        """
+        if self.metrics_filename is None:
+            return None
+        try:
+            return self._metrics
+        except AttributeError:
+            self._metrics = RunMetrics()
+            self.get_book().listen_for_statements(self._metrics.count_statement)
+            return self._metrics
+
     def get_book(self):
-        """Gets the Book object from the book filename.
+        """Gets the Book object from the book filename.  The book is only opened once, and only
+        opened for writing by the commands that save changes to it.
 
         Returns:
-            Book object.
+            Book object, or SnapshotBook if the file is a snapshot, or XmlBook if it is in the XML format.
         """
-        return Book(filename=self._book_filename)
+        try:
+            return self._book
+        except AttributeError:
+            read_only = self.command not in self.WRITING_COMMANDS
+            if is_database_uri(self._book_filename):
+                self._book = Book(filename=self._book_filename, read_only=read_only)
+            elif SnapshotBook.is_snapshot_file(self._book_filename):
+                self._book = SnapshotBook(filename=self._book_filename)
+            elif XmlBook.is_xml_file(self._book_filename):
+                self._book = XmlBook(filename=self._book_filename)
+            else:
+                self._book = Book(filename=self._book_filename, read_only=read_only)
+            return self._book
 
 
 class CommandHandler:
@@ -62,34 +209,603 @@ class CommandHandler:
         MESSAGE_ERROR: 'red',
     }
     COLUMN_WIDTH = 35
+    # Shown in place of the opposite account for transactions with splits in several other accounts
+    MULTIPLE_ACCOUNTS = '(Multiple)'
+    # Shown in place of the rule for transactions that no rule matched
+    NO_MATCH = '(No match)'
+    # Shown in place of the number of rules tried when an earlier transaction had the same description
+    CACHED = '0 (same as earlier)'
+    DEFAULT_HOST = '127.0.0.1'
+    DEFAULT_PORT = 8787
 
     def run(self):
         """Main runner for the program.
         """
         options = self._parse_options_from_command_line()
+        runners = {
+            CommandOptions.COMMAND_CATEGORIZE: self._categorize,
+            CommandOptions.COMMAND_PLAN: self._plan,
+            CommandOptions.COMMAND_APPLY: self._apply,
+            CommandOptions.COMMAND_WATCH: self._watch,
+            CommandOptions.COMMAND_SERVE: self._serve,
+            CommandOptions.COMMAND_UNDO: self._undo,
+            CommandOptions.COMMAND_ANNOTATE: self._annotate,
+            CommandOptions.COMMAND_SNAPSHOT: self._snapshot,
+            CommandOptions.COMMAND_BACKTEST: self._backtest,
+            CommandOptions.COMMAND_CLUSTER: self._cluster,
+        }
+        try:
+            runners[options.command](options)
+        except AccountsNotFound as e:
+            self._print_message('{} Please check the account names in the config file.'.format(e),
+                                self.MESSAGE_ERROR)
+            return
+        except CommodityMismatch as e:
+            self._print_message('{} Please check the patterns in the config file.'.format(e), self.MESSAGE_ERROR)
+            return
+        self._write_metrics(options)
+
+    def _categorize(self, options):
+        """Previews the suggestions, and saves them if the user accepts them.
+
+        Args:
+            options: CommandOptions object.
+        """
+        if options.review:
+            self._categorize_with_review(options)
+            return
         suggestions = self._get_and_preview_suggestions(options)
-        if self._user_accepts_suggestions():
-            self._save_suggestions(suggestions)
+        if options.get_book().read_only:
+            self._print_read_only_warning()
+        elif self._user_accepts_suggestions():
+            self._save_suggestions(options, suggestions)
         else:
             self._print_message('Aborted.', self.MESSAGE_WARNING)
 
+    def _categorize_with_review(self, options):
+        """Lets the user accept or reject each suggestion on an interactive screen, then saves
+        the accepted ones.
+
+        Args:
+            options: CommandOptions object.
+        """
+        suggestions, splits_without_suggestions = self._get_suggestions_and_splits_without_suggestions(options)
+        self._render_splits_without_suggestions(splits_without_suggestions)
+        if options.get_book().read_only:
+            self._print_read_only_warning()
+            return
+        if not suggestions:
+            self._print_message('\nThere are no suggestions to review.', self.MESSAGE_WARNING)
+            return
+        accepted_suggestions = review_suggestions(suggestions)
+        if accepted_suggestions is None:
+            self._print_message('Aborted.', self.MESSAGE_WARNING)
+            return
+        self._print_message('\nAccepted {} of {} suggestions.'.format(len(accepted_suggestions), len(suggestions)))
+        self._save_suggestions(options, accepted_suggestions)
+
+    def _print_read_only_warning(self):
+        self._print_message('\nThe accounts file is read only, so the suggestions cannot be saved. '
+                            'Use the plan command to save them to a plan file instead.',
+                            self.MESSAGE_WARNING)
+
+    def _plan(self, options):
+        """Previews the suggestions, and saves them to a plan file to be applied later.
+
+        Args:
+            options: CommandOptions object.
+        """
+        suggester = self._get_suggester(options)
+        suggestions = suggester.get_suggestions()
+        self._render_suggestions(suggestions)
+        self._render_splits_without_suggestions(suggester.get_splits_without_suggestions())
+        if options.explain_sample is not None:
+            self._render_explanations(suggester.get_explanations())
+        suggester.get_plan(suggestions).write(options.plan_filename)
+        self._print_message('\nSaved {} suggestions to {}.'.format(len(suggestions), options.plan_filename),
+                            self.MESSAGE_SUCCESS)
+
+    def _apply(self, options):
+        """Applies a plan file to the book, as long as the book has not changed since the plan was made.
+
+        Args:
+            options: CommandOptions object.
+        """
+        book = options.get_book()
+        if book.read_only:
+            self._print_message('The accounts file is read only, so the plan cannot be applied to it.',
+                                self.MESSAGE_ERROR)
+            return
+        plan = Plan.read(options.plan_filename)
+        try:
+            plan.check_fingerprint(book.get_fingerprint(plan.account_guids))
+        except BookChanged as e:
+            self._print_message('{} Please make a new plan.'.format(e), self.MESSAGE_ERROR)
+            self._print_message('Aborted.', self.MESSAGE_WARNING)
+            return
+        try:
+            run_id = options.get_journal().save_changes(book, plan.entries)
+        except UnexpectedRowCount as e:
+            self._print_message('{} Some of the transactions have been changed since the plan was made, so it '
+                                'cannot be applied. Please make a new plan.'.format(e), self.MESSAGE_ERROR)
+            self._print_message('Aborted.', self.MESSAGE_WARNING)
+            return
+        except CommodityMismatch as e:
+            self._print_message('{} Please change the rules, and make a new plan.'.format(e), self.MESSAGE_ERROR)
+            self._print_message('Aborted.', self.MESSAGE_WARNING)
+            return
+        self._print_message('Applied {} changes.'.format(len(plan.entries)), self.MESSAGE_SUCCESS)
+        self._print_undo_command(options, run_id)
+
+    def _undo(self, options):
+        """Moves the splits changed by an earlier run back to the accounts they were in before,
+        as long as they have not been moved since.
+
+        Args:
+            options: CommandOptions object.
+        """
+        if options.get_book().read_only:
+            self._print_message('The accounts file is read only, so run {} cannot be undone in it.'.format(
+                options.run_id), self.MESSAGE_ERROR)
+            return
+        journal = options.get_journal()
+        try:
+            entries = journal.get_entries(options.run_id)
+        except RunNotFound as e:
+            self._print_message(str(e), self.MESSAGE_ERROR)
+            return
+        try:
+            run_id = journal.save_changes(options.get_book(), Journal.reverse(entries))
+        except UnexpectedRowCount as e:
+            self._print_message('{} Some of the transactions have been changed since run {}, so it cannot be '
+                                'undone.'.format(e, options.run_id), self.MESSAGE_ERROR)
+            self._print_message('Aborted.', self.MESSAGE_WARNING)
+            return
+        except CommodityMismatch as e:
+            self._print_message('{} Run {} cannot be undone.'.format(e, options.run_id), self.MESSAGE_ERROR)
+            self._print_message('Aborted.', self.MESSAGE_WARNING)
+            return
+        self._print_message('Undid {} changes from run {}.'.format(len(entries), options.run_id),
+                            self.MESSAGE_SUCCESS)
+        self._print_undo_command(options, run_id)
+
+    def _print_undo_command(self, options, run_id):
+        """Tells the user how to undo the changes saved by a run.
+
+        Args:
+            options: CommandOptions object.
+            run_id: The id of the run in the journal, or None if nothing was saved (string).
+        """
+        if run_id is not None:
+            self._print_message('To undo this, run: gnucash-categorize undo {} {}'.format(
+                options.book_filename, run_id))
+
+    def _watch(self, options):
+        """Saves suggestions for the transactions in the book, and again whenever new ones are
+        added to the book, until the user stops it.
+
+        Args:
+            options: CommandOptions object.
+        """
+        # Checked before the book is opened, so that a database is not opened for writing just to be refused
+        if is_database_uri(options.book_filename):
+            self._print_message('Only accounts files can be watched, not databases.', self.MESSAGE_ERROR)
+            return
+        if options.get_book().read_only:
+            self._print_message('The accounts file is read only, so it cannot be watched.', self.MESSAGE_ERROR)
+            return
+        self._print_message('Watching {} for changes. Press Ctrl+C to stop.'.format(options.book_filename))
+        watcher = self._get_watcher(options)
+        try:
+            while not self._watch_until_save_fails(options, watcher):
+                pass
+        except KeyboardInterrupt:
+            self._print_message('\nStopped.', self.MESSAGE_WARNING)
+
+    def _watch_until_save_fails(self, options, watcher):
+        """Outputs what the watcher saves, until it stops or fails to save its suggestions.
+
+        Args:
+            options: CommandOptions object.
+            watcher: Watcher object.
+
+        Returns:
+            Whether the watcher stopped, rather than failing to save (boolean).  After a failure, the
+            watcher tries again once the book next changes.
+        """
+        try:
+            for suggestions, splits_without_suggestions, run_id in watcher.watch():
+                if suggestions:
+                    self._render_suggestions(suggestions)
+                    self._print_message('\nSaved {} suggestions.'.format(len(suggestions)), self.MESSAGE_SUCCESS)
+                    self._print_undo_command(options, run_id)
+                if splits_without_suggestions:
+                    self._render_splits_without_suggestions(splits_without_suggestions)
+                self._write_metrics(options)
+        except (UnexpectedRowCount, CommodityMismatch) as e:
+            self._print_message('{} None of the suggestions have been saved.'.format(e), self.MESSAGE_ERROR)
+            return False
+        return True
+
+    def _get_watcher(self, options):
+        """Args:
+            options: CommandOptions object.
+        Returns:
+            Watcher object.
+        """
+        return Watcher(config=options.get_config(),
+                       book=options.get_book(),
+                       book_filename=options.book_filename,
+                       poll_interval=options.poll_interval,
+                       memory_limit=options.memory_limit,
+                       split_filter=options.get_split_filter(),
+                       journal=options.get_journal(),
+                       metrics=options.get_metrics())
+
+    def _serve(self, options):
+        """Serves the matching over HTTP, until the user stops it.
+
+        Args:
+            options: CommandOptions object.
+        """
+        server = make_server(options.get_config(), host=options.host, port=options.port)
+        host, port = server.server_address[:2]
+        self._print_message('Serving on http://{}:{}/. Press Ctrl+C to stop.'.format(host, port))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            self._print_message('\nStopped.', self.MESSAGE_WARNING)
+        finally:
+            server.server_close()
+
+    def _annotate(self, options):
+        """Writes a copy of a bank statement file with the account each transaction should go to,
+        so that the transactions are categorized as they are imported.
+
+        Args:
+            options: CommandOptions object.
+        """
+        annotator = StatementAnnotator(Matcher(options.get_config()),
+                                       account_name=options.statement_account_name,
+                                       encoding=options.encoding,
+                                       description_column=options.description_column)
+        try:
+            record_count, matched_count = annotator.annotate(options.statement_filename, options.annotated_filename)
+        except InvalidStatement as e:
+            self._print_message(str(e), self.MESSAGE_ERROR)
+            return
+        self._print_message('Matched {} of {} transactions. Saved to {}.'.format(
+            matched_count, record_count, options.annotated_filename), self.MESSAGE_SUCCESS)
+
+    def _snapshot(self, options):
+        """Writes a snapshot of the book, that the other commands can be run from instead of the book.
+
+        Args:
+            options: CommandOptions object.
+        """
+        try:
+            split_count = SnapshotBook.write(options.get_book(), options.snapshot_filename)
+        except NotImplementedError as e:
+            self._print_message(str(e), self.MESSAGE_ERROR)
+            return
+        self._print_message('Saved {} transaction splits to {}.'.format(split_count, options.snapshot_filename),
+                            self.MESSAGE_SUCCESS)
+
+    def _backtest(self, options):
+        """Shows how precise each rule would have been, and how much of its account it would have
+        covered, when tried against the transactions that are already categorized.
+
+        Args:
+            options: CommandOptions object.
+        """
+        backtester = Backtester(options.get_config(), options.get_book(), account_names=options.account_names,
+                                start_date=options.start_date, end_date=options.end_date)
+        results = backtester.run()
+        account_names_by_guid = options.get_book().get_account_names_by_guid()
+        for result in results:
+            self._render_backtest_result(result, account_names_by_guid)
+
+    def _render_backtest_result(self, result, account_names_by_guid):
+        """Outputs how the rules for one uncategorized account did in a backtest.
+
+        Args:
+            result: BacktestResult.
+            account_names_by_guid: Dictionary of account names, keyed by guid.
+        """
+        self._print_message('\nRules for {}, tried against {} categorized transactions:\n'.format(
+            result.account_name, result.split_count))
+        headings = ['Rule', 'Pattern', 'Account', 'Matched', 'Precision', 'Coverage', 'Most often wrong about']
+        self._print_message(self._format_cells(headings))
+        self._print_horizontal_line(cell_count=len(headings))
+        for rule_result in result.rule_results:
+            wrong_account_counts = rule_result.wrong_account_counts.most_common(1)
+            parts = [str(part) for part in (
+                rule_result.match_pattern.rule_id,
+                rule_result.match_pattern.pattern,
+                rule_result.match_pattern.account_name,
+                rule_result.matched_count,
+                self._format_rate(rule_result.precision),
+                self._format_rate(rule_result.coverage),
+                '{} ({})'.format(account_names_by_guid[wrong_account_counts[0][0]], wrong_account_counts[0][1])
+                if wrong_account_counts else '',
+            )]
+            self._print_message(self._format_cells(parts))
+        self._print_message('\nMatched {} of {} transactions, {} of them correctly.'.format(
+            result.matched_count, result.split_count, result.correct_count))
+
+    def _cluster(self, options):
+        """Groups the transactions without suggestions into clusters of similar descriptions, and
+        shows the largest ones with a pattern for each, as the next rules to write.
+
+        Args:
+            options: CommandOptions object.
+        """
+        config = options.get_config()
+        suggester = self._get_suggester(options)
+        suggester.get_suggestions()
+        splits_without_suggestions = suggester.get_splits_without_suggestions()
+        clusters = DescriptionClusterer(config.get_normalizer()).get_clusters(splits_without_suggestions)
+        self._render_clusters(clusters[:options.cluster_limit])
+        self._print_message('\nFound {} clusters of the {} transactions without suggestions.'.format(
+            len(clusters), len(splits_without_suggestions)))
+
+    def _render_clusters(self, clusters):
+        """Outputs the clusters of transactions without suggestions, largest first.
+
+        Args:
+            clusters: List of Clusters.
+        """
+        self._print_message('\nTransactions without suggestions, clustered by description:\n')
+        headings = ['Pattern', 'Transactions', 'Descriptions', 'Total', 'Accounts']
+        self._print_message(self._format_cells(headings))
+        self._print_horizontal_line(cell_count=len(headings))
+        for cluster in clusters:
+            parts = [str(part) for part in (
+                cluster.pattern,
+                cluster.split_count,
+                len(cluster.descriptions),
+                ', '.join(format_money(amount, locale='en_GB') for amount in cluster.total_amounts),
+                ', '.join(account_name for account_name, _ in cluster.account_name_counts.most_common()),
+            )]
+            self._print_message(self._format_cells(parts))
+
+    def _format_rate(self, rate):
+        """Args:
+            rate: A fraction between 0 and 1, or None.
+        Returns:
+            The rate as a percentage, or a dash if there is none (string).
+        """
+        if rate is None:
+            return '-'
+        return '{:.1%}'.format(rate)
+
     def _parse_options_from_command_line(self):
-        """Gets the config and book filenames from the command line.
+        """Gets the command, and the config and book filenames, from the command line.
 
         Returns:
             CommandOptions instance.
         """
         parser = ArgumentParser()
+        parser.set_defaults(accounts=None, config=None, memory_limit=None, plan=None, interval=None,
+                            host=None, port=None, skip_duplicates=False, review=False, account_names=None,
+                            since=None, until=None, description_like=None, run_id=None, explain=None,
+                            metrics=None, statement_account=None, statement=None, output=None, encoding=None,
+                            description_column=None, snapshot=None, top=None)
+        subparsers = parser.add_subparsers(dest='command')
+        subparsers.required = True
+
+        categorize_parser = subparsers.add_parser(
+            CommandOptions.COMMAND_CATEGORIZE,
+            help="Preview the suggestions, and save them to the accounts file (the default command).")
+        self._add_matching_arguments(categorize_parser)
+        self._add_skip_duplicates_argument(categorize_parser)
+        self._add_explain_argument(categorize_parser)
+        categorize_parser.add_argument(
+            "--review", action="store_true",
+            help="Accept or reject each suggestion on an interactive screen, rather than all at once.")
+
+        plan_parser = subparsers.add_parser(
+            CommandOptions.COMMAND_PLAN,
+            help="Preview the suggestions, and save them to a plan file to apply later.")
+        self._add_matching_arguments(plan_parser)
+        self._add_skip_duplicates_argument(plan_parser)
+        self._add_explain_argument(plan_parser)
+        plan_parser.add_argument(
+            "plan",
+            help="The name of the plan file to write.")
+
+        apply_parser = subparsers.add_parser(
+            CommandOptions.COMMAND_APPLY,
+            help="Save the suggestions in a plan file to the accounts file.")
+        apply_parser.add_argument(
+            "accounts",
+            help="The name of the GnuCash file that contains the accounts, or the URI of its database.")
+        apply_parser.add_argument(
+            "plan",
+            help="The name of the plan file to apply.")
+
+        watch_parser = subparsers.add_parser(
+            CommandOptions.COMMAND_WATCH,
+            help="Keep running, and save suggestions for new transactions whenever the accounts file changes.")
+        self._add_matching_arguments(watch_parser)
+        watch_parser.add_argument(
+            "--interval", type=float, metavar="SECONDS",
+            help="How often to check the accounts file for changes.")
+
+        serve_parser = subparsers.add_parser(
+            CommandOptions.COMMAND_SERVE,
+            help="Serve the matching over HTTP, for other programs to use.")
+        serve_parser.add_argument(
+            "config",
+            help="The name of the .yml file that contains the matching configuration.")
+        serve_parser.add_argument(
+            "--host", default=self.DEFAULT_HOST,
+            help="The address to listen on.")
+        serve_parser.add_argument(
+            "--port", type=int, default=self.DEFAULT_PORT,
+            help="The port to listen on.")
+
+        undo_parser = subparsers.add_parser(
+            CommandOptions.COMMAND_UNDO,
+            help="Undo the changes saved to the accounts file by an earlier run.")
+        undo_parser.add_argument(
+            "accounts",
+            help="The name of the GnuCash file that contains the accounts, or the URI of its database.")
+        undo_parser.add_argument(
+            "run_id",
+            help="The id of the run to undo, as shown when its changes were saved.")
+
+        annotate_parser = subparsers.add_parser(
+            CommandOptions.COMMAND_ANNOTATE,
+            help="Write a copy of a CSV, QIF or OFX bank statement with the account for each transaction, "
+                 "to categorize the transactions as they are imported.")
+        annotate_parser.add_argument(
+            "config",
+            help="The name of the .yml file that contains the matching configuration.")
+        annotate_parser.add_argument(
+            "statement_account",
+            help="The uncategorized account whose patterns to use, e.g. Imbalance-GBP.")
+        annotate_parser.add_argument(
+            "statement",
+            help="The name of the statement file, ending .csv, .qif, .ofx or .qfx.")
+        annotate_parser.add_argument(
+            "output",
+            help="The name of the file to write.  For OFX statements, this is a CSV file.")
+        annotate_parser.add_argument(
+            "--encoding",
+            help="The text encoding of the statement file, e.g. cp1252.  Defaults to UTF-8.")
+        annotate_parser.add_argument(
+            "--description-column", metavar="NAME",
+            help="The name of the column containing the descriptions, for CSV statements.")
+
+        snapshot_parser = subparsers.add_parser(
+            CommandOptions.COMMAND_SNAPSHOT,
+            help="Write a snapshot of the accounts file, to run the other commands from instead, e.g. "
+                 "while trying out changes to the configuration.")
+        snapshot_parser.add_argument(
+            "accounts",
+            help="The name of the GnuCash file that contains the accounts, or the URI of its database.")
+        snapshot_parser.add_argument(
+            "snapshot",
+            help="The name of the snapshot file to write.")
+
+        backtest_parser = subparsers.add_parser(
+            CommandOptions.COMMAND_BACKTEST,
+            help="Show what the rules would have done to the transactions that are already categorized: "
+                 "how often each rule is right, and how much of its account it covers.")
+        backtest_parser.add_argument(
+            "config",
+            help="The name of the .yml file that contains the matching configuration.")
+        backtest_parser.add_argument(
+            "accounts",
+            help="The name of the GnuCash file that contains the accounts, or the URI of its database.")
+        backtest_parser.add_argument(
+            "--account", dest="account_names", action="append", metavar="NAME",
+            help="Only test the rules for this uncategorized account.  May be given more than once.")
+        backtest_parser.add_argument(
+            "--since", type=self._parse_date, metavar="YYYY-MM-DD",
+            help="Only test against transactions posted on or after this date.")
+        backtest_parser.add_argument(
+            "--until", type=self._parse_date, metavar="YYYY-MM-DD",
+            help="Only test against transactions posted on or before this date.")
+
+        cluster_parser = subparsers.add_parser(
+            CommandOptions.COMMAND_CLUSTER,
+            help="Group the transactions without suggestions by description, with a pattern for each group, "
+                 "largest first, to show which rules to write next.")
+        self._add_matching_arguments(cluster_parser)
+        cluster_parser.add_argument(
+            "--top", type=int, metavar="N",
+            help="Only show the N largest clusters.")
+
+        args = parser.parse_args(self._get_command_line_arguments())
+
+        return CommandOptions(command=args.command, config_filename=args.config, book_filename=args.accounts,
+                              memory_limit=args.memory_limit, plan_filename=args.plan,
+                              poll_interval=args.interval, host=args.host, port=args.port,
+                              skip_duplicates=args.skip_duplicates, review=args.review,
+                              account_names=args.account_names, start_date=args.since, end_date=args.until,
+                              description_like=args.description_like, run_id=args.run_id,
+                              explain_sample=args.explain, metrics_filename=args.metrics,
+                              statement_account_name=args.statement_account, statement_filename=args.statement,
+                              annotated_filename=args.output, encoding=args.encoding,
+                              description_column=args.description_column, snapshot_filename=args.snapshot,
+                              cluster_limit=args.top)
+
+    def _add_matching_arguments(self, parser):
+        """Adds the arguments needed for the commands that match transactions.
+
+        Args:
+            parser: ArgumentParser.
+        """
         parser.add_argument(
             "config",
             help="The name of the .yml file that contains the matching configuration.")
         parser.add_argument(
             "accounts",
-            help="The name of the GnuCash file that contains the accounts.")
+            help="The name of the GnuCash file that contains the accounts, or the URI of its database.")
+        parser.add_argument(
+            "--memory-limit", type=int, metavar="MB",
+            help="Load the transactions in batches that fit within this many megabytes, "
+                 "for accounts with very many transactions.  This only bounds the batches being loaded "
+                 "and matched; the results are still kept for every transaction.")
+        parser.add_argument(
+            "--account", dest="account_names", action="append", metavar="NAME",
+            help="Only categorize the transactions in this uncategorized account.  May be given more than once.")
+        parser.add_argument(
+            "--since", type=self._parse_date, metavar="YYYY-MM-DD",
+            help="Only categorize transactions posted on or after this date.")
+        parser.add_argument(
+            "--until", type=self._parse_date, metavar="YYYY-MM-DD",
+            help="Only categorize transactions posted on or before this date.")
+        parser.add_argument(
+            "--description-like", metavar="PATTERN",
+            help="Only categorize transactions whose description matches this pattern, "
+                 "where %% matches any text and _ any single character, ignoring case.")
+        parser.add_argument(
+            "--metrics", metavar="FILE",
+            help="Write metrics about the run to this file, for monitoring: in the Prometheus text format "
+                 "if the name ends with {}, or as JSON otherwise.".format(RunMetrics.PROMETHEUS_SUFFIX))
 
-        args = parser.parse_args()
+    @staticmethod
+    def _parse_date(text):
+        """Args:
+            text: A date from the command line, e.g. '2017-03-31'.
+        Returns:
+            date object.
+        Raises:
+            ArgumentTypeError, if the date is not in the expected format.
+        """
+        try:
+            return date.fromisoformat(text)
+        except ValueError:
+            raise ArgumentTypeError("'{}' is not a date in the format YYYY-MM-DD.".format(text))
+
+    def _add_skip_duplicates_argument(self, parser):
+        """Args:
+            parser: ArgumentParser.
+        """
+        parser.add_argument(
+            "--skip-duplicates", action="store_true",
+            help="List any transactions that look like duplicates, and leave them uncategorized.")
 
-        return CommandOptions(config_filename=args.config, book_filename=args.accounts)
+    def _add_explain_argument(self, parser):
+        """Args:
+            parser: ArgumentParser.
+        """
+        parser.add_argument(
+            "--explain", type=float, nargs="?", const=1.0, metavar="SAMPLE",
+            help="Show which rule matched each transaction and how many rules were tried.  Give a fraction "
+                 "between 0 and 1 to only explain a sample of the transactions, e.g. 0.01 for one in a hundred.")
+
+    def _get_command_line_arguments(self):
+        """Returns:
+            The command line arguments, with the categorize command added if no command was given.
+        """
+        arguments = sys.argv[1:]
+        if arguments and arguments[0] not in CommandOptions.COMMANDS and not arguments[0].startswith('-'):
+            arguments = [CommandOptions.COMMAND_CATEGORIZE] + arguments
+        return arguments
 
     def _get_and_preview_suggestions(self, options):
         """Gets and previews the suggested changes to make to the transactions,
@@ -119,7 +835,11 @@ class CommandHandler:
                 - List of Splits without suggestions.
         """
         suggester = self._get_suggester(options)
-        return suggester.get_suggestions(), suggester.get_splits_without_suggestions()
+        suggestions = suggester.get_suggestions()
+        splits_without_suggestions = suggester.get_splits_without_suggestions()
+        if options.explain_sample is not None:
+            self._render_explanations(suggester.get_explanations())
+        return suggestions, splits_without_suggestions
 
     def _get_suggester(self, options):
         """Gets a Suggester object to use to get the suggestions.
@@ -130,8 +850,59 @@ class CommandHandler:
         Returns:
             Suggester object.
         """
+        # Made first, so that the SQL statements run to find the duplicates are counted too
+        metrics = options.get_metrics()
+        skip_split_guids = None
+        if options.skip_duplicates:
+            skip_split_guids = self._get_duplicate_split_guids(options)
         return Suggester(config=options.get_config(),
-                         book=options.get_book())
+                         book=options.get_book(),
+                         memory_limit=options.memory_limit,
+                         skip_split_guids=skip_split_guids,
+                         split_filter=options.get_split_filter(),
+                         explain_sample=options.explain_sample,
+                         metrics=metrics)
+
+    def _get_duplicate_split_guids(self, options):
+        """Finds and outputs the uncategorized splits that look like duplicates.
+
+        Args:
+            options: CommandOptions object.
+
+        Returns:
+            Set of the guids of the duplicate splits.
+        """
+        book = options.get_book()
+        with time_phase(options.get_metrics(), 'duplicates'):
+            duplicates = DuplicateDetector(config=options.get_config(), book=book).get_duplicates()
+        self._render_duplicates(duplicates, book.get_account_names_by_guid(), book.get_currencies_by_account_guid())
+        return {duplicate.split_row.guid for duplicate in duplicates}
+
+    def _render_duplicates(self, duplicates, account_names_by_guid, currencies_by_account_guid):
+        """Outputs the likely duplicates.
+
+        Args:
+            duplicates: List of Duplicates.
+            account_names_by_guid: Dictionary of account names, keyed by guid.
+            currencies_by_account_guid: Dictionary of account currencies, keyed by guid.
+        """
+        self._print_message('\nLikely duplicates, which will be left uncategorized:\n')
+        headings = ['Date', 'Description', 'Amount', 'Account', 'Duplicate of']
+        self._print_message(self._format_cells(headings))
+        self._print_horizontal_line(cell_count=len(headings))
+        for duplicate in duplicates:
+            split_row, original_row = duplicate.split_row, duplicate.original_row
+            amount = Money(Decimal(split_row.value.numerator) / Decimal(split_row.value.denominator),
+                           currencies_by_account_guid[split_row.account_guid])
+            parts = [str(part) for part in (
+                split_row.date.strftime('%d/%m/%Y'),
+                split_row.description,
+                format_money(amount, locale='en_GB'),
+                account_names_by_guid[split_row.account_guid],
+                '{} {}'.format(original_row.date.strftime('%d/%m/%Y'),
+                               account_names_by_guid[original_row.account_guid]),
+            )]
+            self._print_message(self._format_cells(parts))
 
     def _render_suggestions(self, suggestions):
         """Outputs the suggestions for the user to review.
@@ -140,7 +911,7 @@ class CommandHandler:
             suggestions: List of suggestions.
         """
         self._print_message('\nSuggestions for uncategorized transactions:\n')
-        headings = ['Date', 'Description', 'Amount', 'Old account', 'New account']
+        headings = ['Date', 'Description', 'Amount', 'Opposite account', 'Old account', 'New account', 'Rule']
         self._print_message(self._format_cells(headings))
         self._print_horizontal_line(cell_count=len(headings))
         for suggestion in suggestions:
@@ -148,11 +919,44 @@ class CommandHandler:
                 suggestion.date.strftime('%d/%m/%Y'),
                 suggestion.description,
                 format_money(suggestion.amount, locale='en_GB'),
+                suggestion.opposite_account or self.MULTIPLE_ACCOUNTS,
                 suggestion.old_account,
                 suggestion.new_account,
+                suggestion.rule_id or '',
+            )]
+            self._print_message(self._format_cells(parts))
+
+    def _render_explanations(self, explanations):
+        """Outputs how each of the explained transactions was matched.
+
+        Args:
+            explanations: List of (Split, Explanation) two-tuples.
+        """
+        self._print_message('\nHow the transactions were matched:\n')
+        headings = ['Date', 'Description', 'Account', 'Rule', 'Position', 'Rules tried']
+        self._print_message(self._format_cells(headings))
+        self._print_horizontal_line(cell_count=len(headings))
+        for split, explanation in explanations:
+            parts = [str(part) for part in (
+                split.date.strftime('%d/%m/%Y'),
+                split.description,
+                split.account,
+                explanation.rule_id or self.NO_MATCH,
+                self._format_position(explanation),
+                self.CACHED if explanation.cached else explanation.evaluations,
             )]
             self._print_message(self._format_cells(parts))
 
+    def _format_position(self, explanation):
+        """Returns:
+            The position of the rule that matched, with the rule group it is in if any (string).
+        """
+        if explanation.position is None:
+            return ''
+        if explanation.group_name is None:
+            return str(explanation.position)
+        return '{} in {}'.format(explanation.position, explanation.group_name)
+
     def _render_splits_without_suggestions(self, splits):
         """Outputs the splits without suggestions.
 
@@ -190,15 +994,38 @@ class CommandHandler:
         LINE_CHARACTER = '-'
         self._print_message(LINE_CHARACTER * self.COLUMN_WIDTH * cell_count)
 
-    def _save_suggestions(self, suggestions):
-        """Saves the list of suggestions to the accounts book.
+    def _save_suggestions(self, options, suggestions):
+        """Saves the list of suggestions to the accounts book, all at once, recording them in the journal.
 
         Args:
+            options: CommandOptions object.
             suggestions: List of suggestions.
         """
-        for suggestion in suggestions:
-            suggestion.save()
+        try:
+            with time_phase(options.get_metrics(), 'save'):
+                run_id = options.get_journal().save_changes(
+                    options.get_book(), [PlanEntry.from_suggestion(suggestion) for suggestion in suggestions])
+        except UnexpectedRowCount as e:
+            self._print_message('{} Some of the transactions have been changed since they were loaded, so none '
+                                'of the suggestions have been saved.'.format(e), self.MESSAGE_ERROR)
+            self._print_message('Aborted.', self.MESSAGE_WARNING)
+            return
+        except CommodityMismatch as e:
+            self._print_message('{} None of the suggestions have been saved.'.format(e), self.MESSAGE_ERROR)
+            self._print_message('Aborted.', self.MESSAGE_WARNING)
+            return
         self._print_message('Saved.', self.MESSAGE_SUCCESS)
+        self._print_undo_command(options, run_id)
+
+    def _write_metrics(self, options):
+        """Writes the metrics about the run to the metrics file, if one was given.
+
+        Args:
+            options: CommandOptions object.
+        """
+        metrics = options.get_metrics()
+        if metrics is not None:
+            metrics.write(options.metrics_filename)
 
     def _user_accepts_suggestions(self):
         """Asks the user whether or not they accept the suggestions.
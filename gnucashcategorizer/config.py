@@ -1,5 +1,9 @@
+import os
+import re
 import yaml
-from fnmatch import fnmatch
+import hashlib
+from fnmatch import translate
+from .normalizer import DescriptionNormalizer
 
 
 class MatchPattern:
@@ -9,10 +13,46 @@ class MatchPattern:
     Args:
         pattern: text to match to a description (string).
         account_name: full name of account to point the transaction to (string).
+        position: Optional position of the pattern among the patterns for its uncategorized account,
+                  or its rule group, in config order, starting from 1 (integer).
+        group_name: Optional name of the rule group the pattern is in (string).
+
+    Once the pattern has been bound to a book (see Matcher), account is the Account it points to.
+
+    The pattern is compiled once, up front, rather than each time it is matched.
     """
-    def __init__(self, pattern, account_name):
+    # The characters with a special meaning in patterns
+    WILDCARDS = '*?['
+
+    def __init__(self, pattern, account_name, position=None, group_name=None):
         self.pattern = pattern
         self.account_name = account_name
+        self.position = position
+        self.group_name = group_name
+        self.account = None
+        self._regex = re.compile(translate(pattern))
+
+    @property
+    def rule_id(self):
+        """A short id for the pattern, that stays the same as long as the pattern and account do.
+
+        Returns:
+            8 character hex string.
+        """
+        hashable = '{}\0{}'.format(self.pattern, self.account_name)
+        return hashlib.sha1(hashable.encode('utf-8')).hexdigest()[:8]
+
+    @property
+    def literal_prefix(self):
+        """The text that every description the pattern matches starts with: the pattern up to its first wildcard.
+
+        Returns:
+            String, which is empty if the pattern starts with a wildcard.
+        """
+        for index, character in enumerate(self.pattern):
+            if character in self.WILDCARDS:
+                return self.pattern[:index]
+        return self.pattern
 
     def is_match(self, description):
         """Returns whether or not a description matches the pattern.
@@ -23,7 +63,7 @@ class MatchPattern:
         Returns:
             Whether the supplied description matches the pattern.
         """
-        return fnmatch(description, self.pattern)
+        return self._regex.match(description) is not None
 
     def __eq__(self, other):
         return hash(self) == hash(other)
@@ -40,15 +80,136 @@ class MatchPattern:
 class Config:
     """Reads and stores configuration from a YAML file.
     """
+    # How many days apart duplicate transactions may be, unless configured otherwise
+    DEFAULT_DUPLICATE_DATE_TOLERANCE = 2
+    # The key of the entries in an uncategorized account's matches that refer to a rule group
+    GROUP_KEY = 'group'
+
     def __init__(self, filename):
         self._load_from_file(filename)
 
     def _load_from_file(self, filename):
         """Parses the supplied yaml filename.
         """
+        self._filename = filename
+        last_modified = os.stat(filename).st_mtime_ns
+        self._config_dict = self._read_file(filename)
+        self._last_modified = last_modified
+
+    @classmethod
+    def _read_file(cls, filename):
+        """Returns:
+            Dictionary of the config in the yaml file.
+        """
         with open(filename) as config_file:
             yaml_string = config_file.read()
-            self._config_dict = yaml.load(yaml_string)
+            return yaml.load(yaml_string)
+
+    def reload_if_changed(self, apply_changes=None):
+        """Reads the file again if it has been modified since it was last read, and works out
+        which uncategorized accounts' patterns have changed.
+
+        If the normalization section has changed, all the accounts are treated as changed,
+        as the patterns are normalized too.
+
+        An account whose rule groups have changed is treated as changed too.
+
+        The new config only replaces the old one once it has been read in full and the changes
+        have been applied, so if either fails, the old config is kept, and the file is read
+        again the next time.
+
+        Args:
+            apply_changes: Optional function to call with the set of changed account names once the
+                           new config is in place, e.g. to build patterns from it.  If it raises an
+                           exception, the old config is put back.
+
+        Returns:
+            Set of the names of the uncategorized accounts that have been added, removed
+            or had their patterns changed (strings).  Empty if nothing has changed.
+
+        Raises:
+            yaml.YAMLError, if the file is not valid yaml, or any exception raised by apply_changes.
+        """
+        last_modified = os.stat(self._filename).st_mtime_ns
+        if last_modified == self._last_modified:
+            return set()
+        old_config_dict = self._config_dict
+        new_config_dict = self._read_file(self._filename)
+
+        old_matches_config = self._get_matches_config_by_account_name(old_config_dict)
+        new_matches_config = self._get_matches_config_by_account_name(new_config_dict)
+        account_names = set(old_matches_config) | set(new_matches_config)
+        old_normalizer = self.__dict__.get('_normalizer')
+        if old_config_dict.get('normalization') != new_config_dict.get('normalization'):
+            self.__dict__.pop('_normalizer', None)
+        else:
+            account_names = {name for name in account_names
+                             if old_matches_config.get(name) != new_matches_config.get(name)}
+
+        self._config_dict = new_config_dict
+        if apply_changes is not None:
+            try:
+                apply_changes(account_names)
+            except Exception:
+                self._config_dict = old_config_dict
+                if old_normalizer is not None:
+                    self._normalizer = old_normalizer
+                raise
+        self._last_modified = last_modified
+        return account_names
+
+    @classmethod
+    def _get_matches_config_by_account_name(cls, config_dict):
+        """Returns:
+            Dictionary of the matches config for each uncategorized account, with the config of
+            the rule groups it refers to filled in, keyed by account name.
+        """
+        rule_groups_config = config_dict.get('rule_groups') or {}
+        matches_config = {}
+        for account_dict in config_dict['matches']:
+            account_name = cls._get_only_key_from_dictionary(account_dict)
+            matches_config[account_name] = []
+            for match_config in account_dict[account_name]:
+                group_name = cls._get_group_name(match_config)
+                if group_name is not None:
+                    match_config = {cls.GROUP_KEY: group_name, 'matches': rule_groups_config.get(group_name)}
+                matches_config[account_name].append(match_config)
+        return matches_config
+
+    def get_normalizer(self):
+        """Gets the DescriptionNormalizer configured by the optional 'normalization' section, e.g.
+
+            normalization:
+              strip_references: true
+              strip_digits: true
+              collapse_whitespace: true
+              casefold: true
+              strip_accents: true
+
+        The same normalizer is returned each time, so its cache is shared.
+
+        Returns:
+            DescriptionNormalizer object.
+        """
+        try:
+            return self._normalizer
+        except AttributeError:
+            normalization_config = self._config_dict.get('normalization') or {}
+            self._normalizer = DescriptionNormalizer(**normalization_config)
+            return self._normalizer
+
+    def get_duplicate_date_tolerance(self):
+        """Gets how many days apart two transactions may be posted and still be considered
+        duplicates, from the optional 'duplicates' section, e.g.
+
+            duplicates:
+              date_tolerance: 3
+
+        Returns:
+            Number of days (integer).
+        """
+        duplicates_config = self._config_dict.get('duplicates') or {}
+        return duplicates_config.get('date_tolerance', self.DEFAULT_DUPLICATE_DATE_TOLERANCE)
 
     def get_uncategorized_account_names(self):
         """
@@ -80,18 +241,100 @@ class Config:
         """
         Args:
            account_name - Name of the imbalance account for which to get patterns.
+        Returns:
+            List of MatchPatterns, including those of the rule groups the account refers to.
+        """
+        match_patterns = []
+        for rule in self.get_rules_for_account_name(account_name):
+            if isinstance(rule, MatchPattern):
+                match_patterns.append(rule)
+            else:
+                match_patterns.extend(self.get_patterns_for_rule_group(rule))
+        return match_patterns
+
+    def get_rules_for_account_name(self, account_name):
+        """Gets the rules for an uncategorized account: its own patterns, and the rule groups it refers to.
+
+        A rule group is a named list of patterns, in the optional 'rule_groups' section, that
+        several uncategorized accounts can refer to rather than each having a copy, e.g.
+
+            rule_groups:
+              merchants:
+                - Expenses:Groceries: ['TESCO', 'SAINSBURYS']
+            matches:
+              - Imbalance-GBP:
+                - group: merchants
+                - Expenses:Social: ['CASH *']
+              - Unresolved:
+                - group: merchants
+
+        Args:
+           account_name - Name of the imbalance account for which to get rules.
+        Returns:
+            List of MatchPatterns and rule group names (strings), in order of precedence.
+        """
+        rules = []
+        normalizer = self.get_normalizer()
+        position = 0
+        for match_config in self._get_matches_config_for_account_name(account_name):
+            group_name = self._get_group_name(match_config)
+            if group_name is not None:
+                rules.append(group_name)
+                continue
+            for match_pattern in self._get_patterns(match_config, normalizer, position):
+                rules.append(match_pattern)
+                position += 1
+        return rules
+
+    def get_patterns_for_rule_group(self, group_name):
+        """
+        Args:
+           group_name - Name of the rule group for which to get patterns.
         Returns:
             List of MatchPatterns.
+        Raises:
+            ValueError if there is no such rule group, or it refers to another rule group.
         """
+        rule_groups_config = self._config_dict.get('rule_groups') or {}
+        try:
+            matches_config = rule_groups_config[group_name]
+        except KeyError:
+            raise ValueError("There is no rule group '{}' in the config.".format(group_name))
         match_patterns = []
-        matches_config = self._get_matches_config_for_account_name(account_name)
+        normalizer = self.get_normalizer()
         for match_config in matches_config:
-            new_account_name = self._get_only_key_from_dictionary(match_config)
-            for pattern_text in match_config[new_account_name]:
-                match_pattern = MatchPattern(pattern=pattern_text, account_name=new_account_name)
-                match_patterns.append(match_pattern)
+            if self._get_group_name(match_config) is not None:
+                raise ValueError("The rule group '{}' refers to another rule group.".format(group_name))
+            match_patterns.extend(self._get_patterns(match_config, normalizer, len(match_patterns),
+                                                     group_name=group_name))
         return match_patterns
 
+    @classmethod
+    def _get_patterns(cls, match_config, normalizer, position, group_name=None):
+        """Args:
+            match_config: Dictionary in the form {'Destination account': ['PATTERN ONE', 'PATTERN TWO']}.
+            normalizer: DescriptionNormalizer to normalize the patterns with.
+            position: How many patterns come before these ones (integer).
+            group_name: Optional name of the rule group the patterns are in (string).
+        Returns:
+            List of MatchPatterns.
+        """
+        new_account_name = cls._get_only_key_from_dictionary(match_config)
+        return [MatchPattern(pattern=normalizer.normalize_pattern(pattern_text), account_name=new_account_name,
+                             position=position + index, group_name=group_name)
+                for index, pattern_text in enumerate(match_config[new_account_name], start=1)]
+
+    @classmethod
+    def _get_group_name(cls, match_config):
+        """Returns:
+            The name of the rule group the match config refers to, or None if it is a destination
+            account and its patterns.
+        """
+        group_name = match_config.get(cls.GROUP_KEY)
+        if len(match_config) == 1 and isinstance(group_name, str):
+            return group_name
+        return None
+
     def _get_matches_config_for_account_name(self, account_name):
         """Args:
             account_name - Name of the imbalance account for which to get the config
@@ -99,6 +342,8 @@ class Config:
             Returns:
                 List of dictionaries, each in the form, or empty list if none could be found.
                     {'Destination account': ['PATTERN ONE', 'PATTERN TWO']}
+                or, for a rule group,
+                    {'group': 'rule group name'}
         """
         for account_dict in self._config_dict['matches']:
             config_account_name = self._get_only_key_from_dictionary(account_dict)
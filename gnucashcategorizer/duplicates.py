@@ -0,0 +1,107 @@
+from collections import defaultdict
+from datetime import timedelta
+
+
+class Duplicate:
+    """An uncategorized split that looks like a duplicate of another split.
+
+    Args:
+        split_row: SplitRow of the likely duplicate, in an uncategorized account.
+        original_row: SplitRow of the split it duplicates.
+    """
+    def __init__(self, split_row, original_row):
+        self.split_row = split_row
+        self.original_row = original_row
+
+    def __eq__(self, other):
+        return hash(self) == hash(other)
+
+    def __hash__(self):
+        return hash((self.split_row, self.original_row))
+
+    def __repr__(self):
+        return "{cls}({split_guid}, {original_guid})".format(cls=self.__class__.__name__,
+                                                             split_guid=self.split_row.guid,
+                                                             original_guid=self.original_row.guid)
+
+
+class DuplicateDetector:
+    """Finds uncategorized splits that are likely to be duplicates, e.g. from importing the same
+    bank statement twice.
+
+    Two splits are likely duplicates if they have the same value and normalized description,
+    and were posted within the configured number of days of each other.  The uncategorized
+    splits are compared against each other, and against the already categorized splits from
+    the same dates.
+
+    Rather than comparing every pair of splits, the splits are indexed by value and description,
+    then by date bucket.  The buckets are one day wider than the tolerance, so any duplicate is
+    in the same bucket or one of the buckets either side, and the splits are found in linear time.
+
+    Args:
+        config: Config object.
+        book: Book object.
+    """
+    def __init__(self, config, book):
+        self._config = config
+        self._book = book
+        self._date_tolerance = config.get_duplicate_date_tolerance()
+        self._normalizer = config.get_normalizer()
+
+    def get_duplicates(self):
+        """Returns:
+            List of Duplicates, in date order.  Of a set of uncategorized duplicates with
+            no categorized original, the earliest is treated as the original.
+        """
+        account_guids = [account.guid for account in
+                         self._book.get_accounts(self._config.get_uncategorized_account_names())]
+        uncategorized_rows = sorted(self._book.get_split_rows(account_guids=account_guids),
+                                    key=lambda row: (row.date, row.guid))
+        if not uncategorized_rows:
+            return []
+
+        index = defaultdict(lambda: defaultdict(list))
+        tolerance = timedelta(days=self._date_tolerance)
+        categorized_rows = self._book.get_split_rows(exclude_account_guids=account_guids,
+                                                     start_date=uncategorized_rows[0].date - tolerance,
+                                                     end_date=uncategorized_rows[-1].date + tolerance)
+        for row in categorized_rows:
+            self._add_to_index(index, row)
+
+        duplicates = []
+        for row in uncategorized_rows:
+            original_row = self._find_original(index, row)
+            if original_row is None:
+                self._add_to_index(index, row)
+            else:
+                duplicates.append(Duplicate(row, original_row))
+        return duplicates
+
+    def _get_key(self, row):
+        """Returns:
+            The value and normalized description of the row, to look up possible duplicates by.
+        """
+        return (row.value, self._normalizer.normalize(row.description or ''))
+
+    def _get_bucket(self, date):
+        """Returns:
+            The number of the date bucket the date falls in (integer).
+        """
+        return date.toordinal() // (self._date_tolerance + 1)
+
+    def _add_to_index(self, index, row):
+        index[self._get_key(row)][self._get_bucket(row.date)].append(row)
+
+    def _find_original(self, index, row):
+        """Returns:
+            The SplitRow in the index that the row duplicates, or None.
+        """
+        buckets = index.get(self._get_key(row))
+        if not buckets:
+            return None
+        bucket = self._get_bucket(row.date)
+        for candidate_bucket in (bucket - 1, bucket, bucket + 1):
+            for candidate in buckets.get(candidate_bucket, []):
+                if abs((candidate.date - row.date).days) <= self._date_tolerance:
+                    return candidate
+        return None
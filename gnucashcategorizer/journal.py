@@ -0,0 +1,237 @@
+import os
+import secrets
+from datetime import datetime
+from sqlalchemy.engine import make_url
+from .book import is_database_uri
+from .plan import PlanEntry
+
+
+class RunNotFound(Exception):
+    """Raised when there is no run with the given id in the journal.
+    """
+    pass
+
+
+class Journal:
+    """An append-only record of the changes saved to a book, so that the changes made by
+    any one run can be undone later.
+
+    The journal file has a line for each change, with the fields separated by tabs:
+
+        run id, split guid, old account guid, new account guid, rule id
+
+    The changes of each run are written together, and an index file alongside the journal
+    has a line for each run, giving where its changes start in the journal and how long they
+    are.  The index lines are all the same length, and in the order the runs were made, which
+    is the order of their ids, so a run is found by searching the index by halves.  Getting a
+    run's changes only reads a few lines of the index and that part of the journal, however
+    long the journal has grown.
+
+    Usage:
+
+        journal = Journal.for_book('accounts.gnucash')
+        run_id = journal.save_changes(book, entries)
+        ...
+        journal.save_changes(book, Journal.reverse(journal.get_entries(run_id)))
+
+    Args:
+        filename: The filename and path of the journal file (string).
+    """
+    # Appended to the book filename to give the journal filename
+    JOURNAL_SUFFIX = '.journal'
+    # Appended to the journal filename to give the index filename
+    INDEX_SUFFIX = '.index'
+    SEPARATOR = '\t'
+    # Written in place of a missing rule id
+    NO_RULE_ID = '-'
+    # Each line of the index: the run id, then where its changes start in the journal, how long they are,
+    # and how many there are, padded so that every line is the same length
+    INDEX_LINE_FORMAT = '{:<20}\t{:020d}\t{:020d}\t{:010d}\n'
+    INDEX_LINE_LENGTH = len(INDEX_LINE_FORMAT.format('', 0, 0, 0))
+    # How many characters at the start of a run id give the time it was made
+    RUN_ID_TIME_LENGTH = len('20170319-142501')
+
+    def __init__(self, filename):
+        self._filename = filename
+        self._index_filename = filename + self.INDEX_SUFFIX
+
+    @classmethod
+    def for_book(cls, book_filename):
+        """Args:
+            book_filename: The filename and path to the Gnucash accounts file, or the URI of its database (string).
+        Returns:
+            The Journal kept alongside the supplied book file.  For a book on a database server,
+            the journal is kept in the current directory, named after the database.
+        """
+        if is_database_uri(book_filename):
+            # The path of an SQLite file, or the name of a database on a server
+            book_filename = make_url(book_filename).database
+        return cls(book_filename + cls.JOURNAL_SUFFIX)
+
+    def save_changes(self, book, entries):
+        """Records the changes as a new run, then makes them in the book in a single bulk update.
+
+        The changes are recorded first, so that they can always be undone, even if the program
+        stops while the book is being updated.  If the book cannot be updated, none of the changes
+        are made, and the run is removed from the journal again.
+
+        Args:
+            book: Book object.
+            entries: List of PlanEntry objects.
+
+        Returns:
+            The id of the run (string), or None if there were no changes.
+
+        Raises:
+            Any exception raised by Book.update_split_accounts, e.g. UnexpectedRowCount.
+        """
+        if not entries:
+            return None
+        journal_size, index_size = self._get_size(self._filename), self._get_size(self._index_filename)
+        run_id = self.record(entries)
+        try:
+            book.update_split_accounts(
+                (entry.split_guid, entry.old_account_guid, entry.new_account_guid) for entry in entries
+            )
+        except Exception:
+            # The run was the last one written, so it is removed by cutting the files back to their old size.
+            os.truncate(self._filename, journal_size)
+            os.truncate(self._index_filename, index_size)
+            raise
+        return run_id
+
+    def record(self, entries):
+        """Appends the changes to the journal as a new run.
+
+        Args:
+            entries: List of PlanEntry objects.
+
+        Returns:
+            The id of the new run (string).
+        """
+        run_id = self._make_run_id()
+        lines = ''.join(self._format_line(run_id, entry) for entry in entries).encode('utf-8')
+        with open(self._filename, 'ab') as journal_file:
+            offset = journal_file.seek(0, os.SEEK_END)
+            journal_file.write(lines)
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+        with open(self._index_filename, 'a') as index_file:
+            index_file.write(self.INDEX_LINE_FORMAT.format(run_id, offset, len(lines), len(entries)))
+        return run_id
+
+    def get_entries(self, run_id):
+        """Gets the changes made by a run.
+
+        Args:
+            run_id: The id of the run (string).
+
+        Returns:
+            List of PlanEntry objects.
+
+        Raises:
+            RunNotFound, if there is no run with that id.
+        """
+        offset, length = self._find_run(run_id)
+        with open(self._filename, 'rb') as journal_file:
+            journal_file.seek(offset)
+            lines = journal_file.read(length).decode('utf-8').splitlines()
+        return [self._parse_line(line) for line in lines]
+
+    @classmethod
+    def reverse(cls, entries):
+        """Returns:
+            List of PlanEntry objects that undo the supplied ones.
+        """
+        return [PlanEntry(split_guid=entry.split_guid,
+                          old_account_guid=entry.new_account_guid,
+                          new_account_guid=entry.old_account_guid,
+                          rule_id=entry.rule_id)
+                for entry in entries]
+
+    def _find_run(self, run_id):
+        """Finds a run in the index, by searching it by halves for the time the run was made.  If the
+        run is not found that way, e.g. because the clock was put back between runs, the whole
+        index is read.
+
+        Returns:
+            Two-tuple of where the run's changes start in the journal, and their length, in bytes.
+        Raises:
+            RunNotFound, if there is no run with that id.
+        """
+        try:
+            with open(self._index_filename, 'rb') as index_file:
+                line_count = index_file.seek(0, os.SEEK_END) // self.INDEX_LINE_LENGTH
+                location = self._search_index(index_file, line_count, run_id)
+                if location is None:
+                    index_file.seek(0)
+                    location = next((location for index_run_id, location in map(self._parse_index_line, index_file)
+                                     if index_run_id == run_id), None)
+        except FileNotFoundError:
+            location = None
+        if location is None:
+            raise RunNotFound('There is no run {} in {}.'.format(run_id, self._filename))
+        return location
+
+    def _search_index(self, index_file, line_count, run_id):
+        """Returns:
+            Two-tuple of where the run's changes start in the journal, and their length, in bytes,
+            or None if the run was not found.
+        """
+        run_time = run_id[:self.RUN_ID_TIME_LENGTH]
+        # Find the first line for a run made at the same time or later
+        low, high = 0, line_count
+        while low < high:
+            middle = (low + high) // 2
+            if self._read_index_line(index_file, middle)[0][:self.RUN_ID_TIME_LENGTH] < run_time:
+                low = middle + 1
+            else:
+                high = middle
+        # Several runs may have been made in the same second
+        for line_number in range(low, line_count):
+            index_run_id, location = self._read_index_line(index_file, line_number)
+            if index_run_id == run_id:
+                return location
+            if index_run_id[:self.RUN_ID_TIME_LENGTH] != run_time:
+                break
+        return None
+
+    def _read_index_line(self, index_file, line_number):
+        index_file.seek(line_number * self.INDEX_LINE_LENGTH)
+        return self._parse_index_line(index_file.read(self.INDEX_LINE_LENGTH))
+
+    def _parse_index_line(self, line):
+        """Returns:
+            Two-tuple of the run id (string), and a two-tuple of where its changes start in the journal
+            and their length, in bytes.
+        """
+        run_id, offset, length, _ = line.decode('utf-8').rstrip('\n').split(self.SEPARATOR)
+        return run_id.rstrip(), (int(offset), int(length))
+
+    @classmethod
+    def _get_size(cls, filename):
+        """Returns:
+            The size of the file in bytes, or 0 if it does not exist yet (integer).
+        """
+        try:
+            return os.path.getsize(filename)
+        except FileNotFoundError:
+            return 0
+
+    def _make_run_id(self):
+        """Returns:
+            A new run id, made of the time and some random characters, e.g. '20170319-142501-3fa2'.
+        """
+        return '{:%Y%m%d-%H%M%S}-{}'.format(datetime.now(), secrets.token_hex(2))
+
+    def _format_line(self, run_id, entry):
+        fields = [run_id, entry.split_guid, entry.old_account_guid, entry.new_account_guid,
+                  entry.rule_id or self.NO_RULE_ID]
+        return self.SEPARATOR.join(fields) + '\n'
+
+    def _parse_line(self, line):
+        _, split_guid, old_account_guid, new_account_guid, rule_id = line.split(self.SEPARATOR)
+        return PlanEntry(split_guid=split_guid,
+                         old_account_guid=old_account_guid,
+                         new_account_guid=new_account_guid,
+                         rule_id=None if rule_id == self.NO_RULE_ID else rule_id)
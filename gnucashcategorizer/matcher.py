@@ -0,0 +1,415 @@
+import logging
+import threading
+import time
+from .book import CommodityMismatch
+from .config import MatchPattern
+
+
+logger = logging.getLogger(__name__)
+
+
+class Matcher:
+    """Matches transaction descriptions against the patterns configured for each uncategorized account.
+
+    The patterns are read from the config once, up front, so matching involves no further
+    config lookups or I/O.  The match for each description is cached per account.
+
+    Rule groups (see Config.get_rules_for_account_name) are compiled once and shared by every
+    account that refers to them, with a cache of their own, so each description is only tried
+    against a group's patterns once, whichever account it is in.
+
+    If the config file changes, reload picks up the changes, only reading the patterns again
+    for the accounts that changed.  The patterns are swapped in all at once, so other threads
+    can keep matching while the config is reloaded.  If the new config cannot be read or bound,
+    the old patterns are kept, and the config is read again on the next reload.
+
+    If a book is given, the patterns are bound to it up front: every uncategorized account, and
+    every account the patterns point to, is looked up in one go, so that any unknown account names,
+    or patterns that would move splits to an account in another currency, are reported straight
+    away rather than when a transaction first matches them.
+
+    Args:
+        config: Config object.
+        book: Optional Book object to bind the patterns to.
+
+    Raises:
+        AccountsNotFound, if the patterns are bound to a book that lacks some of the accounts.
+        CommodityMismatch, if any of the patterns point to an account in a different commodity to
+        their uncategorized account.
+    """
+    def __init__(self, config, book=None):
+        self._config = config
+        self._book = book
+        self._reload_lock = threading.Lock()
+        self._rule_groups_by_name = {}
+        rules_by_account_name = {}
+        for account_name in config.get_uncategorized_account_names():
+            rules_by_account_name[account_name] = self._get_rules(account_name, self._rule_groups_by_name)
+        self._bind(rules_by_account_name)
+        # The normalizer and the rules, kept together so they can be replaced in one step
+        self._rule_set = (config.get_normalizer(), rules_by_account_name)
+
+    def get_match(self, account_name, description):
+        """Gets the first pattern that matches the description.
+
+        Args:
+            account_name: full name of the uncategorized account the transaction is in (string).
+            description: the description of the transaction (string).
+
+        Returns:
+            MatchPattern object, or None if there was no match.
+        """
+        normalizer, rules_by_account_name = self._rule_set
+        try:
+            rules = rules_by_account_name[account_name]
+        except KeyError:
+            return None
+        return rules.get_match(normalizer.normalize(description))
+
+    def explain(self, account_name, description, rule_timings=None):
+        """Matches the description in the same way as get_match, recording how the match was made.
+
+        Args:
+            account_name: full name of the uncategorized account the transaction is in (string).
+            description: the description of the transaction (string).
+            rule_timings: Optional dictionary to add the time spent trying each pattern to, in
+                          seconds, keyed by MatchPattern.  Patterns are only timed if it is given.
+
+        Returns:
+            Explanation object.
+        """
+        normalizer, rules_by_account_name = self._rule_set
+        try:
+            rules = rules_by_account_name[account_name]
+        except KeyError:
+            return Explanation(match_pattern=None, evaluations=0, cached=False)
+        return rules.explain(normalizer.normalize(description), rule_timings=rule_timings)
+
+    def get_uncategorized_account_names(self):
+        """Returns:
+            List of the names of the uncategorized accounts that have patterns (strings).
+        """
+        _, rules_by_account_name = self._rule_set
+        return list(rules_by_account_name)
+
+    def get_patterns(self, account_name):
+        """Args:
+            account_name: full name of the uncategorized account (string).
+        Returns:
+            List of the MatchPatterns for the account, in order of precedence, or an empty list if it has none.
+        """
+        _, rules_by_account_name = self._rule_set
+        try:
+            return list(rules_by_account_name[account_name].patterns)
+        except KeyError:
+            return []
+
+    def get_uncategorized_accounts(self):
+        """Returns:
+            List of the uncategorized accounts, in the order they are configured.  Only
+            available if the matcher was given a book.
+        """
+        _, rules_by_account_name = self._rule_set
+        return [rules.account for rules in rules_by_account_name.values()]
+
+    def reload(self):
+        """Reloads the config if the file has changed, replacing the patterns for any
+        uncategorized accounts that have changed, along with their cached matches.  Rule groups
+        whose patterns have not changed are kept, along with their cached matches.
+
+        If the new config is not valid, or refers to accounts that are not in the book, the
+        error is logged and the old config and patterns are kept.
+
+        Returns:
+            Set of the names of the uncategorized accounts that changed (strings).  Empty if
+            nothing changed, or the changes could not be loaded.
+        """
+        with self._reload_lock:
+            try:
+                return self._config.reload_if_changed(apply_changes=self._replace_rules)
+            except Exception:
+                logger.exception('The config could not be reloaded, so the old patterns are kept.')
+                return set()
+
+    def _replace_rules(self, changed_account_names):
+        """Builds and binds the rules for the changed uncategorized accounts from the config, and
+        only then swaps them in.
+
+        Args:
+            changed_account_names: Set of the names of the uncategorized accounts that changed (strings).
+
+        Raises:
+            AccountsNotFound, if the new rules are bound to a book that lacks some of their accounts.
+            CommodityMismatch, if any of the new rules point to an account in a different commodity.
+        """
+        if not changed_account_names:
+            return
+        _, old_rules_by_account_name = self._rule_set
+        rules_by_account_name = dict(old_rules_by_account_name)
+        uncategorized_account_names = set(self._config.get_uncategorized_account_names())
+        changed_rules_by_account_name = {}
+        rule_groups_by_name = {}
+        for account_name in changed_account_names:
+            if account_name in uncategorized_account_names:
+                changed_rules_by_account_name[account_name] = self._get_rules(account_name, rule_groups_by_name)
+            else:
+                rules_by_account_name.pop(account_name, None)
+        self._bind(changed_rules_by_account_name)
+        rules_by_account_name.update(changed_rules_by_account_name)
+        rule_set = (self._config.get_normalizer(), rules_by_account_name)
+        self._rule_groups_by_name = {rule_group.name: rule_group for rules in rules_by_account_name.values()
+                                     for rule_group in rules.rule_groups}
+        self._rule_set = rule_set
+
+    def _get_rules(self, account_name, rule_groups_by_name):
+        """Args:
+            account_name: full name of the uncategorized account (string).
+            rule_groups_by_name: Dictionary of the _RuleGroups already read from the config, keyed by
+                                 name, to share between accounts.  Any more that are read are added to it.
+        Returns:
+            _AccountRules for the uncategorized account.
+        """
+        parts = []
+        for rule in self._config.get_rules_for_account_name(account_name):
+            if isinstance(rule, MatchPattern):
+                if not parts or isinstance(parts[-1], _RuleGroup):
+                    parts.append(_PatternList([]))
+                parts[-1].patterns.append(rule)
+            else:
+                if rule not in rule_groups_by_name:
+                    rule_groups_by_name[rule] = self._get_rule_group(rule)
+                parts.append(rule_groups_by_name[rule])
+        return _AccountRules(parts)
+
+    def _get_rule_group(self, group_name):
+        """Returns:
+            _RuleGroup for the rule group, which is the current one if its patterns have not changed.
+        """
+        patterns = self._config.get_patterns_for_rule_group(group_name)
+        rule_group = self._rule_groups_by_name.get(group_name)
+        if rule_group is None or rule_group.patterns != patterns:
+            rule_group = _RuleGroup(group_name, patterns)
+        return rule_group
+
+    def _bind(self, rules_by_account_name):
+        """Looks up the accounts for the rules in the book, in a single pass, and attaches
+        them to the rules and their patterns.  Does nothing if there is no book.
+
+        Args:
+            rules_by_account_name: Dictionary of _AccountRules, keyed by uncategorized account name.
+
+        Raises:
+            AccountsNotFound, listing every account name that is not in the book.
+            CommodityMismatch, listing every pattern's account that is in a different commodity to
+            its uncategorized account.
+        """
+        if self._book is None:
+            return
+        account_names = set(rules_by_account_name)
+        for rules in rules_by_account_name.values():
+            account_names.update(pattern.account_name for pattern in rules.patterns)
+        accounts_by_name = self._book.get_accounts_by_name(account_names)
+        mismatched_account_names = set()
+        for account_name, rules in rules_by_account_name.items():
+            account = accounts_by_name[account_name]
+            for pattern in rules.patterns:
+                pattern_account = accounts_by_name[pattern.account_name]
+                if (account.currency is not None and pattern_account.currency is not None
+                        and account.currency != pattern_account.currency):
+                    mismatched_account_names.add((account_name, pattern.account_name))
+        if mismatched_account_names:
+            raise CommodityMismatch('Patterns cannot move splits between accounts in different commodities: '
+                                    '{}.'.format(', '.join('{} to {}'.format(*names)
+                                                           for names in sorted(mismatched_account_names))))
+        for account_name, rules in rules_by_account_name.items():
+            rules.account = accounts_by_name[account_name]
+            for pattern in rules.patterns:
+                pattern.account = accounts_by_name[pattern.account_name]
+
+
+class Explanation:
+    """How a transaction's description was matched.
+
+    Args:
+        match_pattern: The MatchPattern that matched, or None.
+        evaluations: How many patterns were tried (integer).  None are tried if the match was cached.
+        cached: Whether the match was found in the cache, from an earlier transaction with the
+                same description (boolean).
+    """
+    def __init__(self, match_pattern, evaluations, cached):
+        self.match_pattern = match_pattern
+        self.evaluations = evaluations
+        self.cached = cached
+
+    @property
+    def rule_id(self):
+        """The id of the MatchPattern that matched, or None.
+        """
+        if self.match_pattern is None:
+            return None
+        return self.match_pattern.rule_id
+
+    @property
+    def position(self):
+        """The position of the MatchPattern that matched in config order, or None.
+        """
+        if self.match_pattern is None:
+            return None
+        return self.match_pattern.position
+
+    @property
+    def group_name(self):
+        """The name of the rule group the MatchPattern that matched is in, or None.
+        """
+        if self.match_pattern is None:
+            return None
+        return self.match_pattern.group_name
+
+    def __repr__(self):
+        return "{cls}({rule_id}, evaluations={evaluations}, cached={cached})".format(
+            cls=self.__class__.__name__, rule_id=self.rule_id, evaluations=self.evaluations, cached=self.cached)
+
+
+class _CachedRules:
+    """Rules with a cache of the match for each description.
+
+    The cache is emptied once it holds MAX_CACHE_SIZE descriptions, to keep memory use bounded.
+    """
+    _NOT_CACHED = object()
+    MAX_CACHE_SIZE = 100000
+
+    def __init__(self):
+        self._matches_by_description = {}
+
+    def _cache_match(self, normalized_description, match):
+        if len(self._matches_by_description) >= self.MAX_CACHE_SIZE:
+            self._matches_by_description.clear()
+        self._matches_by_description[normalized_description] = match
+
+
+class _AccountRules(_CachedRules):
+    """The rules for a single uncategorized account, with a cache of the match for each description.
+
+    Args:
+        parts: List of _PatternLists of the account's own patterns and the _RuleGroups it refers to,
+               in order of precedence.
+    """
+    def __init__(self, parts):
+        super().__init__()
+        self.parts = parts
+        self.patterns = [pattern for part in parts for pattern in part.patterns]
+        self.rule_groups = [part for part in parts if isinstance(part, _RuleGroup)]
+        # The uncategorized account, once bound to a book
+        self.account = None
+
+    def get_match(self, normalized_description):
+        """Returns:
+            The first MatchPattern that matches the normalized description, or None.
+        """
+        match = self._matches_by_description.get(normalized_description, self._NOT_CACHED)
+        if match is self._NOT_CACHED:
+            match, _ = self._find_match(normalized_description)
+            self._cache_match(normalized_description, match)
+        return match
+
+    def explain(self, normalized_description, rule_timings=None):
+        """Args:
+            normalized_description: the normalized description of the transaction (string).
+            rule_timings: Optional dictionary to add the time spent trying each pattern to (see Matcher.explain).
+        Returns:
+            Explanation of the match for the normalized description.
+        """
+        match = self._matches_by_description.get(normalized_description, self._NOT_CACHED)
+        if match is not self._NOT_CACHED:
+            return Explanation(match_pattern=match, evaluations=0, cached=True)
+        if rule_timings is None:
+            match, evaluations = self._find_match(normalized_description)
+        else:
+            match, evaluations = self._find_match_timed(normalized_description, rule_timings)
+        self._cache_match(normalized_description, match)
+        return Explanation(match_pattern=match, evaluations=evaluations, cached=False)
+
+    def _find_match(self, normalized_description):
+        """Returns:
+            Two-tuple of the first MatchPattern that matches, or None, and how many patterns were tried.
+        """
+        evaluations = 0
+        for part in self.parts:
+            match, part_evaluations = part.find_match(normalized_description)
+            evaluations += part_evaluations
+            if match is not None:
+                return match, evaluations
+        return None, evaluations
+
+    def _find_match_timed(self, normalized_description, rule_timings):
+        """Finds the match in the same way as _find_match, adding the time spent trying each pattern
+        to rule_timings.
+        """
+        evaluations = 0
+        for part in self.parts:
+            match, part_evaluations = part.find_match_timed(normalized_description, rule_timings)
+            evaluations += part_evaluations
+            if match is not None:
+                return match, evaluations
+        return None, evaluations
+
+
+class _PatternList:
+    """Patterns that are tried in order of precedence.
+
+    Args:
+        patterns: List of MatchPatterns, in order of precedence.
+    """
+    def __init__(self, patterns):
+        self.patterns = patterns
+
+    def find_match(self, normalized_description):
+        """Returns:
+            Two-tuple of the first MatchPattern that matches, or None, and how many patterns were tried.
+        """
+        for evaluations, pattern in enumerate(self.patterns, start=1):
+            if pattern.is_match(normalized_description):
+                return pattern, evaluations
+        return None, len(self.patterns)
+
+    def find_match_timed(self, normalized_description, rule_timings):
+        """Finds the match in the same way as find_match, adding the time spent trying each pattern
+        to rule_timings.  Kept separate so that matching is not slowed down when the patterns are not timed.
+        """
+        for evaluations, pattern in enumerate(self.patterns, start=1):
+            started = time.perf_counter()
+            is_match = pattern.is_match(normalized_description)
+            rule_timings[pattern] = rule_timings.get(pattern, 0.0) + time.perf_counter() - started
+            if is_match:
+                return pattern, evaluations
+        return None, len(self.patterns)
+
+
+class _RuleGroup(_CachedRules, _PatternList):
+    """The patterns of a rule group, shared by every uncategorized account that refers to it, with a
+    cache of the match for each description.  No patterns are tried for a cached description.
+
+    Args:
+        name: Name of the rule group (string).
+        patterns: List of MatchPatterns, in order of precedence.
+    """
+    def __init__(self, name, patterns):
+        _CachedRules.__init__(self)
+        _PatternList.__init__(self, patterns)
+        self.name = name
+
+    def find_match(self, normalized_description):
+        match = self._matches_by_description.get(normalized_description, self._NOT_CACHED)
+        if match is not self._NOT_CACHED:
+            return match, 0
+        match, evaluations = super().find_match(normalized_description)
+        self._cache_match(normalized_description, match)
+        return match, evaluations
+
+    def find_match_timed(self, normalized_description, rule_timings):
+        match = self._matches_by_description.get(normalized_description, self._NOT_CACHED)
+        if match is not self._NOT_CACHED:
+            return match, 0
+        match, evaluations = super().find_match_timed(normalized_description, rule_timings)
+        self._cache_match(normalized_description, match)
+        return match, evaluations
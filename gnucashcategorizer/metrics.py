@@ -0,0 +1,250 @@
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+
+
+class RunMetrics:
+    """Measurements of a categorization run, that can be written to a file for monitoring.
+
+    The measurements are:
+
+        - How many uncategorized splits were loaded.
+        - How many splits were in each uncategorized account, and how many of them matched a rule.
+        - A histogram of how many patterns were tried for each split.  A split whose description
+          was already matched for an earlier split needs none.
+        - The time spent in each phase of the run, e.g. loading and matching.
+        - How many SQL statements were run against the book.
+        - The rules that took the most time to try.
+
+    Splits are loaded on one thread and matched on another, so the time spent in each phase
+    can be recorded from any thread.
+
+    Usage:
+
+        metrics = RunMetrics()
+        book.listen_for_statements(metrics.count_statement)
+        with metrics.time_phase('save'):
+            ...
+        metrics.write('categorize.prom')
+    """
+    # The upper bounds of the buckets of the histogram of patterns tried per split
+    EVALUATION_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+    # How many of the slowest rules to include
+    SLOWEST_RULE_COUNT = 10
+    # Files ending with this are written in the Prometheus text format, and any others as JSON
+    PROMETHEUS_SUFFIX = '.prom'
+    PROMETHEUS_PREFIX = 'gnucash_categorizer_'
+
+    def __init__(self):
+        self.splits_loaded = 0
+        self.sql_statements = 0
+        self._splits_by_account_name = Counter()
+        self._matches_by_account_name = Counter()
+        # The number of splits in each bucket of the histogram, with an extra bucket for more than the last
+        self._evaluation_bucket_counts = [0] * (len(self.EVALUATION_BUCKETS) + 1)
+        self._evaluations_total = 0
+        self._phase_seconds = {}
+        self._phase_lock = threading.Lock()
+        # Time spent trying each pattern, in seconds, keyed by MatchPattern (see Matcher.explain)
+        self.rule_timings = {}
+
+    def count_statement(self):
+        """Counts an SQL statement run against the book.
+        """
+        self.sql_statements += 1
+
+    def record_match(self, account_name, explanation):
+        """Records how a split was matched.
+
+        Args:
+            account_name: Full name of the uncategorized account the split is in (string).
+            explanation: Explanation of how the split was matched.
+        """
+        self._splits_by_account_name[account_name] += 1
+        if explanation.match_pattern is not None:
+            self._matches_by_account_name[account_name] += 1
+        self._evaluation_bucket_counts[bisect_left(self.EVALUATION_BUCKETS, explanation.evaluations)] += 1
+        self._evaluations_total += explanation.evaluations
+
+    @contextmanager
+    def time_phase(self, phase):
+        """Adds the time spent in the block to the phase.
+
+        Args:
+            phase: The name of the phase, e.g. 'save' (string).
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._add_phase_seconds(phase, time.perf_counter() - started)
+
+    def time_iteration(self, phase, iterable):
+        """Yields the items from the iterable, adding the time spent getting each one to the phase,
+        but not the time spent using it.
+
+        Args:
+            phase: The name of the phase, e.g. 'load' (string).
+            iterable: Any iterable.
+        """
+        iterator = iter(iterable)
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self._add_phase_seconds(phase, time.perf_counter() - started)
+            yield item
+
+    def as_dict(self):
+        """Returns:
+            Dictionary of the measurements, that can be written as JSON.
+        """
+        evaluation_count = sum(self._evaluation_bucket_counts)
+        return {
+            'splits_loaded': self.splits_loaded,
+            'accounts': {
+                account_name: {
+                    'splits': split_count,
+                    'matched': self._matches_by_account_name[account_name],
+                    'match_rate': self._matches_by_account_name[account_name] / split_count,
+                }
+                for account_name, split_count in sorted(self._splits_by_account_name.items())
+            },
+            'patterns_evaluated': {
+                'buckets': dict(self._get_cumulative_buckets()),
+                'sum': self._evaluations_total,
+                'count': evaluation_count,
+            },
+            'phase_seconds': dict(sorted(self._phase_seconds.items())),
+            'sql_statements': self.sql_statements,
+            'slowest_rules': [
+                {
+                    'rule_id': pattern.rule_id,
+                    'pattern': pattern.pattern,
+                    'account': pattern.account_name,
+                    'seconds': seconds,
+                }
+                for pattern, seconds in self._get_slowest_rules()
+            ],
+        }
+
+    def as_prometheus_text(self):
+        """Returns:
+            The measurements in the Prometheus text format, e.g. for the node exporter's textfile collector.
+        """
+        metrics = self.as_dict()
+        lines = []
+        self._add_prometheus_metric(lines, 'splits_loaded', 'gauge', 'Uncategorized splits loaded from the book.',
+                                    [({}, metrics['splits_loaded'])])
+        for name, key, description in (
+            ('account_splits', 'splits', 'Splits in each uncategorized account.'),
+            ('account_matched_splits', 'matched', 'Splits in each uncategorized account that matched a rule.'),
+            ('account_match_rate', 'match_rate', 'Fraction of the splits in each uncategorized account that matched.'),
+        ):
+            self._add_prometheus_metric(lines, name, 'gauge', description, [
+                ({'account': account_name}, account_metrics[key])
+                for account_name, account_metrics in metrics['accounts'].items()
+            ])
+        histogram = metrics['patterns_evaluated']
+        self._add_prometheus_metric(
+            lines, 'patterns_evaluated', 'histogram', 'Patterns tried for each split.',
+            [({'le': le}, count) for le, count in histogram['buckets'].items()], suffix='_bucket')
+        lines.append('{}patterns_evaluated_sum {}'.format(self.PROMETHEUS_PREFIX, histogram['sum']))
+        lines.append('{}patterns_evaluated_count {}'.format(self.PROMETHEUS_PREFIX, histogram['count']))
+        self._add_prometheus_metric(lines, 'phase_seconds', 'gauge', 'Time spent in each phase of the run.', [
+            ({'phase': phase}, seconds) for phase, seconds in metrics['phase_seconds'].items()
+        ])
+        self._add_prometheus_metric(lines, 'sql_statements', 'gauge', 'SQL statements run against the book.',
+                                    [({}, metrics['sql_statements'])])
+        self._add_prometheus_metric(lines, 'rule_seconds', 'gauge', 'Time spent trying the slowest rules.', [
+            ({'rule_id': rule['rule_id'], 'account': rule['account']}, rule['seconds'])
+            for rule in metrics['slowest_rules']
+        ])
+        return '\n'.join(lines) + '\n'
+
+    def write(self, filename):
+        """Writes the measurements to a file, in the Prometheus text format if the filename ends
+        with PROMETHEUS_SUFFIX, or as JSON otherwise.
+
+        The file is replaced in one step, so anything reading it never sees it half written.
+
+        Args:
+            filename: The filename and path of the metrics file (string).
+        """
+        if filename.endswith(self.PROMETHEUS_SUFFIX):
+            content = self.as_prometheus_text()
+        else:
+            content = json.dumps(self.as_dict(), indent=2) + '\n'
+        temporary_filename = filename + '.tmp'
+        with open(temporary_filename, 'w') as metrics_file:
+            metrics_file.write(content)
+        os.replace(temporary_filename, filename)
+
+    def _add_phase_seconds(self, phase, seconds):
+        with self._phase_lock:
+            self._phase_seconds[phase] = self._phase_seconds.get(phase, 0.0) + seconds
+
+    def _get_cumulative_buckets(self):
+        """Returns:
+            List of two-tuples, for each bucket of the histogram of patterns tried:
+                - The upper bound of the bucket, as a string, with '+Inf' for the last.
+                - How many splits needed that many patterns or fewer.
+        """
+        buckets = []
+        cumulative_count = 0
+        for le, count in zip(self.EVALUATION_BUCKETS + ('+Inf',), self._evaluation_bucket_counts):
+            cumulative_count += count
+            buckets.append((str(le), cumulative_count))
+        return buckets
+
+    def _get_slowest_rules(self):
+        """Returns:
+            List of (MatchPattern, seconds) two-tuples, for the rules that took the most time to try, slowest first.
+        """
+        return sorted(self.rule_timings.items(), key=lambda item: item[1], reverse=True)[:self.SLOWEST_RULE_COUNT]
+
+    def _add_prometheus_metric(self, lines, name, metric_type, description, samples, suffix=''):
+        """Adds the lines for a metric in the Prometheus text format.
+
+        Args:
+            lines: List of lines to add to.
+            name: The name of the metric, without the prefix (string).
+            metric_type: The Prometheus type of the metric, e.g. 'gauge' (string).
+            description: What the metric measures (string).
+            samples: List of two-tuples of the labels (dictionary) and value (number) of each sample.
+            suffix: Added to the name of each sample, e.g. '_bucket' for histograms (string).
+        """
+        full_name = self.PROMETHEUS_PREFIX + name
+        lines.append('# HELP {} {}'.format(full_name, description))
+        lines.append('# TYPE {} {}'.format(full_name, metric_type))
+        for labels, value in samples:
+            label_text = ','.join('{}="{}"'.format(label, self._escape_label_value(label_value))
+                                  for label, label_value in labels.items())
+            lines.append('{}{}{} {}'.format(full_name, suffix, '{' + label_text + '}' if labels else '', value))
+
+    def _escape_label_value(self, value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def time_phase(metrics, phase):
+    """Times a block as part of a phase, if there are metrics to record it in.
+
+    Usage:
+
+        with time_phase(metrics, 'save'):
+            ...
+
+    Args:
+        metrics: RunMetrics object, or None.
+        phase: The name of the phase (string).
+    """
+    if metrics is None:
+        return nullcontext()
+    return metrics.time_phase(phase)
@@ -0,0 +1,99 @@
+import re
+import unicodedata
+
+
+class DescriptionNormalizer:
+    """Cleans up noisy bank descriptions before they are matched against patterns,
+    e.g. 'CARD 1234 TESCO 12/03' -> 'tesco'.
+
+    Each unique raw description is only normalized once; the result is cached.  The cache is
+    emptied once it holds MAX_CACHE_SIZE descriptions, so memory use stays bounded however many
+    unique descriptions there are.
+
+    Args:
+        strip_references: whether to remove references such as 'REF 123ABC' or 'CARD 1234' (boolean).
+        strip_digits: whether to remove any words containing digits, such as dates and numbers (boolean).
+        collapse_whitespace: whether to collapse runs of whitespace into a single space,
+                             and trim the ends (boolean).
+        casefold: whether to make the description case insensitive (boolean).
+        strip_accents: whether to make the description insensitive to accents and other variants of the
+                       same character, such as 'É' and 'E', or 'ﬁ' and 'fi' (boolean).
+        reference_patterns: list of regular expressions (strings) describing references.
+                            Defaults to DEFAULT_REFERENCE_PATTERNS.
+    """
+    DEFAULT_REFERENCE_PATTERNS = [
+        r'\bREF(?:ERENCE)?\b\s*[:.]?\s*\S+',
+        r'\bCARD\s+\d+',
+    ]
+    # A word made up of digits and the characters typically found in dates, times and amounts
+    DIGITS_PATTERN = r'[^\s\d]*\d[^\s]*'
+    WHITESPACE_PATTERN = r'\s+'
+    MAX_CACHE_SIZE = 100000
+
+    def __init__(self, strip_references=False, strip_digits=False, collapse_whitespace=False,
+                 casefold=False, strip_accents=False, reference_patterns=None):
+        self.strip_references = strip_references
+        self.strip_digits = strip_digits
+        self.collapse_whitespace = collapse_whitespace
+        self.casefold = casefold
+        self.strip_accents = strip_accents
+        if reference_patterns is None:
+            reference_patterns = self.DEFAULT_REFERENCE_PATTERNS
+        self._reference_regexes = [re.compile(pattern, re.IGNORECASE) for pattern in reference_patterns]
+        self._digits_regex = re.compile(self.DIGITS_PATTERN)
+        self._whitespace_regex = re.compile(self.WHITESPACE_PATTERN)
+        self._cache = {}
+
+    def normalize(self, description):
+        """Args:
+            description: a description from a transaction (string).
+        Returns:
+            The normalized description (string).
+        """
+        try:
+            return self._cache[description]
+        except KeyError:
+            if len(self._cache) >= self.MAX_CACHE_SIZE:
+                self._cache.clear()
+            normalized = self._cache[description] = self._normalize(description)
+            return normalized
+
+    def _normalize(self, description):
+        if self.strip_references:
+            for regex in self._reference_regexes:
+                description = regex.sub(' ', description)
+        if self.strip_digits:
+            description = self._digits_regex.sub(' ', description)
+        if self.collapse_whitespace:
+            description = self._whitespace_regex.sub(' ', description).strip()
+        return self._fold(description)
+
+    def _fold(self, text):
+        """Applies the case and accent steps, which apply to both descriptions and patterns.
+        """
+        if self.strip_accents:
+            # Split each character into its base character and any combining marks, so that characters
+            # such as '™' become plain letters before they are casefolded.
+            text = unicodedata.normalize('NFKD', text)
+        if self.casefold:
+            text = text.casefold()
+        if self.strip_accents:
+            # Casefolding can compose characters again, so split them once more before dropping the marks.
+            text = ''.join(character for character in unicodedata.normalize('NFKD', text)
+                           if not unicodedata.combining(character))
+        return text
+
+    def normalize_pattern(self, pattern):
+        """Brings a pattern into line with the normalized descriptions it will be matched against.
+
+        Only the whitespace, case and accent steps apply to patterns, as the other steps
+        would strip out wildcards and literal text written deliberately by the user.
+
+        Args:
+            pattern: text to match to a description (string).
+        Returns:
+            The normalized pattern (string).
+        """
+        if self.collapse_whitespace:
+            pattern = self._whitespace_regex.sub(' ', pattern).strip()
+        return self._fold(pattern)
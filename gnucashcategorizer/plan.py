@@ -0,0 +1,118 @@
+import json
+
+
+class BookChanged(Exception):
+    """Raised when a plan no longer applies, because the uncategorized accounts
+    in the book have changed since the plan was made.
+    """
+    pass
+
+
+class PlanEntry:
+    """A single change to make to the book: moving a split from one account to another.
+
+    Args:
+        split_guid: guid of the split to move (string).
+        old_account_guid: guid of the account the split was in when the plan was made (string).
+        new_account_guid: guid of the account to move the split to (string).
+        rule_id: id of the MatchPattern that suggested the change (string).
+    """
+    def __init__(self, split_guid, old_account_guid, new_account_guid, rule_id):
+        self.split_guid = split_guid
+        self.old_account_guid = old_account_guid
+        self.new_account_guid = new_account_guid
+        self.rule_id = rule_id
+
+    @classmethod
+    def from_suggestion(cls, suggestion):
+        """Args:
+            suggestion: Suggestion object.
+        Returns:
+            PlanEntry for the change the suggestion makes.
+        """
+        return cls(split_guid=suggestion.split.guid,
+                   old_account_guid=suggestion.old_account.guid,
+                   new_account_guid=suggestion.new_account.guid,
+                   rule_id=suggestion.rule_id)
+
+    def as_list(self):
+        """Returns:
+            The entry as a list, for writing to a plan file.
+        """
+        return [self.split_guid, self.old_account_guid, self.new_account_guid, self.rule_id]
+
+    def __eq__(self, other):
+        return hash(self) == hash(other)
+
+    def __hash__(self):
+        return hash(tuple(self.as_list()))
+
+    def __repr__(self):
+        return "{cls}({split_guid}, {old_account_guid}, {new_account_guid}, {rule_id})".format(
+            cls=self.__class__.__name__, **self.__dict__)
+
+
+class Plan:
+    """A reviewed set of suggestions, saved so they can be applied to the book later without matching again.
+
+    Args:
+        book_fingerprint: fingerprint of the uncategorized accounts when the plan was made (string).
+        account_guids: guids of the uncategorized accounts (list of strings).
+        entries: list of PlanEntry objects.
+    """
+    FORMAT_VERSION = 1
+
+    def __init__(self, book_fingerprint, account_guids, entries):
+        self.book_fingerprint = book_fingerprint
+        self.account_guids = account_guids
+        self.entries = entries
+
+    @classmethod
+    def from_suggestions(cls, suggestions, book_fingerprint, account_guids):
+        """Args:
+            suggestions: list of Suggestion objects.
+            book_fingerprint: fingerprint of the uncategorized accounts (string).
+            account_guids: guids of the uncategorized accounts (list of strings).
+        Returns:
+            Plan object.
+        """
+        entries = [PlanEntry.from_suggestion(suggestion) for suggestion in suggestions]
+        return cls(book_fingerprint=book_fingerprint, account_guids=account_guids, entries=entries)
+
+    def check_fingerprint(self, book_fingerprint):
+        """Args:
+            book_fingerprint: the current fingerprint of the uncategorized accounts (string).
+        Raises:
+            BookChanged, if the book has changed since the plan was made.
+        """
+        if book_fingerprint != self.book_fingerprint:
+            raise BookChanged('The uncategorized accounts have changed since the plan was made.')
+
+    def write(self, filename):
+        """Saves the plan to the supplied filename.
+        """
+        plan_dict = {
+            'version': self.FORMAT_VERSION,
+            'book_fingerprint': self.book_fingerprint,
+            'account_guids': self.account_guids,
+            'entries': [entry.as_list() for entry in self.entries],
+        }
+        with open(filename, 'w') as plan_file:
+            json.dump(plan_dict, plan_file, separators=(',', ':'))
+
+    @classmethod
+    def read(cls, filename):
+        """Loads a plan from the supplied filename.
+
+        Returns:
+            Plan object.
+        Raises:
+            ValueError, if the file is not a plan in a supported format.
+        """
+        with open(filename) as plan_file:
+            plan_dict = json.load(plan_file)
+        if plan_dict.get('version') != cls.FORMAT_VERSION:
+            raise ValueError('{} is not a version {} plan file.'.format(filename, cls.FORMAT_VERSION))
+        return cls(book_fingerprint=plan_dict['book_fingerprint'],
+                   account_guids=plan_dict['account_guids'],
+                   entries=[PlanEntry(*entry) for entry in plan_dict['entries']])
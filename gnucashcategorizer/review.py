@@ -0,0 +1,289 @@
+import curses
+from collections import defaultdict
+from moneyed.localization import format_money
+
+
+class ReviewList:
+    """The state of an interactive review: which suggestions are accepted, which are shown
+    by the current filter, and where the cursor is.
+
+    Every suggestion starts off accepted.  Only the indices of the suggestions are kept for
+    the filtered rows, and only the rows that fit on the screen are ever formatted, so
+    the list stays responsive however many suggestions there are.
+
+    Args:
+        suggestions: List of Suggestions.
+    """
+    def __init__(self, suggestions):
+        self._suggestions = suggestions
+        self._rejected_indices = set()
+        self._search_texts = None
+        self._indices_by_rule_id = None
+        self.filter_text = ''
+        self._visible_indices = range(len(suggestions))
+        # Position of the cursor, and of the first row on screen, within the visible rows
+        self.cursor = 0
+        self.top = 0
+
+    @property
+    def visible_count(self):
+        return len(self._visible_indices)
+
+    @property
+    def accepted_count(self):
+        return len(self._suggestions) - len(self._rejected_indices)
+
+    @property
+    def total_count(self):
+        return len(self._suggestions)
+
+    def set_filter(self, filter_text):
+        """Shows only the suggestions whose date, description, accounts or rule id contain the text,
+        ignoring case.
+
+        Args:
+            filter_text: The text to look for, or an empty string to show all the suggestions.
+        """
+        self.filter_text = filter_text
+        if filter_text:
+            folded_text = filter_text.casefold()
+            self._visible_indices = [index for index, search_text in enumerate(self._get_search_texts())
+                                     if folded_text in search_text]
+        else:
+            self._visible_indices = range(len(self._suggestions))
+        self.cursor = self.top = 0
+
+    def get_rows(self, height):
+        """Gets the rows to show on screen, scrolling so that the cursor is on screen.
+
+        Args:
+            height: How many rows fit on the screen (integer).
+
+        Returns:
+            List of three-tuples:
+                - Suggestion.
+                - Whether it is accepted (boolean).
+                - Whether it is under the cursor (boolean).
+        """
+        if self.cursor < self.top:
+            self.top = self.cursor
+        elif self.cursor >= self.top + height:
+            self.top = self.cursor - height + 1
+        rows = []
+        for position in range(self.top, min(self.top + height, self.visible_count)):
+            index = self._visible_indices[position]
+            rows.append((self._suggestions[index], index not in self._rejected_indices, position == self.cursor))
+        return rows
+
+    def move(self, offset):
+        """Moves the cursor up (negative) or down (positive) by a number of rows, stopping at either end.
+        """
+        self.cursor = max(0, min(self.visible_count - 1, self.cursor + offset))
+
+    def toggle(self):
+        """Accepts the suggestion under the cursor if it is rejected, or rejects it if it is accepted.
+        """
+        index = self._get_cursor_index()
+        if index is None:
+            return
+        if index in self._rejected_indices:
+            self._rejected_indices.remove(index)
+        else:
+            self._rejected_indices.add(index)
+
+    def set_rule_accepted(self, accepted):
+        """Accepts or rejects every suggestion made by the same rule as the one under the cursor,
+        whether or not they are shown by the filter.
+        """
+        index = self._get_cursor_index()
+        if index is None:
+            return
+        rule_id = self._suggestions[index].rule_id
+        self._set_accepted(self._get_indices_by_rule_id()[rule_id], accepted)
+
+    def set_visible_accepted(self, accepted):
+        """Accepts or rejects every suggestion shown by the filter.
+        """
+        self._set_accepted(self._visible_indices, accepted)
+
+    def get_accepted_suggestions(self):
+        """Returns:
+            List of the accepted Suggestions, in their original order.
+        """
+        return [suggestion for index, suggestion in enumerate(self._suggestions)
+                if index not in self._rejected_indices]
+
+    def _set_accepted(self, indices, accepted):
+        if accepted:
+            self._rejected_indices.difference_update(indices)
+        else:
+            self._rejected_indices.update(indices)
+
+    def _get_cursor_index(self):
+        """Returns:
+            The index of the suggestion under the cursor, or None if no suggestions are shown.
+        """
+        if not self.visible_count:
+            return None
+        return self._visible_indices[self.cursor]
+
+    def _get_search_texts(self):
+        """Gets the text to filter each suggestion by, only working it out the first time it is needed.
+        """
+        if self._search_texts is None:
+            self._search_texts = [
+                '\0'.join(str(part) for part in (
+                    suggestion.date.strftime('%d/%m/%Y'),
+                    suggestion.description,
+                    suggestion.old_account,
+                    suggestion.new_account,
+                    suggestion.rule_id,
+                )).casefold()
+                for suggestion in self._suggestions
+            ]
+        return self._search_texts
+
+    def _get_indices_by_rule_id(self):
+        """Gets the indices of the suggestions made by each rule, only working them out the first time.
+        """
+        if self._indices_by_rule_id is None:
+            self._indices_by_rule_id = defaultdict(list)
+            for index, suggestion in enumerate(self._suggestions):
+                self._indices_by_rule_id[suggestion.rule_id].append(index)
+        return self._indices_by_rule_id
+
+
+class ReviewScreen:
+    """A full screen, scrollable list of suggestions for the user to accept or reject, drawn with curses.
+
+    Only the rows that fit on the screen are drawn each time a key is pressed.
+
+    Args:
+        review_list: ReviewList object.
+    """
+    COLUMN_WIDTHS = [12, 36, 14, 36, 10]
+    HEADINGS = ['Date', 'Description', 'Amount', 'New account', 'Rule']
+    HELP = ('Up/Down/PgUp/PgDn move  Space toggle  a/r accept/reject rule  '
+            'A/R accept/reject shown  / filter  Enter save  q quit')
+    # Lines used by the headings at the top, and the status and help at the bottom
+    HEADER_LINES = 2
+    FOOTER_LINES = 2
+    KEY_ENTER = (curses.KEY_ENTER, ord('\n'), ord('\r'))
+    KEY_ESCAPE = 27
+    KEY_BACKSPACE = (curses.KEY_BACKSPACE, 127, 8)
+
+    def __init__(self, review_list):
+        self._review_list = review_list
+        self._filtering = False
+
+    def run(self, window):
+        """Lets the user review the suggestions until they save or quit.
+
+        Args:
+            window: The curses window to draw on.
+
+        Returns:
+            Whether the user chose to save the accepted suggestions (boolean).
+        """
+        curses.curs_set(0)
+        window.keypad(True)
+        while True:
+            self._draw(window)
+            key = window.getch()
+            if self._filtering:
+                self._handle_filter_key(key)
+                continue
+            if key in self.KEY_ENTER:
+                return True
+            if key == ord('q'):
+                return False
+            self._handle_key(key, page_height=self._get_page_height(window))
+
+    def _handle_key(self, key, page_height):
+        review_list = self._review_list
+        movements = {
+            curses.KEY_UP: -1, ord('k'): -1,
+            curses.KEY_DOWN: 1, ord('j'): 1,
+            curses.KEY_PPAGE: -page_height,
+            curses.KEY_NPAGE: page_height,
+            curses.KEY_HOME: -review_list.visible_count,
+            curses.KEY_END: review_list.visible_count,
+        }
+        if key in movements:
+            review_list.move(movements[key])
+        elif key == ord(' '):
+            review_list.toggle()
+        elif key in (ord('a'), ord('r')):
+            review_list.set_rule_accepted(key == ord('a'))
+        elif key in (ord('A'), ord('R')):
+            review_list.set_visible_accepted(key == ord('A'))
+        elif key == ord('/'):
+            self._filtering = True
+
+    def _handle_filter_key(self, key):
+        """Updates the filter as the user types it, until they press Enter or Escape.
+        """
+        review_list = self._review_list
+        if key in self.KEY_ENTER:
+            self._filtering = False
+        elif key == self.KEY_ESCAPE:
+            self._filtering = False
+            review_list.set_filter('')
+        elif key in self.KEY_BACKSPACE:
+            review_list.set_filter(review_list.filter_text[:-1])
+        elif 32 <= key < 0x110000 and chr(key).isprintable():
+            review_list.set_filter(review_list.filter_text + chr(key))
+
+    def _get_page_height(self, window):
+        height, _ = window.getmaxyx()
+        return max(1, height - self.HEADER_LINES - self.FOOTER_LINES)
+
+    def _draw(self, window):
+        review_list = self._review_list
+        height, width = window.getmaxyx()
+        window.erase()
+        self._draw_line(window, 0, width, '    ' + self._format_cells(self.HEADINGS), curses.A_BOLD)
+        self._draw_line(window, 1, width, '-' * (width - 1))
+        for line, (suggestion, accepted, selected) in enumerate(review_list.get_rows(self._get_page_height(window)),
+                                                                start=self.HEADER_LINES):
+            text = '[{}] {}'.format('x' if accepted else ' ', self._format_cells([
+                suggestion.date.strftime('%d/%m/%Y'),
+                suggestion.description,
+                format_money(suggestion.amount, locale='en_GB'),
+                suggestion.new_account,
+                suggestion.rule_id or '',
+            ]))
+            self._draw_line(window, line, width, text, curses.A_REVERSE if selected else curses.A_NORMAL)
+        status = '{} of {} accepted, {} shown'.format(
+            review_list.accepted_count, review_list.total_count, review_list.visible_count)
+        if self._filtering or review_list.filter_text:
+            status += '  Filter: {}'.format(review_list.filter_text)
+        self._draw_line(window, height - 2, width, status, curses.A_BOLD)
+        self._draw_line(window, height - 1, width, self.HELP)
+        window.refresh()
+
+    def _draw_line(self, window, line, width, text, attributes=curses.A_NORMAL):
+        try:
+            window.addnstr(line, 0, text, width - 1, attributes)
+        except curses.error:
+            # The terminal is too small to fit the line.
+            pass
+
+    def _format_cells(self, cells):
+        return ' '.join('{: <{width}}'.format(str(cell)[:width - 1], width=width)
+                        for cell, width in zip(cells, self.COLUMN_WIDTHS))
+
+
+def review_suggestions(suggestions):
+    """Lets the user accept or reject each of the suggestions on an interactive screen.
+
+    Args:
+        suggestions: List of Suggestions.
+
+    Returns:
+        List of the accepted Suggestions, or None if the user quit without saving.
+    """
+    review_list = ReviewList(suggestions)
+    if not curses.wrapper(ReviewScreen(review_list).run):
+        return None
+    return review_list.get_accepted_suggestions()
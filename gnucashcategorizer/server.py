@@ -0,0 +1,162 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from .matcher import Matcher
+
+
+class InvalidRequest(Exception):
+    """Raised when a request to the server is not in the expected format.
+    """
+    pass
+
+
+class Classifier:
+    """Gets the account each of a batch of transactions should be moved to.
+
+    The patterns are read from the config once, and shared between all the requests.
+    Each batch picks up any changes made to the config file since the last one.  If the changed
+    config cannot be loaded, the old patterns are used, and it is tried again with the next batch.
+
+    Args:
+        config: Config object.
+    """
+    def __init__(self, config):
+        self._matcher = Matcher(config)
+
+    def classify(self, records):
+        """Args:
+            records: List of dictionaries, each with:
+                - 'account': the full name of the uncategorized account the transaction is in (string).
+                - 'description': the description of the transaction (string).
+                - 'amount': optionally, the amount of the transaction.  It is not used for matching.
+
+        Returns:
+            List of dictionaries, one for each record in the same order, with:
+                - 'account': the full name of the account to move the transaction to, or None (string).
+                - 'rule_id': the id of the pattern that matched, or None (string).
+
+        Raises:
+            InvalidRequest, if the records are not in the expected format.
+        """
+        if not isinstance(records, list):
+            raise InvalidRequest('The records must be a list.')
+        self._matcher.reload()
+        results = []
+        for index, record in enumerate(records):
+            try:
+                account_name, description = record['account'], record['description']
+            except (KeyError, TypeError):
+                raise InvalidRequest('Record {} must have an account and a description.'.format(index))
+            if not isinstance(account_name, str) or not isinstance(description, str):
+                raise InvalidRequest('The account and description of record {} must be strings.'.format(index))
+            match_pattern = self._matcher.get_match(account_name, description)
+            if match_pattern is None:
+                results.append({'account': None, 'rule_id': None})
+            else:
+                results.append({'account': match_pattern.account_name, 'rule_id': match_pattern.rule_id})
+        return results
+
+
+class LatencyStats:
+    """Keeps track of how long the server takes to handle requests.  Safe to use from many threads.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._count = 0
+        self._total = 0.0
+        self._max = 0.0
+
+    def record(self, seconds):
+        """Args:
+            seconds: how long a request took (float).
+        """
+        with self._lock:
+            self._count += 1
+            self._total += seconds
+            self._max = max(self._max, seconds)
+
+    def as_dict(self):
+        """Returns:
+            Dictionary of the number of requests, and the mean and maximum latency in milliseconds.
+        """
+        with self._lock:
+            mean = self._total / self._count if self._count else 0.0
+            return {
+                'requests': self._count,
+                'mean_latency_ms': mean * 1000,
+                'max_latency_ms': self._max * 1000,
+            }
+
+
+class ClassificationRequestHandler(BaseHTTPRequestHandler):
+    """Handles requests to the classification server:
+
+        POST /classify  {"records": [{"account": ..., "description": ..., "amount": ...}, ...]}
+        GET /stats
+    """
+    CLASSIFY_PATH = '/classify'
+    STATS_PATH = '/stats'
+
+    def do_POST(self):
+        started = time.perf_counter()
+        if self.path != self.CLASSIFY_PATH:
+            self._send_json(404, {'error': 'Not found.'})
+            return
+        try:
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+            except ValueError:
+                length = -1
+            # A negative length would read until the client closes the connection
+            if length < 0:
+                raise InvalidRequest('The Content-Length header must be a number of bytes.')
+            try:
+                body = json.loads(self.rfile.read(length).decode('utf-8'))
+            except ValueError:
+                raise InvalidRequest('The request body must be JSON.')
+            if not isinstance(body, dict):
+                raise InvalidRequest('The request body must be a JSON object.')
+            results = self.server.classifier.classify(body.get('records'))
+        except InvalidRequest as e:
+            self._send_json(400, {'error': str(e)})
+            return
+        elapsed = time.perf_counter() - started
+        self.server.latency_stats.record(elapsed)
+        self._send_json(200, {'results': results, 'latency_ms': elapsed * 1000})
+
+    def do_GET(self):
+        if self.path != self.STATS_PATH:
+            self._send_json(404, {'error': 'Not found.'})
+            return
+        self._send_json(200, self.server.latency_stats.as_dict())
+
+    def log_message(self, format, *args):
+        # Don't write a line to stderr for every request.
+        pass
+
+    def _send_json(self, status, content):
+        body = json.dumps(content).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def make_server(config, host, port):
+    """Makes a server that classifies transactions over HTTP, handling each request on its own thread.
+
+    Args:
+        config: Config object.
+        host: The host name or address to listen on (string).
+        port: The port to listen on, or 0 for any free port (integer).
+
+    Returns:
+        ThreadingHTTPServer, ready to serve_forever.
+    """
+    server = ThreadingHTTPServer((host, port), ClassificationRequestHandler)
+    server.daemon_threads = True
+    server.classifier = Classifier(config)
+    server.latency_stats = LatencyStats()
+    return server
@@ -0,0 +1,479 @@
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from datetime import date, datetime
+from decimal import Decimal
+from fractions import Fraction
+from moneyed import Money
+from .book import AccountsNotFound, fingerprint_rows, get_currency_for_commodity, OppositeAccountNotDetermined, SplitRow
+
+
+class SnapshotBook:
+    """Read only adapter for a snapshot of a GnuCash book: a columnar file holding just the data the
+    categorizer needs from every split, which is memory-mapped rather than read.
+
+    Making a snapshot once, and running the categorizer from it many times, e.g. while tuning the
+    patterns, saves opening the database and loading the splits into the ORM each time.  As the
+    fingerprint of a snapshot is worked out in the same way as Book's, a plan made from a snapshot
+    can be applied to the book, as long as the book has not changed since the snapshot was made.
+
+    The file starts with MAGIC, then the length of a JSON header, then the header, which lists the
+    accounts and where each column starts.  Each column is an array with a value for each split
+    (or transaction, or description), in the machine's own byte order.  The splits of each
+    transaction are kept together, and the descriptions are kept once each, in a string table.
+
+    Usage:
+
+        SnapshotBook.write(Book('accounts.gnucash'), 'accounts.snapshot')
+        book = SnapshotBook('accounts.snapshot')
+
+    Args:
+        filename: The filename and path to the snapshot file (string).
+    """
+    MAGIC = b'GNCSNAP1'
+    # The format of the length of the header that follows the magic
+    HEADER_LENGTH_FORMAT = '<Q'
+    # Columns are aligned to this many bytes, so they can be cast to arrays of any type
+    ALIGNMENT = 8
+    GUID_BYTES = 16
+    # The type of each column, as an array typecode, in the order they are written
+    COLUMN_TYPECODES = {
+        # The guids of the splits, 16 bytes each
+        'split_guids': 'B',
+        'transaction_guids': 'B',
+        # For each split, the index of its transaction, and of its account in the header's list of accounts
+        'split_transactions': 'I',
+        'split_accounts': 'I',
+        # For each transaction, the index of its first split, with an extra entry for the end
+        'transaction_starts': 'I',
+        # For each account, the indices of its splits in split order, starting at the account's entry
+        # in account_starts, which has an extra entry for the end
+        'account_splits': 'I',
+        'account_starts': 'I',
+        # The ordinal of the post date of each split's transaction
+        'split_dates': 'i',
+        'split_value_nums': 'q',
+        'split_value_denoms': 'q',
+        'split_quantity_nums': 'q',
+        'split_quantity_denoms': 'q',
+        # For each split, the index of its description in the string table
+        'split_descriptions': 'I',
+        # The string table: the UTF-8 descriptions one after another, and where each starts,
+        # with an extra entry for the end
+        'description_offsets': 'Q',
+        'description_data': 'B',
+    }
+    # Changes can't be saved to snapshots
+    read_only = True
+
+    def __init__(self, filename):
+        self._filename = filename
+        with open(filename, 'rb') as snapshot_file:
+            self._mmap = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        header = self._read_header(self._mmap)
+        self.created = header['created']
+        self._accounts = [SnapshotAccount(guid=guid, name=name,
+                                          currency=get_currency_for_commodity(currency_code) if currency_code else None)
+                          for guid, name, currency_code in header['accounts']]
+        self._accounts_by_guid = {account.guid: account for account in self._accounts}
+        self._account_indices_by_guid = {account.guid: index for index, account in enumerate(self._accounts)}
+        memory = memoryview(self._mmap)
+        self._columns = {name: memory[offset:offset + length].cast(self.COLUMN_TYPECODES[name])
+                         for name, (offset, length) in header['columns'].items()}
+        self._descriptions = {}
+
+    @classmethod
+    def is_snapshot_file(cls, filename):
+        """Returns:
+            Whether the supplied file is a snapshot (boolean).
+        """
+        with open(filename, 'rb') as snapshot_file:
+            return snapshot_file.read(len(cls.MAGIC)) == cls.MAGIC
+
+    @classmethod
+    def write(cls, book, filename):
+        """Makes a snapshot of a book.
+
+        The file is replaced in one step, so a snapshot that is being read is never half written.
+
+        Args:
+            book: Book object.
+            filename: The filename and path to write the snapshot to (string).
+
+        Returns:
+            The number of splits in the snapshot (integer).
+        """
+        # Got first, so that books that cannot be snapshotted say so before anything else is read
+        rows = book.get_snapshot_rows()
+        account_names_by_guid = book.get_account_names_by_guid()
+        currencies_by_account_guid = book.get_currencies_by_account_guid()
+        account_guids = sorted(account_names_by_guid)
+        account_indices_by_guid = {guid: index for index, guid in enumerate(account_guids)}
+        columns = {name: array(typecode) for name, typecode in cls.COLUMN_TYPECODES.items()}
+        description_indices = {}
+        description_data = bytearray()
+        columns['description_offsets'].append(0)
+
+        last_transaction_guid = None
+        for row in rows:
+            account_index = account_indices_by_guid.get(row.account_guid)
+            if account_index is None:
+                # e.g. the template splits of scheduled transactions
+                continue
+            split_index = len(columns['split_accounts'])
+            if row.transaction_guid != last_transaction_guid:
+                columns['transaction_starts'].append(split_index)
+                columns['transaction_guids'].frombytes(bytes.fromhex(row.transaction_guid))
+                last_transaction_guid = row.transaction_guid
+            description = row.description or ''
+            description_index = description_indices.get(description)
+            if description_index is None:
+                description_index = description_indices[description] = len(description_indices)
+                description_data += description.encode('utf-8')
+                columns['description_offsets'].append(len(description_data))
+            columns['split_guids'].frombytes(bytes.fromhex(row.guid))
+            columns['split_transactions'].append(len(columns['transaction_starts']) - 1)
+            columns['split_accounts'].append(account_index)
+            columns['split_dates'].append(row.date.toordinal())
+            columns['split_value_nums'].append(row.value_num)
+            columns['split_value_denoms'].append(row.value_denom)
+            columns['split_quantity_nums'].append(row.quantity_num)
+            columns['split_quantity_denoms'].append(row.quantity_denom)
+            columns['split_descriptions'].append(description_index)
+        split_count = len(columns['split_accounts'])
+        columns['transaction_starts'].append(split_count)
+        columns['description_data'].frombytes(bytes(description_data))
+
+        # Group the splits by account
+        split_accounts = columns['split_accounts']
+        columns['account_splits'].extend(sorted(range(split_count), key=split_accounts.__getitem__))
+        account_starts = columns['account_starts']
+        account_split_counts = [0] * len(account_guids)
+        for account_index in split_accounts:
+            account_split_counts[account_index] += 1
+        account_starts.append(0)
+        for account_split_count in account_split_counts:
+            account_starts.append(account_starts[-1] + account_split_count)
+
+        cls._write_columns(filename, columns, header={
+            'byteorder': sys.byteorder,
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'accounts': [
+                (guid, account_names_by_guid[guid],
+                 currencies_by_account_guid[guid].code if guid in currencies_by_account_guid else None)
+                for guid in account_guids
+            ],
+        })
+        return split_count
+
+    @classmethod
+    def _write_columns(cls, filename, columns, header):
+        """Writes the header, followed by the columns.
+
+        Args:
+            filename: The filename and path to write the snapshot to (string).
+            columns: Dictionary of arrays, keyed by column name.
+            header: Dictionary of the rest of the header.
+        """
+        # Work out where the columns will go, which depends on the length of the header.
+        offset, header_bytes = 0, b''
+        while True:
+            header['columns'] = {}
+            column_offset = cls._align(offset)
+            for name, column in columns.items():
+                length = len(column) * column.itemsize
+                header['columns'][name] = (column_offset, length)
+                column_offset = cls._align(column_offset + length)
+            header_bytes = json.dumps(header).encode('utf-8')
+            header_end = len(cls.MAGIC) + struct.calcsize(cls.HEADER_LENGTH_FORMAT) + len(header_bytes)
+            if cls._align(header_end) == cls._align(offset):
+                break
+            offset = header_end
+
+        temporary_filename = filename + '.tmp'
+        with open(temporary_filename, 'wb') as snapshot_file:
+            snapshot_file.write(cls.MAGIC)
+            snapshot_file.write(struct.pack(cls.HEADER_LENGTH_FORMAT, len(header_bytes)))
+            snapshot_file.write(header_bytes)
+            for name, column in columns.items():
+                column_offset, _ = header['columns'][name]
+                snapshot_file.write(b'\0' * (column_offset - snapshot_file.tell()))
+                column.tofile(snapshot_file)
+        os.replace(temporary_filename, filename)
+
+    @classmethod
+    def _align(cls, offset):
+        return -(-offset // cls.ALIGNMENT) * cls.ALIGNMENT
+
+    @classmethod
+    def _read_header(cls, buffer):
+        """Returns:
+            The header of the snapshot (dictionary).
+        Raises:
+            ValueError, if the file is not a snapshot that can be read on this machine.
+        """
+        if buffer[:len(cls.MAGIC)] != cls.MAGIC:
+            raise ValueError('This is not a snapshot file.')
+        start = len(cls.MAGIC) + struct.calcsize(cls.HEADER_LENGTH_FORMAT)
+        (header_length,) = struct.unpack(cls.HEADER_LENGTH_FORMAT, buffer[len(cls.MAGIC):start])
+        header = json.loads(buffer[start:start + header_length].decode('utf-8'))
+        if header['byteorder'] != sys.byteorder:
+            raise ValueError('This snapshot was made on a machine with a different byte order. '
+                             'Please make it again on this machine.')
+        return header
+
+    def refresh(self):
+        """Does nothing, as a snapshot never changes.
+        """
+        pass
+
+    def listen_for_statements(self, callback):
+        """The snapshot is read without running any SQL statements, so the callback is never called.
+        """
+        pass
+
+    def get_accounts(self, account_names):
+        """Args:
+            account_names: list of account names, e.g. 'Equity:Opening Balances'
+        Returns:
+            List of SnapshotAccount objects, in the same order.
+        Raises:
+            AccountsNotFound, listing every name that is not in the book.
+        """
+        accounts_by_name = self.get_accounts_by_name(account_names)
+        return [accounts_by_name[name] for name in account_names]
+
+    def get_account(self, name):
+        """Gets an account by colon-separated name.
+        Args:
+            name: the name of the account, e.g. 'Equity:Opening Balances'
+        Returns:
+            SnapshotAccount object.
+        Raises:
+            AccountsNotFound, if there is no account with that name.
+        """
+        for account in self._accounts:
+            if account.name == name:
+                return account
+        raise AccountsNotFound([name])
+
+    def get_accounts_by_name(self, account_names):
+        """Args:
+            account_names: iterable of account names, e.g. 'Equity:Opening Balances'
+        Returns:
+            Dictionary of SnapshotAccount objects, keyed by account name.
+        Raises:
+            AccountsNotFound, listing every name that is not in the book.
+        """
+        account_names = set(account_names)
+        accounts_by_name = {account.name: account for account in self._accounts if account.name in account_names}
+        missing_account_names = account_names - set(accounts_by_name)
+        if missing_account_names:
+            raise AccountsNotFound(missing_account_names)
+        return accounts_by_name
+
+    def get_split_chunks_from_accounts(self, accounts, chunk_size, release=False, split_filter=None):
+        """Gets any splits that are assigned to any of the supplied list of accounts, a chunk at a time.
+
+        Args:
+            accounts: List of SnapshotAccount objects.
+            chunk_size: The maximum number of splits in each chunk (integer).
+            release: Not used, as SnapshotSplits hold no database state.
+            split_filter: Optional SplitFilter; only the splits it matches are included.
+
+        Yields:
+            Lists of SnapshotSplit objects.
+        """
+        chunk = []
+        for account in accounts:
+            for split_index in self._get_split_indices(account):
+                split = SnapshotSplit(self, split_index)
+                if split_filter is not None and not split_filter.matches(split.date, split.description):
+                    continue
+                chunk.append(split)
+                if len(chunk) == chunk_size:
+                    yield chunk
+                    chunk = []
+        if chunk:
+            yield chunk
+
+    def get_split_rows(self, account_guids=None, exclude_account_guids=None, start_date=None, end_date=None):
+        """Gets the data of splits, in the same way as Book.
+
+        Args:
+            account_guids: Optional list of account guids; if given, only splits in these accounts are included.
+            exclude_account_guids: Optional list of account guids to leave out.
+            start_date: Optional earliest post date to include (date).
+            end_date: Optional latest post date to include (date).
+
+        Yields:
+            SplitRow named tuples, with the value as a Fraction.
+        """
+        accounts = self._accounts
+        if account_guids is not None:
+            accounts = [self._accounts_by_guid[guid] for guid in account_guids if guid in self._accounts_by_guid]
+        if exclude_account_guids:
+            exclude_account_guids = set(exclude_account_guids)
+            accounts = [account for account in accounts if account.guid not in exclude_account_guids]
+        for account in accounts:
+            for split_index in self._get_split_indices(account):
+                split = SnapshotSplit(self, split_index)
+                if start_date is not None and split.date < start_date:
+                    continue
+                if end_date is not None and split.date > end_date:
+                    continue
+                yield SplitRow(guid=split.guid, account_guid=account.guid, date=split.date,
+                               value=split.value, description=split.description)
+
+    def get_account_names_by_guid(self):
+        """Returns:
+            Dictionary of the full names of all the accounts in the book, keyed by guid.
+        """
+        return {account.guid: account.name for account in self._accounts}
+
+    def get_currencies_by_account_guid(self):
+        """Returns:
+            Dictionary of moneyed Currency objects, keyed by account guid.
+        """
+        return {account.guid: account.currency for account in self._accounts if account.currency is not None}
+
+    def get_fingerprint(self, account_guids):
+        """Gets a fingerprint of the splits in the supplied accounts, in the same way as Book.
+
+        Args:
+            account_guids: List of account guids (strings).
+
+        Returns:
+            Hex digest (string).
+        """
+        accounts = [self._accounts_by_guid[guid] for guid in account_guids if guid in self._accounts_by_guid]
+        rows = sorted((split.guid, account.guid, split.value, split.description)
+                      for account in accounts
+                      for split in (SnapshotSplit(self, index) for index in self._get_split_indices(account)))
+        return fingerprint_rows(rows)
+
+    def update_split_accounts(self, changes):
+        raise NotImplementedError('Changes cannot be saved to snapshots. Make a plan from the snapshot, '
+                                  'then apply it to the book instead.')
+
+    def get_snapshot_rows(self):
+        raise NotImplementedError('This is already a snapshot.')
+
+    def _get_split_indices(self, account):
+        """Returns:
+            The indices of the splits in the account, in the order they were written.
+        """
+        account_index = self._account_indices_by_guid[account.guid]
+        account_starts = self._columns['account_starts']
+        return self._columns['account_splits'][account_starts[account_index]:account_starts[account_index + 1]]
+
+    def _get_guid(self, column_name, index):
+        return self._columns[column_name][index * self.GUID_BYTES:(index + 1) * self.GUID_BYTES].hex()
+
+    def _get_description(self, description_index):
+        """Gets a description from the string table, only decoding each one once.
+        """
+        try:
+            return self._descriptions[description_index]
+        except KeyError:
+            offsets = self._columns['description_offsets']
+            description = self._descriptions[description_index] = bytes(
+                self._columns['description_data'][offsets[description_index]:offsets[description_index + 1]]
+            ).decode('utf-8')
+            return description
+
+
+class SnapshotAccount:
+    """An account in a snapshot.
+
+    Args:
+        guid: The account's guid (string).
+        name: The full name of the account (string).
+        currency: The moneyed Currency of the account.
+    """
+    def __init__(self, guid, name, currency=None):
+        self.guid = guid
+        self.name = name
+        self.currency = currency
+
+    def __str__(self):
+        return self.name
+
+
+class SnapshotSplit:
+    """A split in a snapshot, read from the snapshot's columns as it is used.
+
+    Args:
+        snapshot: The SnapshotBook the split is in.
+        index: The index of the split in the snapshot (integer).
+    """
+    __slots__ = ('_snapshot', '_index')
+
+    def __init__(self, snapshot, index):
+        self._snapshot = snapshot
+        self._index = index
+
+    def _get(self, column_name):
+        return self._snapshot._columns[column_name][self._index]
+
+    @property
+    def guid(self):
+        return self._snapshot._get_guid('split_guids', self._index)
+
+    @property
+    def account(self):
+        return self._snapshot._accounts[self._get('split_accounts')]
+
+    @property
+    def date(self):
+        return date.fromordinal(self._get('split_dates'))
+
+    @property
+    def description(self):
+        return self._snapshot._get_description(self._get('split_descriptions'))
+
+    @property
+    def value(self):
+        """Returns:
+            The value of the split, in the currency of its transaction (Fraction).
+        """
+        return Fraction(self._get('split_value_nums'), self._get('split_value_denoms'))
+
+    @property
+    def amount(self):
+        """Returns:
+            The amount of the split, in the currency of its account (Money).
+        """
+        return Money(Decimal(self._get('split_quantity_nums')) / Decimal(self._get('split_quantity_denoms')),
+                     self.account.currency)
+
+    @property
+    def opposite_account(self):
+        """The account on the other side of the transaction.
+
+        Returns:
+            SnapshotAccount object.
+        Raises:
+            OppositeAccountNotDetermined, if the other splits in the transaction are not all in the same account.
+        """
+        other_split_accounts = self._get_other_split_accounts()
+        if len({account.guid for account in other_split_accounts}) != 1:
+            raise OppositeAccountNotDetermined
+        return other_split_accounts[0]
+
+    def _get_other_split_accounts(self):
+        """Returns:
+            The SnapshotAccounts of the other splits in the transaction (list).
+        """
+        columns = self._snapshot._columns
+        transaction_index = self._get('split_transactions')
+        transaction_starts = columns['transaction_starts']
+        return [self._snapshot._accounts[columns['split_accounts'][index]]
+                for index in range(transaction_starts[transaction_index], transaction_starts[transaction_index + 1])
+                if index != self._index]
+
+    def __repr__(self):
+        return '{cls}({guid})'.format(cls=self.__class__.__name__, guid=self.guid)
@@ -0,0 +1,282 @@
+import codecs
+import csv
+import html
+import os
+import re
+from .book import AccountsNotFound
+
+
+class InvalidStatement(Exception):
+    """Raised when a statement file cannot be annotated, e.g. because its format is not known
+    or its descriptions cannot be found.
+    """
+    pass
+
+
+class StatementAnnotator:
+    """Categorizes the transactions in a bank statement file before it is imported, using the
+    patterns configured for one of the uncategorized accounts.
+
+    The file is read and written one transaction at a time, so memory use stays flat however
+    long the statement is; only the match for each unique description is kept.  The output
+    depends on the format of the statement:
+
+        - CSV: The same rows, with Suggested Account and Suggested Rule columns added.
+        - QIF: The same records, with the category (L line) set to the account.  Records that
+          are split between categories are left as they are.
+        - OFX: A CSV file of the transactions, with Suggested Account and Suggested Rule columns,
+          as OFX has no field for the account.
+
+    Usage:
+
+        annotator = StatementAnnotator(Matcher(config), 'Imbalance-GBP')
+        record_count, matched_count = annotator.annotate('statement.csv', 'annotated.csv')
+
+    Args:
+        matcher: Matcher object.
+        account_name: Full name of the uncategorized account whose patterns to use (string).
+        encoding: The text encoding of the statement file, also used for the output (string).
+        description_column: Optional name of the CSV column containing the descriptions.  If not
+                            given, the first column named like DESCRIPTION_COLUMNS is used.
+    """
+    FORMAT_CSV = 'csv'
+    FORMAT_QIF = 'qif'
+    FORMAT_OFX = 'ofx'
+    FORMATS_BY_EXTENSION = {
+        '.csv': FORMAT_CSV,
+        '.qif': FORMAT_QIF,
+        '.ofx': FORMAT_OFX,
+        '.qfx': FORMAT_OFX,
+    }
+    DEFAULT_ENCODING = 'utf-8'
+    # The columns added to CSV output, named so as not to be mistaken for the bank's own columns, such
+    # as an Account column holding the account number
+    ACCOUNT_COLUMN = 'Suggested Account'
+    RULE_COLUMN = 'Suggested Rule'
+    # The names banks commonly give the description column, in order of preference (compared ignoring case)
+    DESCRIPTION_COLUMNS = ('Description', 'Transaction Description', 'Narrative', 'Details', 'Payee', 'Name',
+                           'Memo')
+    # The QIF sections that contain transactions, rather than lists of accounts, categories and so on
+    QIF_TRANSACTION_TYPES = ('Bank', 'Cash', 'CCard', 'Oth A', 'Oth L')
+    QIF_END_OF_RECORD = '^'
+    OFX_COLUMNS = ('Date', 'Amount', 'Description', 'Memo', 'FITID')
+    # How much of an OFX file to read at a time, in characters
+    OFX_BLOCK_SIZE = 64 * 1024
+    OFX_ELEMENT_PATTERN = r'<(/?)([^<>/\s]+)>([^<]*)'
+    OFX_TRANSACTION_TAG = 'STMTTRN'
+
+    def __init__(self, matcher, account_name, encoding=None, description_column=None):
+        self._matcher = matcher
+        self._account_name = account_name
+        self._encoding = encoding or self.DEFAULT_ENCODING
+        self._description_column = description_column
+        self._ofx_element_regex = re.compile(self.OFX_ELEMENT_PATTERN)
+
+    def annotate(self, input_filename, output_filename):
+        """Writes a copy of the statement file annotated with the account for each transaction.
+
+        Args:
+            input_filename: The filename and path of the statement file (string).
+            output_filename: The filename and path to write the annotated statement to (string).
+
+        Returns:
+            Two-tuple of the number of transactions, and how many of them matched a pattern (integers).
+
+        Raises:
+            AccountsNotFound, if the account has no patterns in the config.
+            InvalidStatement, if the statement file is not in a known format, or its descriptions cannot be found.
+        """
+        if self._account_name not in self._matcher.get_uncategorized_account_names():
+            raise AccountsNotFound([self._account_name])
+        annotators = {
+            self.FORMAT_CSV: self._annotate_csv,
+            self.FORMAT_QIF: self._annotate_qif,
+            self.FORMAT_OFX: self._annotate_ofx,
+        }
+        annotate = annotators[self.get_format(input_filename)]
+        # Any byte order mark is dropped from the input, so that the first column name is read correctly.
+        input_encoding = 'utf-8-sig' if codecs.lookup(self._encoding).name == 'utf-8' else self._encoding
+        with open(input_filename, encoding=input_encoding, newline='') as input_file:
+            try:
+                with open(output_filename, 'w', encoding=self._encoding, newline='') as output_file:
+                    return annotate(input_file, output_file)
+            except InvalidStatement:
+                # Don't leave a half written file behind.
+                os.remove(output_filename)
+                raise
+
+    @classmethod
+    def get_format(cls, filename):
+        """Returns:
+            The format of the statement file, worked out from its extension, e.g. FORMAT_CSV.
+        Raises:
+            InvalidStatement, if the extension is not one of FORMATS_BY_EXTENSION.
+        """
+        _, extension = os.path.splitext(filename)
+        try:
+            return cls.FORMATS_BY_EXTENSION[extension.lower()]
+        except KeyError:
+            raise InvalidStatement('{} is not a statement file: expected one of {}.'.format(
+                filename, ', '.join(sorted(cls.FORMATS_BY_EXTENSION))))
+
+    def _get_match(self, description):
+        """Returns:
+            The MatchPattern that matches the description, or None.
+        """
+        return self._matcher.get_match(self._account_name, description)
+
+    def _annotate_csv(self, input_file, output_file):
+        reader = csv.reader(input_file)
+        writer = csv.writer(output_file)
+        try:
+            header = next(reader)
+        except StopIteration:
+            raise InvalidStatement('The statement file is empty.')
+        description_index = self._get_description_index(header)
+        # Overwrite the columns if the file has been annotated before; the bank's own columns are kept
+        for column in (self.ACCOUNT_COLUMN, self.RULE_COLUMN):
+            if column not in header:
+                header.append(column)
+        account_index, rule_index = header.index(self.ACCOUNT_COLUMN), header.index(self.RULE_COLUMN)
+        writer.writerow(header)
+        padding = [''] * len(header)
+
+        record_count = matched_count = 0
+        for row in reader:
+            if not row:
+                continue
+            record_count += 1
+            row.extend(padding[len(row):])
+            match_pattern = self._get_match(row[description_index])
+            if match_pattern is not None:
+                matched_count += 1
+                row[account_index], row[rule_index] = match_pattern.account_name, match_pattern.rule_id
+            else:
+                row[account_index] = row[rule_index] = ''
+            writer.writerow(row)
+        return record_count, matched_count
+
+    def _get_description_index(self, header):
+        """Returns:
+            The index of the description column in the CSV header.
+        Raises:
+            InvalidStatement, if there is no description column.
+        """
+        folded_header = [column.strip().casefold() for column in header]
+        candidates = [self._description_column] if self._description_column else self.DESCRIPTION_COLUMNS
+        for candidate in candidates:
+            if candidate.casefold() in folded_header:
+                return folded_header.index(candidate.casefold())
+        raise InvalidStatement('Could not find the description column in the statement file; expected one of: '
+                               '{}.'.format(', '.join(candidates)))
+
+    def _annotate_qif(self, input_file, output_file):
+        record_count = matched_count = 0
+        in_transactions = False
+        record_lines = []
+        for line in input_file:
+            if not record_lines and line.startswith('!'):
+                # A header, which starts a new section
+                if line.startswith('!Type:'):
+                    in_transactions = line[len('!Type:'):].strip() in self.QIF_TRANSACTION_TYPES
+                elif line.startswith('!Account'):
+                    in_transactions = False
+                output_file.write(line)
+                continue
+            record_lines.append(line)
+            if not line.startswith(self.QIF_END_OF_RECORD):
+                continue
+            if in_transactions:
+                record_count += 1
+                if self._annotate_qif_record(record_lines):
+                    matched_count += 1
+            output_file.writelines(record_lines)
+            record_lines = []
+        output_file.writelines(record_lines)
+        return record_count, matched_count
+
+    def _annotate_qif_record(self, record_lines):
+        """Sets the category of a QIF transaction record to the account it matches, in place.
+
+        Args:
+            record_lines: List of the lines of the record, ending with the end of record line.
+
+        Returns:
+            Whether the record matched a pattern (boolean).
+        """
+        fields = {}
+        for line in record_lines:
+            fields.setdefault(line[:1], line[1:].rstrip('\r\n'))
+        if 'S' in fields:
+            # Split between several categories
+            return False
+        match_pattern = self._get_match(fields.get('P') or fields.get('M') or '')
+        if match_pattern is None:
+            return False
+        end_of_record = record_lines[-1]
+        line_ending = end_of_record[len(self.QIF_END_OF_RECORD):]
+        record_lines[:] = [line for line in record_lines[:-1] if not line.startswith('L')]
+        record_lines.extend(['L' + match_pattern.account_name + line_ending, end_of_record])
+        return True
+
+    def _annotate_ofx(self, input_file, output_file):
+        writer = csv.writer(output_file)
+        writer.writerow(self.OFX_COLUMNS + (self.ACCOUNT_COLUMN, self.RULE_COLUMN))
+        record_count = matched_count = 0
+        for transaction in self._read_ofx_transactions(input_file):
+            record_count += 1
+            description = transaction.get('NAME') or transaction.get('PAYEE') or transaction.get('MEMO', '')
+            match_pattern = self._get_match(description)
+            if match_pattern is not None:
+                matched_count += 1
+            posted = transaction.get('DTPOSTED', '')
+            writer.writerow([
+                '{}-{}-{}'.format(posted[:4], posted[4:6], posted[6:8]) if len(posted) >= 8 else posted,
+                transaction.get('TRNAMT', ''),
+                description,
+                transaction.get('MEMO', ''),
+                transaction.get('FITID', ''),
+                match_pattern.account_name if match_pattern else '',
+                match_pattern.rule_id if match_pattern else '',
+            ])
+        return record_count, matched_count
+
+    def _read_ofx_transactions(self, input_file):
+        """Yields:
+            Dictionary of the values in each transaction in the OFX file, keyed by tag, e.g. 'NAME'.
+        """
+        transaction = None
+        for closing, tag, text in self._read_ofx_elements(input_file):
+            tag = tag.upper()
+            if tag == self.OFX_TRANSACTION_TAG:
+                if closing and transaction is not None:
+                    yield transaction
+                transaction = None if closing else {}
+            elif transaction is not None and not closing:
+                transaction.setdefault(tag, html.unescape(text.strip()))
+
+    def _read_ofx_elements(self, input_file):
+        """Reads the elements of an OFX file, which may be SGML or XML, a block at a time.
+
+        Yields:
+            Three-tuple for each tag:
+                - Whether it is a closing tag (boolean).
+                - The tag (string).
+                - The text that follows it, up to the next tag (string).
+        """
+        buffer = ''
+        while True:
+            block = input_file.read(self.OFX_BLOCK_SIZE)
+            buffer += block
+            if block:
+                # Hold back the last element, as its text may continue in the next block.
+                end = buffer.rfind('<')
+                if end <= 0:
+                    continue
+            else:
+                end = len(buffer)
+            for match in self._ofx_element_regex.finditer(buffer, 0, end):
+                yield bool(match.group(1)), match.group(2), match.group(3)
+            buffer = buffer[end:]
+            if not block:
+                return
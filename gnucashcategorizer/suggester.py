@@ -1,3 +1,11 @@
+import queue
+import threading
+from .matcher import Matcher
+from .book import OppositeAccountNotDetermined
+from .plan import Plan
+from .metrics import time_phase
+
+
 class NoSuggestion(Exception):
     """Exception raised when no suggestion could be made.
     """
@@ -6,9 +14,18 @@ class NoSuggestion(Exception):
 
 
 class Suggestion:
-    def __init__(self, split, new_account):
+    def __init__(self, split, new_account, match_pattern=None):
         self.split = split
         self.new_account = new_account
+        self.match_pattern = match_pattern
+
+    @property
+    def rule_id(self):
+        """The id of the MatchPattern that made the suggestion, or None if not known.
+        """
+        if self.match_pattern is None:
+            return None
+        return self.match_pattern.rule_id
 
     @property
     def old_account(self):
@@ -16,6 +33,16 @@ class Suggestion:
         """
         return self.split.account
 
+    @property
+    def opposite_account(self):
+        """The account on the other side of the transaction, or None if the transaction
+        has more than two splits in different accounts.
+        """
+        try:
+            return self.split.opposite_account
+        except OppositeAccountNotDetermined:
+            return None
+
     @property
     def date(self):
         return self.split.date
@@ -50,13 +77,51 @@ class Suggestion:
 class Suggester:
     """Provides a list of Suggestions for unmatched transactions.
 
+    The splits are loaded from the book in chunks, and matched against the patterns
+    on a background thread while the next chunk is loading, so the database access and
+    the matching overlap.  All access to the book stays on the calling thread, as
+    database connections (SQLite in particular) cannot be shared between threads.
+
+    If a memory limit is given, the chunk size is chosen to keep the chunks being loaded and
+    matched within the limit, and the database objects are released after each chunk, so the
+    database session does not grow with the number of splits.  The limit does not cover the
+    results: each split is kept, with a copy of its data, in the suggestions or the splits without
+    suggestions, so memory use still grows with the number of splits, only more slowly.
+
     Args:
         config: Config object.
         book: Book object.
+        memory_limit: Optional memory ceiling for the chunks of splits being loaded and matched at
+                      any one time, in megabytes (integer).
+        skip_split_guids: Optional set of guids of splits to leave out, e.g. because they have already
+                          been looked at.  The set may be added to between calls to get_suggestions.
+        split_filter: Optional SplitFilter, to only load some of the uncategorized splits.
+        explain_sample: Optional fraction of the splits, between 0 and 1, to record an Explanation of
+                        the match for (see get_explanations).  The same splits are chosen each time.
+        metrics: Optional RunMetrics to record the loading and matching in.  Each pattern tried
+                 is timed, so matching is a little slower.
     """
-    def __init__(self, config, book):
+    # The number of splits to load from the book at a time
+    CHUNK_SIZE = 1000
+    # How many loaded chunks may be waiting to be matched, to bound memory use
+    MAX_QUEUED_CHUNKS = 4
+    # A generous estimate of the memory taken by a loaded split and its transaction, in bytes
+    ESTIMATED_SPLIT_SIZE = 10 * 1024
+    # Put on the queue once all the chunks have been loaded
+    _END_OF_CHUNKS = None
+    # The number of possible values of the first eight hex digits of a guid, for sampling splits
+    _GUID_SAMPLE_RANGE = 16 ** 8
+
+    def __init__(self, config, book, memory_limit=None, skip_split_guids=None, split_filter=None,
+                 explain_sample=None, metrics=None):
         self._config = config
         self._book = book
+        self._memory_limit = memory_limit
+        self._skip_split_guids = skip_split_guids if skip_split_guids is not None else set()
+        self._split_filter = split_filter
+        self._explain_sample = explain_sample
+        self._metrics = metrics
+        self._matcher = None
 
     def get_suggestions(self):
         """Gets a list of suggestions to apply to the book.
@@ -67,12 +132,13 @@ class Suggester:
         suggestions = []
         self._splits_without_suggestions = []
 
-        splits = self._get_uncategorized_splits()
-        for split in splits:
-            try:
-                suggestions.append(self._get_suggestion_for_split(split))
-            except NoSuggestion:
-                self._splits_without_suggestions.append(split)
+        matched_splits = self._get_matched_splits()
+        with time_phase(self._metrics, 'suggest'):
+            for split, match_pattern in matched_splits:
+                try:
+                    suggestions.append(self._get_suggestion_for_match(split, match_pattern))
+                except NoSuggestion:
+                    self._splits_without_suggestions.append(split)
 
         return suggestions
 
@@ -87,21 +153,176 @@ class Suggester:
         except AttributeError:
             raise RuntimeError('get_splits_without_suggestions must be called after get_suggestions.')
 
-    def _get_uncategorized_splits(self):
+    def get_explanations(self):
         """Returns:
-            List of all splits from uncategorized accounts.
+            List of two-tuples, for the sample of splits chosen to be explained, in the order they were loaded:
+                - Split.
+                - Explanation of how it was matched.
+        Raises:
+            RuntimeError, if this method was called before get_suggestions was called.
+        """
+        try:
+            return self._explanations
+        except AttributeError:
+            raise RuntimeError('get_explanations must be called after get_suggestions.')
+
+    def get_plan(self, suggestions):
+        """Gets a Plan that can be saved, and applied to the book later without matching again.
+
+        Args:
+            suggestions: List of Suggestions from get_suggestions.
+
+        Returns:
+            Plan object.
+        """
+        account_guids = [account.guid for account in self._get_uncategorized_accounts()]
+        return Plan.from_suggestions(suggestions,
+                                     book_fingerprint=self._book.get_fingerprint(account_guids),
+                                     account_guids=account_guids)
+
+    def reload_config(self):
+        """Picks up any changes to the config file since the suggester started.
+
+        Returns:
+            Set of the names of the uncategorized accounts whose patterns changed (strings).
+        """
+        return self._get_matcher().reload()
+
+    def _get_matched_splits(self):
+        """Loads the uncategorized splits and matches them against the patterns.
+
+        Returns:
+            List of two-tuples, in the order the splits were loaded:
+                - Split.
+                - The MatchPattern that matched it, or None.
+        """
+        matcher = self._get_matcher()
+        chunks = queue.Queue(maxsize=self.MAX_QUEUED_CHUNKS)
+        matched_splits = []
+        explanations = []
+        errors = []
+        worker = threading.Thread(target=self._match_chunks,
+                                  args=(matcher, chunks, matched_splits, explanations, errors),
+                                  daemon=True)
+        worker.start()
+        split_chunks = self._get_uncategorized_split_chunks()
+        if self._metrics is not None:
+            split_chunks = self._metrics.time_iteration('load', split_chunks)
+        try:
+            for chunk in split_chunks:
+                if self._metrics is not None:
+                    self._metrics.splits_loaded += len(chunk)
+                # Read the account names and descriptions here, so that any database
+                # access happens on this thread rather than the worker.
+                chunks.put([
+                    (split, split.account.name, split.description, self._should_explain(split.guid))
+                    for split in chunk
+                    if split.guid not in self._skip_split_guids
+                ])
+        finally:
+            chunks.put(self._END_OF_CHUNKS)
+            worker.join()
+
+        if errors:
+            raise errors[0]
+        self._explanations = explanations
+        return matched_splits
+
+    def _should_explain(self, split_guid):
+        """Returns:
+            Whether to record an Explanation for the split with the supplied guid (boolean).
+        """
+        if self._explain_sample is None:
+            return False
+        return int(split_guid[:8], 16) < self._explain_sample * self._GUID_SAMPLE_RANGE
+
+    def _match_chunks(self, matcher, chunks, matched_splits, explanations, errors):
+        """Matches chunks from the queue until the end of the chunks is reached.  Run on the worker thread.
+
+        Args:
+            matcher: Matcher object.
+            chunks: Queue of lists of (Split, account name, description, whether to explain) four-tuples.
+            matched_splits: List to append (Split, MatchPattern or None) two-tuples to.
+            explanations: List to append (Split, Explanation) two-tuples to, for the splits to explain.
+            errors: List to append any exception raised during matching to.
+        """
+        while True:
+            chunk = chunks.get()
+            if chunk is self._END_OF_CHUNKS:
+                return
+            if errors:
+                # Keep taking chunks off the queue so the loading thread never blocks.
+                continue
+            try:
+                with time_phase(self._metrics, 'match'):
+                    self._match_chunk(matcher, chunk, matched_splits, explanations)
+            except Exception as e:
+                errors.append(e)
+
+    def _match_chunk(self, matcher, chunk, matched_splits, explanations):
+        """Matches the splits in a chunk, explaining the matches if they are to be explained or
+        recorded in the metrics.  Run on the worker thread.
+        """
+        metrics = self._metrics
+        rule_timings = metrics.rule_timings if metrics is not None else None
+        for split, account_name, description, explain in chunk:
+            if explain or metrics is not None:
+                explanation = matcher.explain(account_name, description, rule_timings=rule_timings)
+                if explain:
+                    explanations.append((split, explanation))
+                if metrics is not None:
+                    metrics.record_match(account_name, explanation)
+                matched_splits.append((split, explanation.match_pattern))
+            else:
+                matched_splits.append((split, matcher.get_match(account_name, description)))
+
+    def _get_matcher(self):
+        """Gets the Matcher, only reading the patterns from the config and looking up their
+        accounts in the book once.
+
+        Raises:
+            AccountsNotFound, if any of the configured accounts are not in the book.
+        """
+        if self._matcher is None:
+            with time_phase(self._metrics, 'bind'):
+                self._matcher = Matcher(self._config, book=self._book)
+        return self._matcher
+
+    def _get_uncategorized_split_chunks(self):
+        """Yields:
+            Lists of splits from uncategorized accounts.
         """
         accounts = self._get_uncategorized_accounts()
-        return self._book.get_splits_from_accounts(accounts)
+        yield from self._book.get_split_chunks_from_accounts(accounts,
+                                                             chunk_size=self._get_chunk_size(),
+                                                             release=self._memory_limit is not None,
+                                                             split_filter=self._split_filter)
+
+    def _get_chunk_size(self):
+        """Returns:
+            The number of splits to load at a time (integer).
+        """
+        if self._memory_limit is None:
+            return self.CHUNK_SIZE
+        # As well as the queued chunks, one chunk is being loaded and another matched.
+        chunks_in_memory = self.MAX_QUEUED_CHUNKS + 2
+        memory_limit_bytes = self._memory_limit * 1024 * 1024
+        return max(1, memory_limit_bytes // (chunks_in_memory * self.ESTIMATED_SPLIT_SIZE))
 
     def _get_uncategorized_accounts(self):
-        account_names = self._config.get_uncategorized_account_names()
-        return self._book.get_accounts(account_names)
+        """Gets the uncategorized accounts, as looked up by the Matcher, narrowed down by the
+        split filter if there is one.
+        """
+        accounts = self._get_matcher().get_uncategorized_accounts()
+        if self._split_filter is not None:
+            accounts = self._split_filter.filter_accounts(accounts)
+        return accounts
 
-    def _get_suggestion_for_split(self, split):
+    def _get_suggestion_for_match(self, split, match_pattern):
         """
         Args:
             split: Split to get a suggestion for.
+            match_pattern: The MatchPattern that matched the split, or None.
 
         Returns:
             Suggestion object.
@@ -109,11 +330,6 @@ class Suggester:
         Raises:
             NoSuggestion.
         """
-        # TODO - this is not very efficient as we keep recalculating the patterns
-        # for the same accounts, if there are many splits for the same account (which is likely).
-        patterns = self._config.get_patterns_for_account_name(split.account.name)
-        for pattern in patterns:
-            if pattern.is_match(split.description):
-                account = self._book.get_account(pattern.account_name)
-                return Suggestion(split, new_account=account)
-        raise NoSuggestion(split)
+        if match_pattern is None:
+            raise NoSuggestion(split)
+        return Suggestion(split, new_account=match_pattern.account, match_pattern=match_pattern)
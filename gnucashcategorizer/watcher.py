@@ -0,0 +1,111 @@
+import os
+import time
+from .suggester import Suggester
+from .journal import Journal
+from .plan import PlanEntry
+from .metrics import time_phase
+
+
+class Watcher:
+    """Keeps the config and the book open, and categorizes new transactions each time the book file changes.
+
+    The patterns and the accounts are only looked up once, and each split is only matched once:
+    splits that could not be categorized are remembered, and left out the next time the book changes.
+    If the config file changes, its changes are picked up, and all the uncategorized splits are
+    matched again.  The suggestions are saved to the book without asking, and recorded in the journal
+    so they can be undone.
+
+    Usage:
+
+        for suggestions, splits_without_suggestions, run_id in Watcher(config, book, book_filename).watch():
+            ...
+
+    Args:
+        config: Config object.
+        book: Book object.
+        book_filename: The filename and path to the Gnucash accounts file, to watch for changes (string).
+        poll_interval: How often to check the file for changes, in seconds (number).
+        memory_limit: Optional memory ceiling for the chunks of splits being loaded and matched, in megabytes
+                      (integer).
+        split_filter: Optional SplitFilter, to only categorize some of the uncategorized splits.
+        journal: Optional Journal to record the changes in.  Defaults to the journal alongside the book.
+        metrics: Optional RunMetrics to record every categorization in, since watching started.
+    """
+    # How often to check the file for changes, in seconds
+    POLL_INTERVAL = 2
+
+    def __init__(self, config, book, book_filename, poll_interval=None, memory_limit=None, split_filter=None,
+                 journal=None, metrics=None):
+        self._book = book
+        self._book_filename = book_filename
+        self._journal = journal if journal is not None else Journal.for_book(book_filename)
+        self._poll_interval = poll_interval if poll_interval is not None else self.POLL_INTERVAL
+        self._metrics = metrics
+        self._seen_split_guids = set()
+        self._suggester = Suggester(config=config, book=book, memory_limit=memory_limit,
+                                    skip_split_guids=self._seen_split_guids, split_filter=split_filter,
+                                    metrics=metrics)
+        self._last_modified = None
+
+    def watch(self):
+        """Categorizes the transactions in the book, then again each time the book file changes.
+
+        Yields:
+            Three-tuple each time the book has been categorized:
+                - List of Suggestions that were saved.
+                - List of Splits that could not be categorized, that had not been seen before.
+                - The id of the run in the journal, or None if nothing was saved (string).
+        """
+        while True:
+            if self._suggester.reload_config():
+                # Splits that could not be categorized before might be now.
+                self._seen_split_guids.clear()
+                self._last_modified = None
+            if self.book_has_changed():
+                yield self.categorize_new_splits()
+            time.sleep(self._poll_interval)
+
+    def book_has_changed(self):
+        """Returns:
+            Whether the book file has been modified since it was last categorized (boolean).
+        """
+        return self._get_last_modified() != self._last_modified
+
+    def categorize_new_splits(self):
+        """Reads the book again, and saves suggestions for any splits that have not been seen before.
+        If the suggestions cannot be saved, they are tried again the next time the book changes.
+
+        Returns:
+            Three-tuple:
+                - List of Suggestions that were saved.
+                - List of Splits that could not be categorized.
+                - The id of the run in the journal, or None if nothing was saved (string).
+
+        Raises:
+            UnexpectedRowCount or CommodityMismatch, if the suggestions could not be saved.
+        """
+        last_modified = self._get_last_modified()
+        self._book.refresh()
+        suggestions = self._suggester.get_suggestions()
+        splits_without_suggestions = self._suggester.get_splits_without_suggestions()
+        self._seen_split_guids.update(split.guid for split in splits_without_suggestions)
+        run_id = None
+        if suggestions:
+            try:
+                with time_phase(self._metrics, 'save'):
+                    run_id = self._journal.save_changes(
+                        self._book, [PlanEntry.from_suggestion(suggestion) for suggestion in suggestions])
+            except Exception:
+                # Don't try again until the book changes.
+                self._last_modified = last_modified
+                raise
+            # Don't categorize again just because of our own changes.
+            last_modified = self._get_last_modified()
+        self._last_modified = last_modified
+        return suggestions, splits_without_suggestions, run_id
+
+    def _get_last_modified(self):
+        """Returns:
+            The modification time of the book file, in nanoseconds (integer).
+        """
+        return os.stat(self._book_filename).st_mtime_ns
@@ -0,0 +1,351 @@
+import gzip
+from datetime import datetime
+from decimal import Decimal
+from fractions import Fraction
+from xml.etree.ElementTree import iterparse
+from moneyed import Money
+from .book import AccountsNotFound, fingerprint_rows, get_currency_for_commodity, OppositeAccountNotDetermined, SplitRow
+
+
+# The XML namespaces used by GnuCash
+GNC = '{http://www.gnucash.org/XML/gnc}'
+ACT = '{http://www.gnucash.org/XML/act}'
+TRN = '{http://www.gnucash.org/XML/trn}'
+SPLIT = '{http://www.gnucash.org/XML/split}'
+TS = '{http://www.gnucash.org/XML/ts}'
+CMDTY = '{http://www.gnucash.org/XML/cmdty}'
+
+
+class XmlBook:
+    """Read only adapter for a GnuCash book saved in the XML format, which may be gzip compressed.
+
+    Rather than loading the whole document, the file is streamed through an incremental
+    parser and only the accounts, and the splits in the accounts asked for, are kept.
+
+    Args:
+        filename: The filename and path to the Gnucash accounts file (string).
+    """
+    # The character used to separate account names when specifying the full account name
+    ACCOUNT_NAME_SEPARATOR = ':'
+    # The first bytes of a gzip file
+    GZIP_MAGIC = b'\x1f\x8b'
+    XML_DECLARATION = b'<?xml'
+    DATE_FORMAT = '%Y-%m-%d %H:%M:%S %z'
+    # Changes can't be saved to XML books
+    read_only = True
+
+    def __init__(self, filename):
+        self._filename = filename
+        self._accounts = None
+        self._accounts_by_name = None
+
+    @classmethod
+    def is_xml_file(cls, filename):
+        """Returns:
+            Whether the supplied file is a GnuCash XML book, compressed or not (boolean).
+        """
+        with open(filename, 'rb') as book_file:
+            start = book_file.read(len(cls.XML_DECLARATION))
+        return start.startswith(cls.GZIP_MAGIC) or start == cls.XML_DECLARATION
+
+    def refresh(self):
+        """Forgets the accounts that have been read, so the file is read again the next time it is used.
+        """
+        self._accounts = None
+        self._accounts_by_name = None
+
+    def listen_for_statements(self, callback):
+        """The file is read without running any SQL statements, so the callback is never called.
+        """
+        pass
+
+    def get_accounts(self, account_names):
+        """Args:
+            account_names: list of account names, e.g. 'Equity:Opening Balances'
+        Returns:
+            List of XmlAccount objects, in the same order.
+        Raises:
+            AccountsNotFound, listing every name that is not in the book.
+        """
+        accounts_by_name = self.get_accounts_by_name(account_names)
+        return [accounts_by_name[name] for name in account_names]
+
+    def get_account(self, name):
+        """Gets an account by colon-separated name.
+        Args:
+            name: the name of the account, e.g. 'Equity:Opening Balances'
+        Returns:
+            XmlAccount object.
+        Raises:
+            AccountsNotFound, if there is no account with that name.
+        """
+        try:
+            return self._get_accounts_by_full_name()[name]
+        except KeyError:
+            raise AccountsNotFound([name])
+
+    def get_accounts_by_name(self, account_names):
+        """Args:
+            account_names: iterable of account names, e.g. 'Equity:Opening Balances'
+        Returns:
+            Dictionary of XmlAccount objects, keyed by account name.
+        Raises:
+            AccountsNotFound, listing every name that is not in the book.
+        """
+        all_accounts_by_name = self._get_accounts_by_full_name()
+        account_names = set(account_names)
+        missing_account_names = account_names - set(all_accounts_by_name)
+        if missing_account_names:
+            raise AccountsNotFound(missing_account_names)
+        return {name: all_accounts_by_name[name] for name in account_names}
+
+    def _get_all_accounts(self):
+        """Returns:
+            List of all the XmlAccounts in the book, only reading them from the file once.
+        """
+        if self._accounts is None:
+            self._accounts = self._read_accounts()
+            self._accounts_by_name = {account.name: account for account in self._accounts}
+        return self._accounts
+
+    def _get_accounts_by_full_name(self):
+        """Returns:
+            Dictionary of all the XmlAccounts in the book, keyed by full name, only built once.
+        """
+        self._get_all_accounts()
+        return self._accounts_by_name
+
+    def get_split_chunks_from_accounts(self, accounts, chunk_size, release=False, split_filter=None):
+        """Gets any splits that are assigned to any of the supplied list of accounts,
+        a chunk at a time, in the order they are in the file.
+
+        Args:
+            accounts: List of XmlAccount objects.
+            chunk_size: The maximum number of splits in each chunk (integer).
+            release: Not used, as XmlSplits hold no database state.
+            split_filter: Optional SplitFilter; only the splits it matches are included.
+
+        Yields:
+            Lists of XmlSplit objects.
+        """
+        chunk = []
+        for split in self._read_splits(accounts):
+            if split_filter is not None and not split_filter.matches(split.date, split.description):
+                continue
+            chunk.append(split)
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def get_split_rows(self, account_guids=None, exclude_account_guids=None, start_date=None, end_date=None):
+        """Gets the data of splits, in the same way as Book.
+
+        Args:
+            account_guids: Optional list of account guids; if given, only splits in these accounts are included.
+            exclude_account_guids: Optional list of account guids to leave out.
+            start_date: Optional earliest post date to include (date).
+            end_date: Optional latest post date to include (date).
+
+        Yields:
+            SplitRow named tuples, with the value as a Fraction.
+        """
+        accounts = self._get_all_accounts()
+        if account_guids is not None:
+            account_guids = set(account_guids)
+            accounts = [account for account in accounts if account.guid in account_guids]
+        if exclude_account_guids:
+            exclude_account_guids = set(exclude_account_guids)
+            accounts = [account for account in accounts if account.guid not in exclude_account_guids]
+        for split in self._read_splits(accounts):
+            if start_date is not None and split.date < start_date:
+                continue
+            if end_date is not None and split.date > end_date:
+                continue
+            yield SplitRow(guid=split.guid, account_guid=split.account.guid, date=split.date,
+                           value=Fraction(split.value), description=split.description)
+
+    def get_account_names_by_guid(self):
+        """Returns:
+            Dictionary of the full names of all the accounts in the book, keyed by guid.
+        """
+        return {account.guid: account.name for account in self._get_all_accounts()}
+
+    def get_currencies_by_account_guid(self):
+        """Gets the currency of every account, from the commodities read along with the accounts.
+
+        Returns:
+            Dictionary of moneyed Currency objects, keyed by account guid.
+        """
+        return {account.guid: account.currency for account in self._get_all_accounts()}
+
+    def get_fingerprint(self, account_guids):
+        """Gets a fingerprint of the splits in the supplied accounts, in the same way as Book.
+
+        Args:
+            account_guids: List of account guids (strings).
+
+        Returns:
+            Hex digest (string).
+        """
+        accounts_by_guid = {account.guid: account for account in self._get_all_accounts()}
+        accounts = [accounts_by_guid[guid] for guid in account_guids if guid in accounts_by_guid]
+        rows = sorted((split.guid, split.account.guid, split.value, split.description)
+                      for split in self._read_splits(accounts))
+        return fingerprint_rows(rows)
+
+    def get_snapshot_rows(self):
+        raise NotImplementedError('Snapshots cannot be made from GnuCash XML books. Save the book in '
+                                  'the SQLite format in GnuCash, then make a snapshot of that instead.')
+
+    def update_split_accounts(self, changes):
+        raise NotImplementedError('Changes cannot be saved to GnuCash XML books. Save the book in '
+                                  'the SQLite format in GnuCash, then apply a plan to that instead.')
+
+    def _read_accounts(self):
+        """Reads all the accounts from the file, stopping at the first transaction.
+
+        Returns:
+            List of XmlAccount objects, with their full names.
+        """
+        names_by_guid, parent_guids_by_guid, commodities_by_guid = {}, {}, {}
+        for event, element in self._iterparse():
+            if element.tag == GNC + 'transaction':
+                # The accounts are all listed before the transactions.
+                break
+            if event == 'end' and element.tag == GNC + 'account':
+                guid = element.findtext(ACT + 'id')
+                if element.findtext(ACT + 'type') != 'ROOT':
+                    names_by_guid[guid] = element.findtext(ACT + 'name')
+                    parent_guids_by_guid[guid] = element.findtext(ACT + 'parent')
+                    commodities_by_guid[guid] = element.findtext(ACT + 'commodity/' + CMDTY + 'id')
+                element.clear()
+
+        accounts = []
+        for guid in names_by_guid:
+            parts = []
+            ancestor_guid = guid
+            while ancestor_guid in names_by_guid:
+                parts.insert(0, names_by_guid[ancestor_guid])
+                ancestor_guid = parent_guids_by_guid[ancestor_guid]
+            commodity = commodities_by_guid[guid]
+            accounts.append(XmlAccount(guid=guid, name=self.ACCOUNT_NAME_SEPARATOR.join(parts),
+                                       currency=get_currency_for_commodity(commodity) if commodity else None))
+        return accounts
+
+    def _read_splits(self, accounts):
+        """Streams the transactions in the file, picking out the splits assigned to the accounts.
+        Each split is given the accounts of the other splits in its transaction.
+
+        Args:
+            accounts: List of XmlAccount objects.
+
+        Yields:
+            XmlSplit objects.
+        """
+        accounts_by_guid = {account.guid: account for account in accounts}
+        all_accounts_by_guid = {account.guid: account for account in self._get_all_accounts()}
+        book_element = None
+        for event, element in self._iterparse():
+            if event == 'start':
+                if element.tag == GNC + 'book':
+                    book_element = element
+                continue
+            if element.tag != GNC + 'transaction':
+                continue
+            date_text = element.findtext(TRN + 'date-posted/' + TS + 'date')
+            description = element.findtext(TRN + 'description') or ''
+            split_elements = list(element.iterfind(TRN + 'splits/' + TRN + 'split'))
+            account_guids = [split_element.findtext(SPLIT + 'account') for split_element in split_elements]
+            for index, split_element in enumerate(split_elements):
+                account = accounts_by_guid.get(account_guids[index])
+                if account:
+                    other_split_accounts = [all_accounts_by_guid[guid] for guid in
+                                            account_guids[:index] + account_guids[index + 1:]]
+                    yield XmlSplit(guid=split_element.findtext(SPLIT + 'id'),
+                                   account=account,
+                                   date=datetime.strptime(date_text, self.DATE_FORMAT).date(),
+                                   description=description,
+                                   value=split_element.findtext(SPLIT + 'value'),
+                                   quantity=split_element.findtext(SPLIT + 'quantity'),
+                                   other_split_accounts=other_split_accounts)
+            # Discard the transactions as we go, so the tree never grows.
+            element.clear()
+            if book_element is not None:
+                book_element.clear()
+
+    def _iterparse(self):
+        """Yields:
+            ('start' or 'end', Element) two-tuples, as the file is parsed.
+        """
+        with self._open() as book_file:
+            yield from iterparse(book_file, events=('start', 'end'))
+
+    def _open(self):
+        with open(self._filename, 'rb') as book_file:
+            compressed = book_file.read(len(self.GZIP_MAGIC)) == self.GZIP_MAGIC
+        if compressed:
+            return gzip.open(self._filename, 'rb')
+        return open(self._filename, 'rb')
+
+
+class XmlAccount:
+    """An account read from an XML book.
+
+    Args:
+        guid: The account's guid (string).
+        name: The full name of the account (string).
+        currency: The moneyed Currency of the account.
+    """
+    def __init__(self, guid, name, currency=None):
+        self.guid = guid
+        self.name = name
+        self.currency = currency
+
+    def __str__(self):
+        return self.name
+
+
+class XmlSplit:
+    """A split read from an XML book.
+
+    Args:
+        guid: The split's guid (string).
+        account: The XmlAccount the split is assigned to.
+        date: The date the transaction was posted (date).
+        description: The transaction's description (string).
+        value: The value of the split, as stored in the XML, e.g. '3000/100' (string).
+        quantity: The amount of the split in the account's currency, as stored in the XML (string).
+                  Defaults to the value.
+        other_split_accounts: The XmlAccounts of the other splits in the transaction (list).
+    """
+    def __init__(self, guid, account, date, description, value, quantity=None, other_split_accounts=()):
+        self.guid = guid
+        self.account = account
+        self.date = date
+        self.description = description
+        self.value = value
+        self.quantity = quantity if quantity is not None else value
+        self._other_split_accounts = list(other_split_accounts)
+
+    @property
+    def opposite_account(self):
+        """The account on the other side of the transaction.
+
+        Returns:
+            XmlAccount object.
+        Raises:
+            OppositeAccountNotDetermined, if the other splits in the transaction are not all in the same account.
+        """
+        if len({account.guid for account in self._other_split_accounts}) != 1:
+            raise OppositeAccountNotDetermined
+        return self._other_split_accounts[0]
+
+    @property
+    def amount(self):
+        """Returns:
+            The amount of the split, in the currency of its account (Money).
+        """
+        fraction = Fraction(self.quantity)
+        return Money(Decimal(fraction.numerator) / Decimal(fraction.denominator), self.account.currency)
@@ -0,0 +1,104 @@
+from unittest import TestCase
+from unittest.mock import Mock, patch, sentinel
+from datetime import date
+from fractions import Fraction
+from moneyed import GBP
+from gnucashcategorizer.backtest import Backtester, RuleResult, _PatternIndex
+from gnucashcategorizer.book import SplitRow
+from gnucashcategorizer.config import Config, MatchPattern
+from gnucashcategorizer.matcher import Matcher
+
+
+def make_row(guid, account_guid, description):
+    return SplitRow(guid=guid, account_guid=account_guid, date=date(2017, 3, 19),
+                    value=Fraction(5), description=description)
+
+
+class TestBacktester(TestCase):
+    def setUp(self):
+        with patch.object(Config, '_load_from_file'):
+            self.config = Config(sentinel.filename)
+        self.config._config_dict = {
+            'normalization': {'strip_digits': True, 'collapse_whitespace': True},
+            'matches': [
+                {'Imbalance-GBP': [
+                    {'Expenses:Groceries': ['TESCO', 'STORE *']},
+                    {'Expenses:Social': ['CASH *']},
+                ]},
+                {'Unresolved': [{'Income:Salary': ['MYEMPLOYER']}]},
+            ],
+        }
+        account_guids_by_name = {
+            'Imbalance-GBP': 'imbalance', 'Unresolved': 'unresolved', 'Expenses:Groceries': 'groceries',
+            'Expenses:Social': 'social', 'Income:Salary': 'salary',
+        }
+        self.book = Mock()
+        self.book.get_accounts_by_name.side_effect = lambda names: {
+            name: Mock(guid=account_guids_by_name[name], currency=GBP) for name in names}
+        self.book.get_split_rows.return_value = iter([
+            make_row('s1', 'groceries', 'TESCO 1234'),
+            make_row('s2', 'groceries', 'TESCO 5678'),
+            make_row('s3', 'groceries', 'STORE CASH 1'),
+            make_row('s4', 'groceries', 'SAINSBURYS'),
+            make_row('s5', 'social', 'CASH AT 1'),
+            make_row('s6', 'social', 'STORE BAR'),
+            make_row('s7', 'salary', 'MYEMPLOYER'),
+        ])
+
+    def test_run(self):
+        results = Backtester(self.config, self.book, start_date=date(2017, 1, 1)).run()
+
+        self.book.get_split_rows.assert_called_once_with(account_guids=['groceries', 'salary', 'social'],
+                                                         start_date=date(2017, 1, 1), end_date=None)
+        imbalance_result, unresolved_result = results
+        assert imbalance_result.account_name == 'Imbalance-GBP'
+        # Only the splits in the accounts the rules point to are tested
+        assert imbalance_result.split_count == 6
+        assert imbalance_result.matched_count == 5
+        assert imbalance_result.correct_count == 4
+        tesco, store, cash = imbalance_result.rule_results
+        assert tesco.match_pattern == MatchPattern('TESCO', 'Expenses:Groceries')
+        assert (tesco.matched_count, tesco.correct_count, tesco.precision, tesco.coverage) == (2, 2, 1.0, 0.5)
+        # STORE * wrongly matched a Social split
+        assert (store.matched_count, store.correct_count) == (2, 1)
+        assert store.precision == 0.5
+        assert store.wrong_account_counts == {'social': 1}
+        assert (cash.matched_count, cash.correct_count, cash.coverage) == (1, 1, 0.5)
+
+        assert unresolved_result.split_count == 1
+        [salary] = unresolved_result.rule_results
+        assert (salary.precision, salary.coverage) == (1.0, 1.0)
+
+    def test_run_for_some_accounts(self):
+        [result] = Backtester(self.config, self.book, account_names=['Unresolved']).run()
+
+        assert result.account_name == 'Unresolved'
+        self.book.get_split_rows.assert_called_once_with(account_guids=['salary'], start_date=None, end_date=None)
+
+
+class TestRuleResult(TestCase):
+    def test_rates_are_none_without_splits(self):
+        rule_result = RuleResult(sentinel.match_pattern, target_split_count=0)
+
+        assert rule_result.precision is None
+        assert rule_result.coverage is None
+
+
+class TestPatternIndex(TestCase):
+    def test_get_match_is_the_same_as_the_matcher(self):
+        with patch.object(Config, '_load_from_file'):
+            config = Config(sentinel.filename)
+        config._config_dict = {
+            'matches': [
+                {'Imbalance-GBP': [
+                    {'Expenses:Groceries': ['TESCO *', 'ST']},
+                    {'Expenses:Social': ['*BAR', 'STORE BAR']},
+                    {'Expenses:Household': ['STORE *', 'TE?CO', 'TESCO']},
+                ]},
+            ],
+        }
+        matcher = Matcher(config)
+        pattern_index = _PatternIndex(matcher.get_patterns('Imbalance-GBP'))
+
+        for description in ['TESCO', 'TESCO METRO', 'TEXCO', 'ST', 'STORE BAR', 'STORE FOO', 'THE BAR', 'TE', '']:
+            assert pattern_index.get_match(description) == matcher.get_match('Imbalance-GBP', description)
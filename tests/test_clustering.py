@@ -0,0 +1,98 @@
+from unittest import TestCase
+from unittest.mock import Mock
+from moneyed import Money, GBP, EUR
+from gnucashcategorizer.clustering import DescriptionClusterer, escape_pattern
+from gnucashcategorizer.config import MatchPattern
+from gnucashcategorizer.normalizer import DescriptionNormalizer
+
+
+def make_split(description, amount='10.00', currency=GBP, account='Imbalance-GBP'):
+    return Mock(description=description, amount=Money(amount, currency), account=account)
+
+
+class TestDescriptionClusterer(TestCase):
+    def setUp(self):
+        self.clusterer = DescriptionClusterer(DescriptionNormalizer(strip_digits=True, collapse_whitespace=True))
+
+    def get_clusters_by_pattern(self, splits):
+        return {cluster.pattern: cluster for cluster in self.clusterer.get_clusters(splits)}
+
+    def test_get_clusters(self):
+        clusters = self.get_clusters_by_pattern([
+            make_split('CARD PAYMENT TO TESCO 1234'),
+            make_split('CARD PAYMENT TO TESCO 5678'),
+            make_split('CARD PAYMENT TO AMAZON'),
+            make_split('NETFLIX.COM'),
+            make_split('NETFLIX.COM'),
+        ])
+
+        assert set(clusters) == {'CARD PAYMENT TO *', 'NETFLIX.COM'}
+        card = clusters['CARD PAYMENT TO *']
+        assert card.split_count == 3
+        # The most common descriptions come first
+        assert card.descriptions == ['CARD PAYMENT TO TESCO', 'CARD PAYMENT TO AMAZON']
+        assert clusters['NETFLIX.COM'].descriptions == ['NETFLIX.COM']
+
+    def test_descriptions_sharing_a_first_word_are_split_where_they_fork(self):
+        clusters = self.get_clusters_by_pattern([
+            make_split('DD BRITISH GAS'),
+            make_split('DD COUNCIL TAX'),
+            make_split('DD COUNCIL TAX'),
+        ])
+
+        # No catch-all 'DD *' pattern is proposed
+        assert set(clusters) == {'DD BRITISH GAS', 'DD COUNCIL TAX'}
+        assert clusters['DD COUNCIL TAX'].split_count == 2
+
+    def test_no_pattern_is_proposed_for_a_short_prefix(self):
+        clusters = self.get_clusters_by_pattern([
+            make_split('TESCO'),
+            make_split('TESCO METRO'),
+            make_split('TESCO STORES'),
+            make_split('DD UK A'),
+            make_split('DD UK B'),
+        ])
+
+        assert set(clusters) == {'TESCO', 'TESCO METRO', 'TESCO STORES', 'DD UK A', 'DD UK B'}
+
+    def test_proposed_patterns_match_every_description(self):
+        splits = [make_split(description) for description in
+                  ['PAYPAL *SPOTIFY', 'PAYPAL *SPOTIFY A', 'PAYPAL *SPOTIFY B', 'SAINSBURYS [ONLINE]',
+                   'WHAT? NOW THEN A', 'WHAT? NOW THEN B', 'WHAT? NOW', '']]
+
+        clusters = self.clusterer.get_clusters(splits)
+
+        assert {cluster.pattern for cluster in clusters} == {'PAYPAL [*]SPOTIFY*', 'SAINSBURYS [[]ONLINE]',
+                                                             'WHAT[?] NOW THEN *', 'WHAT[?] NOW', ''}
+        for cluster in clusters:
+            match_pattern = MatchPattern(cluster.pattern, 'Expenses')
+            assert all(match_pattern.is_match(description) for description in cluster.descriptions)
+
+    def test_clusters_are_ranked_by_count_then_amount(self):
+        clusters = self.clusterer.get_clusters([
+            make_split('SMALL', '1.00'),
+            make_split('LARGE', '-500.00'),
+            make_split('FREQUENT FLYER A', '1.00'),
+            make_split('FREQUENT FLYER B', '1.00'),
+        ])
+
+        assert [cluster.pattern for cluster in clusters] == ['FREQUENT FLYER *', 'LARGE', 'SMALL']
+
+    def test_totals_are_kept_per_currency(self):
+        [cluster] = self.clusterer.get_clusters([
+            make_split('AMAZON MARKETPLACE UK', '10.00', GBP, account='Imbalance-GBP'),
+            make_split('AMAZON MARKETPLACE DE', '5.00', EUR, account='Imbalance-EUR'),
+            make_split('AMAZON MARKETPLACE UK', '2.50', GBP, account='Imbalance-GBP'),
+        ])
+
+        assert cluster.total_amounts == [Money('12.50', GBP), Money('5.00', EUR)]
+        assert cluster.account_name_counts == {'Imbalance-GBP': 2, 'Imbalance-EUR': 1}
+
+    def test_get_clusters_without_splits(self):
+        assert self.clusterer.get_clusters([]) == []
+
+
+class TestEscapePattern(TestCase):
+    def test_escape_pattern(self):
+        assert escape_pattern('50% OFF* [SALE]?') == '50% OFF[*] [[]SALE][?]'
+        assert MatchPattern(escape_pattern('50% OFF* [SALE]?'), 'Expenses').is_match('50% OFF* [SALE]?')
@@ -1,9 +1,23 @@
 from unittest import TestCase
-from unittest.mock import Mock, patch, call, sentinel
+from unittest.mock import Mock, MagicMock, patch, call, sentinel
+import os
 import sys
-from moneyed import Money, GBP
+import tempfile
+from argparse import ArgumentTypeError
+from moneyed import Money, GBP, EUR, USD, CHF
 from datetime import date
+from collections import Counter
 from gnucashcategorizer.commandhandler import CommandHandler, CommandOptions
+from gnucashcategorizer.plan import BookChanged, PlanEntry
+from gnucashcategorizer.journal import RunNotFound
+from gnucashcategorizer.statements import InvalidStatement
+from gnucashcategorizer.matcher import Explanation
+from gnucashcategorizer.config import Config, MatchPattern
+from gnucashcategorizer.book import SplitRow, AccountsNotFound, CommodityMismatch, UnexpectedRowCount
+from fractions import Fraction
+
+
+SAMPLE_BOOK_FILENAME = os.path.join(os.path.dirname(__file__), 'sample_book.xml')
 
 
 class TestCommandOptions(TestCase):
@@ -18,9 +32,87 @@ class TestCommandOptions(TestCase):
             mock_config_cls.assert_called_once_with(filename=sentinel.config_filename)
 
     def test_get_book(self):
-        with patch('gnucashcategorizer.commandhandler.Book', return_value=sentinel.book) as mock_book_cls:
-            assert self.options.get_book() == sentinel.book
-            mock_book_cls.assert_called_once_with(filename=sentinel.book_filename)
+        options = CommandOptions(config_filename=sentinel.config_filename,
+                                 book_filename='accounts.gnucash')
+        with patch('gnucashcategorizer.commandhandler.SnapshotBook.is_snapshot_file', return_value=False):
+            with patch('gnucashcategorizer.commandhandler.XmlBook.is_xml_file', return_value=False):
+                with patch('gnucashcategorizer.commandhandler.Book', return_value=sentinel.book) as mock_book_cls:
+                    assert options.get_book() == sentinel.book
+                    # The book is only opened once
+                    assert options.get_book() == sentinel.book
+                    mock_book_cls.assert_called_once_with(filename='accounts.gnucash', read_only=False)
+
+    def test_get_book_for_reading(self):
+        for command in (CommandOptions.COMMAND_PLAN, CommandOptions.COMMAND_BACKTEST,
+                        CommandOptions.COMMAND_CLUSTER, CommandOptions.COMMAND_SNAPSHOT):
+            options = CommandOptions(config_filename=sentinel.config_filename, book_filename='accounts.gnucash',
+                                     command=command)
+            with patch('gnucashcategorizer.commandhandler.SnapshotBook.is_snapshot_file', return_value=False):
+                with patch('gnucashcategorizer.commandhandler.XmlBook.is_xml_file', return_value=False):
+                    with patch('gnucashcategorizer.commandhandler.Book') as mock_book_cls:
+                        options.get_book()
+
+            mock_book_cls.assert_called_once_with(filename='accounts.gnucash', read_only=True)
+
+    def test_get_book_for_xml_file(self):
+        options = CommandOptions(config_filename=sentinel.config_filename,
+                                 book_filename='accounts.gnucash')
+        with patch('gnucashcategorizer.commandhandler.SnapshotBook.is_snapshot_file', return_value=False):
+            with patch('gnucashcategorizer.commandhandler.XmlBook') as mock_xml_book_cls:
+                mock_xml_book_cls.is_xml_file.return_value = True
+                assert options.get_book() == mock_xml_book_cls.return_value
+
+        mock_xml_book_cls.is_xml_file.assert_called_once_with('accounts.gnucash')
+        mock_xml_book_cls.assert_called_once_with(filename='accounts.gnucash')
+
+    def test_get_book_for_database_uri(self):
+        options = CommandOptions(config_filename=sentinel.config_filename,
+                                 book_filename='postgresql://localhost/accounts')
+        with patch('gnucashcategorizer.commandhandler.SnapshotBook') as mock_snapshot_book_cls:
+            with patch('gnucashcategorizer.commandhandler.Book', return_value=sentinel.book) as mock_book_cls:
+                assert options.get_book() == sentinel.book
+
+        # There is no file to look at
+        assert not mock_snapshot_book_cls.is_snapshot_file.called
+        mock_book_cls.assert_called_once_with(filename='postgresql://localhost/accounts', read_only=False)
+
+    def test_get_book_for_snapshot_file(self):
+        options = CommandOptions(config_filename=sentinel.config_filename,
+                                 book_filename='accounts.gnucash')
+        with patch('gnucashcategorizer.commandhandler.SnapshotBook') as mock_snapshot_book_cls:
+            mock_snapshot_book_cls.is_snapshot_file.return_value = True
+            assert options.get_book() == mock_snapshot_book_cls.return_value
+
+        mock_snapshot_book_cls.is_snapshot_file.assert_called_once_with('accounts.gnucash')
+        mock_snapshot_book_cls.assert_called_once_with(filename='accounts.gnucash')
+
+    def test_get_split_filter(self):
+        options = CommandOptions(config_filename=sentinel.config_filename, book_filename=sentinel.book_filename,
+                                 account_names=['Imbalance-GBP'], start_date=date(2017, 3, 1))
+
+        split_filter = options.get_split_filter()
+
+        assert split_filter.account_names == ['Imbalance-GBP']
+        assert split_filter.start_date == date(2017, 3, 1)
+        assert split_filter.end_date is None
+        assert split_filter.description_like is None
+
+    def test_get_split_filter_is_none_without_filters(self):
+        assert self.options.get_split_filter() is None
+
+    def test_get_metrics(self):
+        options = CommandOptions(config_filename=sentinel.config_filename, book_filename=sentinel.book_filename,
+                                 metrics_filename='metrics.prom')
+        book = Mock()
+        with patch.object(options, 'get_book', return_value=book):
+            metrics = options.get_metrics()
+            # The metrics are only made once
+            assert options.get_metrics() is metrics
+
+        book.listen_for_statements.assert_called_once_with(metrics.count_statement)
+
+    def test_get_metrics_is_none_without_filename(self):
+        assert self.options.get_metrics() is None
 
 
 class TestCommandHandler(TestCase):
@@ -29,59 +121,736 @@ class TestCommandHandler(TestCase):
     def setUpClass(cls):
         cls.command_handler = CommandHandler()
 
-    def test_run_user_accepts(self):
-        with patch.object(self.command_handler, '_parse_options_from_command_line') as mock_parse:
-            with patch.object(self.command_handler, '_get_and_preview_suggestions') as mock_preview:
-                with patch.object(self.command_handler, '_user_accepts_suggestions', return_value=True):
-                    with patch.object(self.command_handler, '_save_suggestions') as mock_save:
-                        with patch.object(self.command_handler, '_print_message'):
-                            mock_parse.return_value = sentinel.options
-                            mock_preview.return_value = sentinel.suggestions
+    def test_run_dispatches_to_command(self):
+        for command, runner_name in [
+            (CommandOptions.COMMAND_CATEGORIZE, '_categorize'),
+            (CommandOptions.COMMAND_PLAN, '_plan'),
+            (CommandOptions.COMMAND_APPLY, '_apply'),
+            (CommandOptions.COMMAND_WATCH, '_watch'),
+            (CommandOptions.COMMAND_SERVE, '_serve'),
+            (CommandOptions.COMMAND_UNDO, '_undo'),
+            (CommandOptions.COMMAND_ANNOTATE, '_annotate'),
+            (CommandOptions.COMMAND_SNAPSHOT, '_snapshot'),
+            (CommandOptions.COMMAND_BACKTEST, '_backtest'),
+        ]:
+            options = Mock(command=command)
+            with patch.object(self.command_handler, '_parse_options_from_command_line', return_value=options):
+                with patch.object(self.command_handler, runner_name) as mock_runner:
+                    self.command_handler.run()
+
+            mock_runner.assert_called_once_with(options)
+
+    def test_run_writes_metrics(self):
+        options = Mock(command=CommandOptions.COMMAND_PLAN, metrics_filename='metrics.json')
+        with patch.object(self.command_handler, '_parse_options_from_command_line', return_value=options):
+            with patch.object(self.command_handler, '_plan'):
+                self.command_handler.run()
+
+        options.get_metrics.return_value.write.assert_called_once_with('metrics.json')
+
+    def test_run_reports_unknown_accounts(self):
+        options = Mock(command=CommandOptions.COMMAND_CATEGORIZE)
+        with patch.object(self.command_handler, '_parse_options_from_command_line', return_value=options):
+            with patch.object(self.command_handler, '_categorize',
+                              side_effect=AccountsNotFound(['Expenses:Grocreies', 'Expenses:Sosial'])):
+                with patch.object(self.command_handler, '_print_message') as mock_print_message:
+                    self.command_handler.run()
+
+        mock_print_message.assert_called_once_with(
+            'Could not find accounts: Expenses:Grocreies, Expenses:Sosial. '
+            'Please check the account names in the config file.',
+            CommandHandler.MESSAGE_ERROR)
+
+    def test_run_reports_patterns_in_other_commodities(self):
+        options = Mock(command=CommandOptions.COMMAND_CATEGORIZE)
+        error = CommodityMismatch('Patterns cannot move splits between accounts in different commodities: '
+                                  'Imbalance-EUR to Expenses:Groceries.')
+        with patch.object(self.command_handler, '_parse_options_from_command_line', return_value=options):
+            with patch.object(self.command_handler, '_categorize', side_effect=error):
+                with patch.object(self.command_handler, '_print_message') as mock_print_message:
+                    self.command_handler.run()
+
+        mock_print_message.assert_called_once_with(
+            'Patterns cannot move splits between accounts in different commodities: '
+            'Imbalance-EUR to Expenses:Groceries. Please check the patterns in the config file.',
+            CommandHandler.MESSAGE_ERROR)
 
-                            self.command_handler.run()
+    def test_categorize_user_accepts(self):
+        with patch.object(self.command_handler, '_get_and_preview_suggestions') as mock_preview:
+            with patch.object(self.command_handler, '_user_accepts_suggestions', return_value=True):
+                with patch.object(self.command_handler, '_save_suggestions') as mock_save:
+                    with patch.object(self.command_handler, '_print_message'):
+                        mock_preview.return_value = sentinel.suggestions
+                        options = Mock(review=False)
+                        options.get_book.return_value.read_only = False
 
-                            mock_preview.assert_called_once_with(sentinel.options)
-                            mock_save.assert_called_once_with(sentinel.suggestions)
+                        self.command_handler._categorize(options)
 
-    def test_run_user_does_not_accept(self):
+                        mock_preview.assert_called_once_with(options)
+                        mock_save.assert_called_once_with(options, sentinel.suggestions)
+
+    def test_categorize_user_does_not_accept(self):
         # TODO make this test and the one above more DRY.
-        with patch.object(self.command_handler, '_parse_options_from_command_line') as mock_parse:
-            with patch.object(self.command_handler, '_get_and_preview_suggestions') as mock_preview:
-                with patch.object(self.command_handler, '_user_accepts_suggestions', return_value=False):
+        with patch.object(self.command_handler, '_get_and_preview_suggestions') as mock_preview:
+            with patch.object(self.command_handler, '_user_accepts_suggestions', return_value=False):
+                with patch.object(self.command_handler, '_save_suggestions') as mock_save:
+                    with patch.object(self.command_handler, '_print_message') as mock_print:
+                        mock_preview.return_value = sentinel.suggestions
+                        options = Mock(review=False)
+                        options.get_book.return_value.read_only = False
+
+                        self.command_handler._categorize(options)
+
+                        mock_preview.assert_called_once_with(options)
+                        assert not mock_save.called
+                        mock_print.assert_called_once_with('Aborted.',
+                                                           self.command_handler.MESSAGE_WARNING)
+
+    def test_categorize_with_review_saves_accepted_suggestions(self):
+        options = Mock(review=True)
+        options.get_book.return_value.read_only = False
+        suggestions = [sentinel.suggestion_1, sentinel.suggestion_2]
+        with patch.object(self.command_handler, '_get_suggestions_and_splits_without_suggestions',
+                          return_value=(suggestions, sentinel.splits_without_suggestions)):
+            with patch.object(self.command_handler, '_render_splits_without_suggestions'):
+                with patch('gnucashcategorizer.commandhandler.review_suggestions',
+                           return_value=[sentinel.suggestion_2]) as mock_review:
+                    with patch.object(self.command_handler, '_save_suggestions') as mock_save:
+                        with patch.object(self.command_handler, '_print_message') as mock_print:
+                            self.command_handler._categorize(options)
+
+        mock_review.assert_called_once_with(suggestions)
+        mock_save.assert_called_once_with(options, [sentinel.suggestion_2])
+        mock_print.assert_called_once_with('\nAccepted 1 of 2 suggestions.')
+
+    def test_categorize_with_review_user_quits(self):
+        options = Mock(review=True)
+        options.get_book.return_value.read_only = False
+        with patch.object(self.command_handler, '_get_suggestions_and_splits_without_suggestions',
+                          return_value=([sentinel.suggestion], [])):
+            with patch.object(self.command_handler, '_render_splits_without_suggestions'):
+                with patch('gnucashcategorizer.commandhandler.review_suggestions', return_value=None):
                     with patch.object(self.command_handler, '_save_suggestions') as mock_save:
                         with patch.object(self.command_handler, '_print_message') as mock_print:
-                            mock_parse.return_value = sentinel.options
-                            mock_preview.return_value = sentinel.suggestions
+                            self.command_handler._categorize(options)
+
+        assert not mock_save.called
+        mock_print.assert_called_once_with('Aborted.', self.command_handler.MESSAGE_WARNING)
+
+    def test_categorize_read_only_book(self):
+        with patch.object(self.command_handler, '_get_and_preview_suggestions'):
+            with patch.object(self.command_handler, '_user_accepts_suggestions') as mock_user_accepts:
+                with patch.object(self.command_handler, '_save_suggestions') as mock_save:
+                    with patch.object(self.command_handler, '_print_message') as mock_print:
+                        options = Mock(review=False)
+                        options.get_book.return_value.read_only = True
+
+                        self.command_handler._categorize(options)
+
+        assert not mock_user_accepts.called
+        assert not mock_save.called
+        mock_print.assert_called_once_with(
+            '\nThe accounts file is read only, so the suggestions cannot be saved. '
+            'Use the plan command to save them to a plan file instead.',
+            self.command_handler.MESSAGE_WARNING)
+
+    def test_plan(self):
+        options = Mock(plan_filename='plan.json', explain_sample=None)
+        suggester = Mock()
+        suggester.get_suggestions.return_value = [sentinel.suggestion_1, sentinel.suggestion_2]
+        with patch.object(self.command_handler, '_get_suggester', return_value=suggester):
+            with patch.object(self.command_handler, '_render_suggestions') as mock_render_suggestions:
+                with patch.object(self.command_handler, '_render_splits_without_suggestions') as mock_render_splits:
+                    with patch.object(self.command_handler, '_print_message') as mock_print:
+                        self.command_handler._plan(options)
+
+        mock_render_suggestions.assert_called_once_with([sentinel.suggestion_1, sentinel.suggestion_2])
+        mock_render_splits.assert_called_once_with(suggester.get_splits_without_suggestions.return_value)
+        suggester.get_plan.assert_called_once_with([sentinel.suggestion_1, sentinel.suggestion_2])
+        suggester.get_plan.return_value.write.assert_called_once_with('plan.json')
+        mock_print.assert_called_once_with('\nSaved 2 suggestions to plan.json.',
+                                           self.command_handler.MESSAGE_SUCCESS)
+
+    def test_apply(self):
+        options = Mock(plan_filename='plan.json', book_filename='accounts.gnucash')
+        book = options.get_book.return_value
+        book.read_only = False
+        journal = options.get_journal.return_value
+        journal.save_changes.return_value = 'run1'
+        plan = Mock(account_guids=sentinel.account_guids, entries=[sentinel.entry_1, sentinel.entry_2])
+        with patch('gnucashcategorizer.commandhandler.Plan.read', return_value=plan) as mock_read:
+            with patch.object(self.command_handler, '_print_message') as mock_print:
+                self.command_handler._apply(options)
+
+        mock_read.assert_called_once_with('plan.json')
+        book.get_fingerprint.assert_called_once_with(sentinel.account_guids)
+        plan.check_fingerprint.assert_called_once_with(book.get_fingerprint.return_value)
+        journal.save_changes.assert_called_once_with(book, plan.entries)
+        mock_print.assert_has_calls([
+            call('Applied 2 changes.', self.command_handler.MESSAGE_SUCCESS),
+            call('To undo this, run: gnucash-categorize undo accounts.gnucash run1'),
+        ])
+
+    def test_undo(self):
+        options = Mock(book_filename='accounts.gnucash', run_id='run1')
+        options.get_book.return_value.read_only = False
+        journal = options.get_journal.return_value
+        journal.get_entries.return_value = [PlanEntry('s1', 'o1', 'a1', 'abcd1234')]
+        journal.save_changes.return_value = 'run2'
+        with patch.object(self.command_handler, '_print_message') as mock_print:
+            self.command_handler._undo(options)
+
+        journal.get_entries.assert_called_once_with('run1')
+        journal.save_changes.assert_called_once_with(options.get_book.return_value,
+                                                     [PlanEntry('s1', 'a1', 'o1', 'abcd1234')])
+        mock_print.assert_has_calls([
+            call('Undid 1 changes from run run1.', self.command_handler.MESSAGE_SUCCESS),
+            call('To undo this, run: gnucash-categorize undo accounts.gnucash run2'),
+        ])
+
+    def test_annotate(self):
+        options = Mock(statement_filename='statement.csv', annotated_filename='out.csv')
+        with patch('gnucashcategorizer.commandhandler.Matcher') as mock_matcher_cls:
+            with patch('gnucashcategorizer.commandhandler.StatementAnnotator') as mock_annotator_cls:
+                mock_annotator_cls.return_value.annotate.return_value = (10, 7)
+                with patch.object(self.command_handler, '_print_message') as mock_print:
+                    self.command_handler._annotate(options)
+
+        mock_matcher_cls.assert_called_once_with(options.get_config())
+        mock_annotator_cls.assert_called_once_with(mock_matcher_cls.return_value,
+                                                   account_name=options.statement_account_name,
+                                                   encoding=options.encoding,
+                                                   description_column=options.description_column)
+        mock_annotator_cls.return_value.annotate.assert_called_once_with('statement.csv', 'out.csv')
+        mock_print.assert_called_once_with('Matched 7 of 10 transactions. Saved to out.csv.',
+                                           self.command_handler.MESSAGE_SUCCESS)
+
+    def test_annotate_invalid_statement(self):
+        options = Mock(statement_filename='statement.txt', annotated_filename='out.txt')
+        with patch('gnucashcategorizer.commandhandler.Matcher'):
+            with patch('gnucashcategorizer.commandhandler.StatementAnnotator') as mock_annotator_cls:
+                mock_annotator_cls.return_value.annotate.side_effect = InvalidStatement('Bad statement.')
+                with patch.object(self.command_handler, '_print_message') as mock_print:
+                    self.command_handler._annotate(options)
+
+        mock_print.assert_called_once_with('Bad statement.', self.command_handler.MESSAGE_ERROR)
+
+    def test_undo_in_read_only_book(self):
+        options = Mock(run_id='run1')
+        options.get_book.return_value.read_only = True
+        with patch.object(self.command_handler, '_print_message') as mock_print:
+            self.command_handler._undo(options)
+
+        assert not options.get_journal.called
+        mock_print.assert_called_once_with('The accounts file is read only, so run run1 cannot be undone in it.',
+                                           self.command_handler.MESSAGE_ERROR)
+
+    def test_undo_unknown_run(self):
+        options = Mock(run_id='run1')
+        options.get_book.return_value.read_only = False
+        options.get_journal.return_value.get_entries.side_effect = RunNotFound('There is no run run1.')
+        with patch.object(self.command_handler, '_print_message') as mock_print:
+            self.command_handler._undo(options)
+
+        assert not options.get_journal.return_value.save_changes.called
+        mock_print.assert_called_once_with('There is no run run1.', self.command_handler.MESSAGE_ERROR)
+
+    def test_undo_aborts_if_splits_have_moved_since(self):
+        options = Mock(run_id='run1')
+        options.get_book.return_value.read_only = False
+        journal = options.get_journal.return_value
+        journal.get_entries.return_value = [PlanEntry('s1', 'o1', 'a1', 'abcd1234')]
+        journal.save_changes.side_effect = UnexpectedRowCount('Expected to move 1 splits, but 0 could be moved.')
+        with patch.object(self.command_handler, '_print_message') as mock_print:
+            self.command_handler._undo(options)
+
+        mock_print.assert_has_calls([
+            call('Expected to move 1 splits, but 0 could be moved. Some of the transactions have been changed '
+                 'since run run1, so it cannot be undone.', self.command_handler.MESSAGE_ERROR),
+            call('Aborted.', self.command_handler.MESSAGE_WARNING),
+        ])
+
+    def test_undo_aborts_if_splits_would_change_commodity(self):
+        options = Mock(run_id='run1')
+        options.get_book.return_value.read_only = False
+        journal = options.get_journal.return_value
+        journal.get_entries.return_value = [PlanEntry('s1', 'o1', 'a1', 'abcd1234')]
+        journal.save_changes.side_effect = CommodityMismatch(
+            'Splits cannot be moved between accounts in different commodities: Expenses:Groceries to Imbalance-EUR.')
+        with patch.object(self.command_handler, '_print_message') as mock_print:
+            self.command_handler._undo(options)
+
+        mock_print.assert_has_calls([
+            call('Splits cannot be moved between accounts in different commodities: Expenses:Groceries to '
+                 'Imbalance-EUR. Run run1 cannot be undone.', self.command_handler.MESSAGE_ERROR),
+            call('Aborted.', self.command_handler.MESSAGE_WARNING),
+        ])
+
+    def test_apply_aborts_if_book_changed(self):
+        options = Mock(plan_filename='plan.json')
+        book = options.get_book.return_value
+        book.read_only = False
+        plan = Mock()
+        plan.check_fingerprint.side_effect = BookChanged('The book changed.')
+        with patch('gnucashcategorizer.commandhandler.Plan.read', return_value=plan):
+            with patch.object(self.command_handler, '_print_message') as mock_print:
+                self.command_handler._apply(options)
+
+        assert not book.update_split_accounts.called
+        mock_print.assert_has_calls([
+            call('The book changed. Please make a new plan.', self.command_handler.MESSAGE_ERROR),
+            call('Aborted.', self.command_handler.MESSAGE_WARNING),
+        ])
+
+    def test_apply_aborts_if_splits_have_moved_since(self):
+        options = Mock(plan_filename='plan.json')
+        options.get_book.return_value.read_only = False
+        options.get_journal.return_value.save_changes.side_effect = UnexpectedRowCount(
+            'Expected to move 2 splits, but 1 could be moved.')
+        with patch('gnucashcategorizer.commandhandler.Plan.read'):
+            with patch.object(self.command_handler, '_print_message') as mock_print:
+                self.command_handler._apply(options)
+
+        mock_print.assert_has_calls([
+            call('Expected to move 2 splits, but 1 could be moved. Some of the transactions have been changed '
+                 'since the plan was made, so it cannot be applied. Please make a new plan.',
+                 self.command_handler.MESSAGE_ERROR),
+            call('Aborted.', self.command_handler.MESSAGE_WARNING),
+        ])
+        assert mock_print.call_count == 2
+
+    def test_apply_aborts_if_splits_would_change_commodity(self):
+        options = Mock(plan_filename='plan.json')
+        options.get_book.return_value.read_only = False
+        options.get_journal.return_value.save_changes.side_effect = CommodityMismatch(
+            'Splits cannot be moved between accounts in different commodities: Imbalance-EUR to Expenses:Groceries.')
+        with patch('gnucashcategorizer.commandhandler.Plan.read'):
+            with patch.object(self.command_handler, '_print_message') as mock_print:
+                self.command_handler._apply(options)
+
+        mock_print.assert_has_calls([
+            call('Splits cannot be moved between accounts in different commodities: Imbalance-EUR to '
+                 'Expenses:Groceries. Please change the rules, and make a new plan.',
+                 self.command_handler.MESSAGE_ERROR),
+            call('Aborted.', self.command_handler.MESSAGE_WARNING),
+        ])
+
+    def test_apply_to_read_only_book(self):
+        options = Mock(plan_filename='plan.json')
+        options.get_book.return_value.read_only = True
+        with patch('gnucashcategorizer.commandhandler.Plan.read') as mock_read:
+            with patch.object(self.command_handler, '_print_message') as mock_print:
+                self.command_handler._apply(options)
+
+        assert not mock_read.called
+        assert not options.get_journal.called
+        mock_print.assert_called_once_with('The accounts file is read only, so the plan cannot be applied to it.',
+                                           self.command_handler.MESSAGE_ERROR)
+
+    def test_snapshot(self):
+        options = Mock(snapshot_filename='accounts.snapshot')
+        with patch('gnucashcategorizer.commandhandler.SnapshotBook.write', return_value=12) as mock_write:
+            with patch.object(self.command_handler, '_print_message') as mock_print:
+                self.command_handler._snapshot(options)
+
+        mock_write.assert_called_once_with(options.get_book.return_value, 'accounts.snapshot')
+        mock_print.assert_called_once_with('Saved 12 transaction splits to accounts.snapshot.',
+                                           self.command_handler.MESSAGE_SUCCESS)
+
+    def test_snapshot_of_xml_book(self):
+        with tempfile.TemporaryDirectory() as directory:
+            snapshot_filename = os.path.join(directory, 'accounts.snapshot')
+            options = CommandOptions(config_filename=None, book_filename=SAMPLE_BOOK_FILENAME,
+                                     snapshot_filename=snapshot_filename)
+            with patch.object(self.command_handler, '_print_message') as mock_print:
+                self.command_handler._snapshot(options)
+
+            assert not os.listdir(directory)
+        mock_print.assert_called_once_with(
+            'Snapshots cannot be made from GnuCash XML books. Save the book in the SQLite format in GnuCash, '
+            'then make a snapshot of that instead.', self.command_handler.MESSAGE_ERROR)
 
-                            self.command_handler.run()
+    def test_backtest(self):
+        options = Mock(account_names=['Imbalance-GBP'], start_date=date(2017, 3, 1), end_date=None)
+        options.get_book.return_value.get_account_names_by_guid.return_value = {'social': 'Expenses:Social'}
+        rule_result = Mock(match_pattern=MatchPattern('STORE *', 'Expenses:Groceries'), matched_count=4,
+                           precision=0.75, coverage=0.5, wrong_account_counts=Counter({'social': 1}))
+        result = Mock(account_name='Imbalance-GBP', rule_results=[rule_result], split_count=10,
+                      matched_count=4, correct_count=3)
+        with patch('gnucashcategorizer.commandhandler.Backtester') as mock_backtester_cls:
+            mock_backtester_cls.return_value.run.return_value = [result]
+            with patch.object(self.command_handler, '_print_message') as mock_print:
+                self.command_handler._backtest(options)
+
+        mock_backtester_cls.assert_called_once_with(options.get_config(), options.get_book(),
+                                                    account_names=['Imbalance-GBP'],
+                                                    start_date=date(2017, 3, 1), end_date=None)
+        mock_print.assert_has_calls([
+            call('\nRules for Imbalance-GBP, tried against 10 categorized transactions:\n'),
+            call(self.command_handler._format_cells(['Rule', 'Pattern', 'Account', 'Matched', 'Precision', 'Coverage',
+                                                     'Most often wrong about'])),
+            call('-' * self.command_handler.COLUMN_WIDTH * 7),
+            call(self.command_handler._format_cells([
+                rule_result.match_pattern.rule_id, 'STORE *', 'Expenses:Groceries', '4', '75.0%', '50.0%',
+                'Expenses:Social (1)'])),
+            call('\nMatched 4 of 10 transactions, 3 of them correctly.'),
+        ])
 
-                            mock_preview.assert_called_once_with(sentinel.options)
-                            assert not mock_save.called
-                            mock_print.assert_called_once_with('Aborted.',
-                                                               self.command_handler.MESSAGE_WARNING)
+    def test_cluster(self):
+        options = Mock(cluster_limit=1)
+        options.get_config.return_value.get_normalizer.return_value.normalize.side_effect = lambda text: text
+        splits = [
+            Mock(description='AMAZON MKTPLACE PMTS A1', amount=Money('7.99', GBP), account='Imbalance-GBP'),
+            Mock(description='AMAZON MKTPLACE PMTS B2', amount=Money('20.00', GBP), account='Imbalance-GBP'),
+            Mock(description='NETFLIX', amount=Money('9.99', GBP), account='Unresolved'),
+        ]
+        suggester = Mock()
+        suggester.get_splits_without_suggestions.return_value = splits
+        with patch.object(self.command_handler, '_get_suggester', return_value=suggester):
+            with patch.object(self.command_handler, '_print_message') as mock_print:
+                self.command_handler._cluster(options)
+
+        suggester.get_suggestions.assert_called_once_with()
+        mock_print.assert_has_calls([
+            call('\nTransactions without suggestions, clustered by description:\n'),
+            call(self.command_handler._format_cells(['Pattern', 'Transactions', 'Descriptions', 'Total', 'Accounts'])),
+            call('-' * self.command_handler.COLUMN_WIDTH * 5),
+            call(self.command_handler._format_cells(['AMAZON MKTPLACE PMTS *', '2', '2', '£27.99', 'Imbalance-GBP'])),
+            call('\nFound 2 clusters of the 3 transactions without suggestions.'),
+        ])
+
+    def test_format_rate(self):
+        assert self.command_handler._format_rate(0.1234) == '12.3%'
+        assert self.command_handler._format_rate(None) == '-'
+
+    def test_watch(self):
+        options = Mock(book_filename='accounts.gnucash')
+        options.get_book.return_value.read_only = False
+        watcher = Mock()
+        watcher.watch.return_value = iter([
+            ([sentinel.suggestion_1, sentinel.suggestion_2], [], 'run1'),
+            ([], [sentinel.split], None),
+        ])
+        with patch.object(self.command_handler, '_get_watcher', return_value=watcher):
+            with patch.object(self.command_handler, '_render_suggestions') as mock_render_suggestions:
+                with patch.object(self.command_handler, '_render_splits_without_suggestions') as mock_render_splits:
+                    with patch.object(self.command_handler, '_print_message') as mock_print:
+                        self.command_handler._watch(options)
+
+        mock_render_suggestions.assert_called_once_with([sentinel.suggestion_1, sentinel.suggestion_2])
+        mock_render_splits.assert_called_once_with([sentinel.split])
+        mock_print.assert_has_calls([
+            call('Watching accounts.gnucash for changes. Press Ctrl+C to stop.'),
+            call('\nSaved 2 suggestions.', self.command_handler.MESSAGE_SUCCESS),
+            call('To undo this, run: gnucash-categorize undo accounts.gnucash run1'),
+        ])
+
+    def test_watch_carries_on_if_suggestions_cannot_be_saved(self):
+        options = Mock(book_filename='accounts.gnucash')
+        options.get_book.return_value.read_only = False
+        watcher = Mock()
+        watcher.watch.side_effect = [
+            UnexpectedRowCount('Expected to move 2 splits, but 1 could be moved.'),
+            iter([([], [sentinel.split], None)]),
+        ]
+        with patch.object(self.command_handler, '_get_watcher', return_value=watcher):
+            with patch.object(self.command_handler, '_render_splits_without_suggestions') as mock_render_splits:
+                with patch.object(self.command_handler, '_print_message') as mock_print:
+                    self.command_handler._watch(options)
+
+        assert watcher.watch.call_count == 2
+        mock_print.assert_any_call('Expected to move 2 splits, but 1 could be moved. None of the suggestions '
+                                   'have been saved.', self.command_handler.MESSAGE_ERROR)
+        mock_render_splits.assert_called_once_with([sentinel.split])
+
+    def test_watch_stops_on_keyboard_interrupt(self):
+        options = Mock(book_filename='accounts.gnucash')
+        options.get_book.return_value.read_only = False
+        watcher = Mock()
+        watcher.watch.side_effect = KeyboardInterrupt
+        with patch.object(self.command_handler, '_get_watcher', return_value=watcher):
+            with patch.object(self.command_handler, '_print_message') as mock_print:
+                self.command_handler._watch(options)
+
+        mock_print.assert_called_with('\nStopped.', self.command_handler.MESSAGE_WARNING)
+
+    def test_watch_read_only_book(self):
+        options = Mock(book_filename='accounts.snapshot')
+        options.get_book.return_value.read_only = True
+        with patch.object(self.command_handler, '_get_watcher') as mock_get_watcher:
+            with patch.object(self.command_handler, '_print_message') as mock_print:
+                self.command_handler._watch(options)
+
+        assert not mock_get_watcher.called
+        mock_print.assert_called_once_with('The accounts file is read only, so it cannot be watched.',
+                                           self.command_handler.MESSAGE_ERROR)
+
+    def test_watch_database(self):
+        options = Mock(book_filename='postgresql://localhost/accounts')
+        options.get_book.return_value.read_only = False
+        with patch.object(self.command_handler, '_get_watcher') as mock_get_watcher:
+            with patch.object(self.command_handler, '_print_message') as mock_print:
+                self.command_handler._watch(options)
+
+        assert not mock_get_watcher.called
+        # The database is not even opened
+        assert not options.get_book.called
+        mock_print.assert_called_once_with('Only accounts files can be watched, not databases.',
+                                           self.command_handler.MESSAGE_ERROR)
+
+    def test_get_watcher(self):
+        options = Mock()
+
+        with patch('gnucashcategorizer.commandhandler.Watcher') as mock_watcher_cls:
+            watcher = self.command_handler._get_watcher(options)
+
+        assert watcher == mock_watcher_cls.return_value
+        mock_watcher_cls.assert_called_once_with(config=options.get_config(), book=options.get_book(),
+                                                 book_filename=options.book_filename,
+                                                 poll_interval=options.poll_interval,
+                                                 memory_limit=options.memory_limit,
+                                                 split_filter=options.get_split_filter(),
+                                                 journal=options.get_journal(),
+                                                 metrics=options.get_metrics())
+
+    def test_serve(self):
+        options = Mock(host='localhost', port=0)
+        with patch('gnucashcategorizer.commandhandler.make_server') as mock_make_server:
+            server = mock_make_server.return_value
+            server.server_address = ('127.0.0.1', 45678)
+            server.serve_forever.side_effect = KeyboardInterrupt
+            with patch.object(self.command_handler, '_print_message') as mock_print:
+                self.command_handler._serve(options)
+
+        mock_make_server.assert_called_once_with(options.get_config.return_value, host='localhost', port=0)
+        server.server_close.assert_called_once_with()
+        mock_print.assert_has_calls([
+            call('Serving on http://127.0.0.1:45678/. Press Ctrl+C to stop.'),
+            call('\nStopped.', self.command_handler.MESSAGE_WARNING),
+        ])
+
+    def assert_command_line_parsed(self, arguments, **expected_options):
+        """Asserts that parsing the supplied command line arguments builds the expected CommandOptions.
+        """
+        options = dict(command=CommandOptions.COMMAND_CATEGORIZE, config_filename=None, book_filename=None,
+                       memory_limit=None, plan_filename=None, poll_interval=None, host=None, port=None,
+                       skip_duplicates=False, review=False, account_names=None, start_date=None, end_date=None,
+                       description_like=None, run_id=None, explain_sample=None,
+                       metrics_filename=None, statement_account_name=None, statement_filename=None,
+                       annotated_filename=None, encoding=None, description_column=None,
+                       snapshot_filename=None, cluster_limit=None)
+        options.update(expected_options)
+        # Spoof passing command line arguments in
+        with patch.object(sys, 'argv', ['gnucash-categorize'] + arguments):
+            with patch('gnucashcategorizer.commandhandler.CommandOptions',
+                       return_value=sentinel.options) as mock_options_cls:
+                # Keep the command constants
+                for name in dir(CommandOptions):
+                    if name.startswith('COMMAND'):
+                        setattr(mock_options_cls, name, getattr(CommandOptions, name))
+                result = self.command_handler._parse_options_from_command_line()
+
+        assert result == sentinel.options
+        mock_options_cls.assert_called_once_with(**options)
 
     def test_parse_options_from_command_line(self):
         CONFIG_FILENAME = 'path/to/config.yaml'
         BOOK_FILENAME = 'path/to/foo_book_filename.gnucash'
-        # Spoof passing command line arguments in
-        sys.argv.extend([CONFIG_FILENAME, BOOK_FILENAME])
+        self.assert_command_line_parsed([CONFIG_FILENAME, BOOK_FILENAME],
+                                        config_filename=CONFIG_FILENAME,
+                                        book_filename=BOOK_FILENAME)
+
+    def test_parse_options_from_command_line_with_categorize_command(self):
+        self.assert_command_line_parsed(['categorize', 'config.yaml', 'accounts.gnucash'],
+                                        config_filename='config.yaml',
+                                        book_filename='accounts.gnucash')
+
+    def test_parse_options_from_command_line_with_memory_limit(self):
+        self.assert_command_line_parsed(['config.yaml', 'accounts.gnucash', '--memory-limit', '200'],
+                                        config_filename='config.yaml',
+                                        book_filename='accounts.gnucash',
+                                        memory_limit=200)
+
+    def test_parse_options_from_command_line_with_skip_duplicates(self):
+        self.assert_command_line_parsed(['config.yaml', 'accounts.gnucash', '--skip-duplicates'],
+                                        config_filename='config.yaml',
+                                        book_filename='accounts.gnucash',
+                                        skip_duplicates=True)
+
+    def test_parse_options_from_command_line_with_filters(self):
+        self.assert_command_line_parsed(['config.yaml', 'accounts.gnucash', '--account', 'Imbalance-GBP',
+                                         '--account', 'Unresolved', '--since', '2017-03-01', '--until', '2017-03-31',
+                                         '--description-like', '%TESCO%'],
+                                        config_filename='config.yaml',
+                                        book_filename='accounts.gnucash',
+                                        account_names=['Imbalance-GBP', 'Unresolved'],
+                                        start_date=date(2017, 3, 1),
+                                        end_date=date(2017, 3, 31),
+                                        description_like='%TESCO%')
+
+    def test_parse_options_from_command_line_with_watch_filters(self):
+        self.assert_command_line_parsed(['watch', 'config.yaml', 'accounts.gnucash', '--since', '2017-03-01'],
+                                        command=CommandOptions.COMMAND_WATCH,
+                                        config_filename='config.yaml',
+                                        book_filename='accounts.gnucash',
+                                        start_date=date(2017, 3, 1))
 
-        with patch('gnucashcategorizer.commandhandler.CommandOptions',
-                   return_value=sentinel.options) as mock_options_cls:
-            options = self.command_handler._parse_options_from_command_line()
+    def test_parse_date(self):
+        assert CommandHandler._parse_date('2017-03-31') == date(2017, 3, 31)
+        try:
+            CommandHandler._parse_date('31/03/2017')
+        except ArgumentTypeError as e:
+            assert str(e) == "'31/03/2017' is not a date in the format YYYY-MM-DD."
+        else:
+            assert False, '_parse_date did not raise ArgumentTypeError.'
+
+    def test_parse_options_from_command_line_with_undo_command(self):
+        self.assert_command_line_parsed(['undo', 'accounts.gnucash', '20170319-142501-3fa2'],
+                                        command=CommandOptions.COMMAND_UNDO,
+                                        book_filename='accounts.gnucash',
+                                        run_id='20170319-142501-3fa2')
+
+    def test_parse_options_from_command_line_with_annotate_command(self):
+        self.assert_command_line_parsed(['annotate', 'config.yaml', 'Imbalance-GBP', 'statement.csv', 'out.csv',
+                                         '--encoding', 'cp1252', '--description-column', 'Narrative'],
+                                        command=CommandOptions.COMMAND_ANNOTATE,
+                                        config_filename='config.yaml',
+                                        statement_account_name='Imbalance-GBP',
+                                        statement_filename='statement.csv',
+                                        annotated_filename='out.csv',
+                                        encoding='cp1252',
+                                        description_column='Narrative')
+
+    def test_parse_options_from_command_line_with_snapshot_command(self):
+        self.assert_command_line_parsed(['snapshot', 'accounts.gnucash', 'accounts.snapshot'],
+                                        command=CommandOptions.COMMAND_SNAPSHOT,
+                                        book_filename='accounts.gnucash',
+                                        snapshot_filename='accounts.snapshot')
+
+    def test_parse_options_from_command_line_with_backtest_command(self):
+        self.assert_command_line_parsed(['backtest', 'config.yaml', 'accounts.gnucash', '--account', 'Imbalance-GBP',
+                                         '--since', '2017-03-01'],
+                                        command=CommandOptions.COMMAND_BACKTEST,
+                                        config_filename='config.yaml',
+                                        book_filename='accounts.gnucash',
+                                        account_names=['Imbalance-GBP'],
+                                        start_date=date(2017, 3, 1))
+
+    def test_parse_options_from_command_line_with_cluster_command(self):
+        self.assert_command_line_parsed(['cluster', 'config.yaml', 'accounts.gnucash', '--top', '10'],
+                                        command=CommandOptions.COMMAND_CLUSTER,
+                                        config_filename='config.yaml',
+                                        book_filename='accounts.gnucash',
+                                        cluster_limit=10)
+
+    def test_parse_options_from_command_line_with_review(self):
+        self.assert_command_line_parsed(['categorize', 'config.yaml', 'accounts.gnucash', '--review'],
+                                        config_filename='config.yaml',
+                                        book_filename='accounts.gnucash',
+                                        review=True)
 
-            assert options == sentinel.options
-            mock_options_cls.assert_called_once_with(config_filename=CONFIG_FILENAME,
-                                                     book_filename=BOOK_FILENAME)
+    def test_parse_options_from_command_line_with_plan_command(self):
+        self.assert_command_line_parsed(['plan', 'config.yaml', 'accounts.gnucash', 'plan.json'],
+                                        command=CommandOptions.COMMAND_PLAN,
+                                        config_filename='config.yaml',
+                                        book_filename='accounts.gnucash',
+                                        plan_filename='plan.json')
+
+    def test_parse_options_from_command_line_with_apply_command(self):
+        self.assert_command_line_parsed(['apply', 'accounts.gnucash', 'plan.json'],
+                                        command=CommandOptions.COMMAND_APPLY,
+                                        book_filename='accounts.gnucash',
+                                        plan_filename='plan.json')
+
+    def test_parse_options_from_command_line_with_watch_command(self):
+        self.assert_command_line_parsed(['watch', 'config.yaml', 'accounts.gnucash', '--interval', '0.5'],
+                                        command=CommandOptions.COMMAND_WATCH,
+                                        config_filename='config.yaml',
+                                        book_filename='accounts.gnucash',
+                                        poll_interval=0.5)
+
+    def test_parse_options_from_command_line_with_serve_command(self):
+        self.assert_command_line_parsed(['serve', 'config.yaml'],
+                                        command=CommandOptions.COMMAND_SERVE,
+                                        config_filename='config.yaml',
+                                        host='127.0.0.1',
+                                        port=8787)
+        self.assert_command_line_parsed(['serve', 'config.yaml', '--host', '0.0.0.0', '--port', '9000'],
+                                        command=CommandOptions.COMMAND_SERVE,
+                                        config_filename='config.yaml',
+                                        host='0.0.0.0',
+                                        port=9000)
 
     def test_get_suggestions_and_splits_without_suggestions(self):
         suggester = Mock()
+        options = Mock(explain_sample=None)
         with patch.object(self.command_handler, '_get_suggester', return_value=suggester) as mock_get_suggester:
-            suggestions, splits = self.command_handler._get_suggestions_and_splits_without_suggestions(sentinel.options)
+            with patch.object(self.command_handler, '_render_explanations') as mock_render_explanations:
+                suggestions, splits = self.command_handler._get_suggestions_and_splits_without_suggestions(options)
 
             assert suggestions == suggester.get_suggestions()
             assert splits == suggester.get_splits_without_suggestions()
-            mock_get_suggester.assert_called_once_with(sentinel.options)
+            mock_get_suggester.assert_called_once_with(options)
+            assert not mock_render_explanations.called
+
+    def test_get_suggestions_and_splits_without_suggestions_with_explanations(self):
+        suggester = Mock()
+        with patch.object(self.command_handler, '_get_suggester', return_value=suggester):
+            with patch.object(self.command_handler, '_render_explanations') as mock_render_explanations:
+                self.command_handler._get_suggestions_and_splits_without_suggestions(Mock(explain_sample=0.5))
+
+        mock_render_explanations.assert_called_once_with(suggester.get_explanations.return_value)
+
+    def test_render_explanations(self):
+        explanations = [
+            (Mock(date=date(2017, 3, 19), description='TESCO', account='Imbalance-GBP'),
+             Explanation(match_pattern=MatchPattern('TESCO', 'Expenses:Groceries', position=3),
+                         evaluations=3, cached=False)),
+            (Mock(date=date(2017, 3, 20), description='TESCO', account='Imbalance-GBP'),
+             Explanation(match_pattern=MatchPattern('TESCO', 'Expenses:Groceries', position=3),
+                         evaluations=0, cached=True)),
+            (Mock(date=date(2017, 3, 21), description='UNKNOWN', account='Imbalance-GBP'),
+             Explanation(match_pattern=None, evaluations=5, cached=False)),
+            (Mock(date=date(2017, 3, 22), description='TESCO', account='Unresolved'),
+             Explanation(match_pattern=MatchPattern('TESCO', 'Expenses:Groceries', position=2, group_name='merchants'),
+                         evaluations=4, cached=False)),
+        ]
+        rule_id = MatchPattern('TESCO', 'Expenses:Groceries').rule_id
+        with patch.object(self.command_handler, '_print_message'):
+            with patch.object(self.command_handler, '_print_horizontal_line'):
+                with patch.object(self.command_handler, '_format_cells') as mock_format_cells:
+                    self.command_handler._render_explanations(explanations)
+
+        mock_format_cells.assert_has_calls([
+            call(['Date', 'Description', 'Account', 'Rule', 'Position', 'Rules tried']),
+            call(['19/03/2017', 'TESCO', 'Imbalance-GBP', rule_id, '3', '3']),
+            call(['20/03/2017', 'TESCO', 'Imbalance-GBP', rule_id, '3', '0 (same as earlier)']),
+            call(['21/03/2017', 'UNKNOWN', 'Imbalance-GBP', '(No match)', '', '5']),
+            call(['22/03/2017', 'TESCO', 'Unresolved', rule_id, '2 in merchants', '4']),
+        ])
+
+    def test_parse_options_from_command_line_with_metrics(self):
+        for command in (CommandOptions.COMMAND_CATEGORIZE, CommandOptions.COMMAND_PLAN, CommandOptions.COMMAND_WATCH):
+            extra_arguments = ['plan.json'] if command == CommandOptions.COMMAND_PLAN else []
+            self.assert_command_line_parsed(
+                [command, 'config.yaml', 'accounts.gnucash'] + extra_arguments + ['--metrics', 'metrics.prom'],
+                command=command,
+                config_filename='config.yaml',
+                book_filename='accounts.gnucash',
+                plan_filename=extra_arguments[0] if extra_arguments else None,
+                metrics_filename='metrics.prom')
+
+    def test_parse_options_from_command_line_with_explain(self):
+        self.assert_command_line_parsed(['config.yaml', 'accounts.gnucash', '--explain'],
+                                        config_filename='config.yaml',
+                                        book_filename='accounts.gnucash',
+                                        explain_sample=1.0)
+        self.assert_command_line_parsed(['plan', 'config.yaml', 'accounts.gnucash', 'plan.json', '--explain', '0.01'],
+                                        command=CommandOptions.COMMAND_PLAN,
+                                        config_filename='config.yaml',
+                                        book_filename='accounts.gnucash',
+                                        plan_filename='plan.json',
+                                        explain_sample=0.01)
 
     def test_get_and_preview_suggestions(self):
         with patch.object(self.command_handler, '_get_suggestions_and_splits_without_suggestions',
@@ -100,13 +869,17 @@ class TestCommandHandler(TestCase):
             Mock(date=date(2017, 3, 19),
                  description='CASH 19 MAR',
                  amount=Money(30, GBP),
+                 opposite_account='Assets:Current Account',
                  old_account='Expenses:Unidentified',
-                 new_account='Expenses:Groceries'),
+                 new_account='Expenses:Groceries',
+                 rule_id='abcd1234'),
             Mock(date=date(2017, 3, 21),
                  description='Monthly Salary',
                  amount=Money(1500, GBP),
+                 opposite_account=None,
                  old_account='Imbalance:GBP',
-                 new_account='Income:Salary'),
+                 new_account='Income:Salary',
+                 rule_id=None),
         ]
         with patch.object(self.command_handler, '_print_message') as mock_print:
             with patch.object(self.command_handler, '_format_cells') as mock_format_cells:
@@ -119,11 +892,12 @@ class TestCommandHandler(TestCase):
                     self.command_handler._render_suggestions(suggestions)
 
         mock_format_cells.assert_has_calls([
-            call(['Date', 'Description', 'Amount', 'Old account', 'New account']),
-            call(['19/03/2017', 'CASH 19 MAR', '£30.00', 'Expenses:Unidentified', 'Expenses:Groceries']),
-            call(['21/03/2017', 'Monthly Salary', '£1,500.00', 'Imbalance:GBP', 'Income:Salary']),
+            call(['Date', 'Description', 'Amount', 'Opposite account', 'Old account', 'New account', 'Rule']),
+            call(['19/03/2017', 'CASH 19 MAR', '£30.00', 'Assets:Current Account', 'Expenses:Unidentified',
+                  'Expenses:Groceries', 'abcd1234']),
+            call(['21/03/2017', 'Monthly Salary', '£1,500.00', '(Multiple)', 'Imbalance:GBP', 'Income:Salary', '']),
         ])
-        mock_print_hr.assert_called_once_with(cell_count=5)
+        mock_print_hr.assert_called_once_with(cell_count=7)
         mock_print.assert_has_calls([
             call('\nSuggestions for uncategorized transactions:\n'),
             call(sentinel.table_headings_string),
@@ -165,6 +939,23 @@ class TestCommandHandler(TestCase):
             call(sentinel.table_data_string_2),
         ])
 
+    def test_render_splits_without_suggestions_in_other_currencies(self):
+        splits = [
+            Mock(date=date(2017, 3, 19), description='A', amount=Money(30, EUR), account='Foo'),
+            Mock(date=date(2017, 3, 19), description='B', amount=Money(-1500, USD), account='Foo'),
+            Mock(date=date(2017, 3, 19), description='C', amount=Money(10, CHF), account='Foo'),
+        ]
+        with patch.object(self.command_handler, '_print_message'):
+            with patch.object(self.command_handler, '_format_cells') as mock_format_cells:
+                with patch.object(self.command_handler, '_print_horizontal_line'):
+                    self.command_handler._render_splits_without_suggestions(splits)
+
+        mock_format_cells.assert_has_calls([
+            call(['19/03/2017', 'A', '€30.00', 'Foo']),
+            call(['19/03/2017', 'B', '-US$1,500.00', 'Foo']),
+            call(['19/03/2017', 'C', '10.00 CHF', 'Foo']),
+        ])
+
     def test_format_cells(self):
         self.command_handler.COLUMN_WIDTH = 8
         result = self.command_handler._format_cells(['Foo', 'Bar', 'FooBar'])
@@ -179,25 +970,141 @@ class TestCommandHandler(TestCase):
 
     def test_save_suggestions(self):
         suggestions = [
-            Mock(),
-            Mock(),
+            Mock(split=Mock(guid='s1'), old_account=Mock(guid='o1'), new_account=Mock(guid='a1'), rule_id='r1'),
+            Mock(split=Mock(guid='s2'), old_account=Mock(guid='o2'), new_account=Mock(guid='a2'), rule_id='r2'),
         ]
+        options = Mock(book_filename='accounts.gnucash')
+        options.get_metrics.return_value = None
+        journal = options.get_journal.return_value
+        journal.save_changes.return_value = 'run1'
         with patch.object(self.command_handler, '_print_message') as mock_print:
-            self.command_handler._save_suggestions(suggestions)
+            self.command_handler._save_suggestions(options, suggestions)
+
+        journal.save_changes.assert_called_once_with(options.get_book.return_value, [
+            PlanEntry('s1', 'o1', 'a1', 'r1'),
+            PlanEntry('s2', 'o2', 'a2', 'r2'),
+        ])
+        mock_print.assert_has_calls([
+            call('Saved.', self.command_handler.MESSAGE_SUCCESS),
+            call('To undo this, run: gnucash-categorize undo accounts.gnucash run1'),
+        ])
+
+    def test_save_suggestions_that_cannot_be_saved(self):
+        options = Mock(book_filename='accounts.gnucash')
+        options.get_metrics.return_value = None
+        for error, message in [
+            (UnexpectedRowCount('Expected to move 1 splits, but 0 could be moved.'),
+             'Expected to move 1 splits, but 0 could be moved. Some of the transactions have been changed since '
+             'they were loaded, so none of the suggestions have been saved.'),
+            (CommodityMismatch('Splits cannot be moved between accounts in different commodities: '
+                               'Imbalance-EUR to Expenses:Groceries.'),
+             'Splits cannot be moved between accounts in different commodities: Imbalance-EUR to '
+             'Expenses:Groceries. None of the suggestions have been saved.'),
+        ]:
+            options.get_journal.return_value.save_changes.side_effect = error
+            with patch.object(self.command_handler, '_print_message') as mock_print:
+                self.command_handler._save_suggestions(options, [])
 
-            suggestions[0].save.assert_called_once_with()
-            suggestions[1].save.assert_called_once_with()
-            mock_print.assert_called_once_with('Saved.',
-                                               self.command_handler.MESSAGE_SUCCESS)
+            assert mock_print.call_args_list == [
+                call(message, self.command_handler.MESSAGE_ERROR),
+                call('Aborted.', self.command_handler.MESSAGE_WARNING),
+            ]
 
     def test_get_suggester(self):
-        options = Mock()
+        options = Mock(skip_duplicates=False)
 
         with patch('gnucashcategorizer.commandhandler.Suggester') as mock_suggester_cls:
             suggester = self.command_handler._get_suggester(options)
 
         assert suggester == mock_suggester_cls.return_value
-        mock_suggester_cls.assert_called_once_with(config=options.get_config(), book=options.get_book())
+        mock_suggester_cls.assert_called_once_with(config=options.get_config(), book=options.get_book(),
+                                                   memory_limit=options.memory_limit, skip_split_guids=None,
+                                                   split_filter=options.get_split_filter(),
+                                                   explain_sample=options.explain_sample,
+                                                   metrics=options.get_metrics())
+
+    def test_get_suggester_skipping_duplicates(self):
+        options = Mock(skip_duplicates=True)
+
+        def get_duplicate_split_guids(options):
+            # The metrics are made first, so that they count the SQL statements run to find the duplicates
+            options.get_metrics.assert_called_once_with()
+            return {'s1'}
+
+        with patch('gnucashcategorizer.commandhandler.Suggester') as mock_suggester_cls:
+            with patch.object(self.command_handler, '_get_duplicate_split_guids',
+                              side_effect=get_duplicate_split_guids) as mock_get_duplicates:
+                self.command_handler._get_suggester(options)
+
+        mock_get_duplicates.assert_called_once_with(options)
+        mock_suggester_cls.assert_called_once_with(config=options.get_config(), book=options.get_book(),
+                                                   memory_limit=options.memory_limit, skip_split_guids={'s1'},
+                                                   split_filter=options.get_split_filter(),
+                                                   explain_sample=options.explain_sample,
+                                                   metrics=options.get_metrics())
+
+    def test_get_duplicate_split_guids(self):
+        options = Mock()
+        options.get_metrics.return_value = MagicMock()
+        book = options.get_book.return_value
+        duplicates = [Mock(split_row=Mock(guid='s1')), Mock(split_row=Mock(guid='s2'))]
+        with patch('gnucashcategorizer.commandhandler.DuplicateDetector') as mock_detector_cls:
+            mock_detector_cls.return_value.get_duplicates.return_value = duplicates
+            with patch.object(self.command_handler, '_render_duplicates') as mock_render:
+                result = self.command_handler._get_duplicate_split_guids(options)
+
+        assert result == {'s1', 's2'}
+        mock_detector_cls.assert_called_once_with(config=options.get_config.return_value, book=book)
+        options.get_metrics.return_value.time_phase.assert_called_once_with('duplicates')
+        mock_render.assert_called_once_with(duplicates, book.get_account_names_by_guid.return_value,
+                                            book.get_currencies_by_account_guid.return_value)
+
+    def test_get_duplicate_split_guids_for_xml_book(self):
+        # Not a unit test, this finds the duplicates in a copy of the sample XML book with a transaction repeated
+        with open(SAMPLE_BOOK_FILENAME) as sample_file:
+            xml = sample_file.read()
+        start = xml.index('<gnc:transaction')
+        transaction = xml[start:xml.index('</gnc:transaction>') + len('</gnc:transaction>')]
+        repeated_transaction = transaction.replace(
+            '10000000000000000000000000000001', '10000000000000000000000000000009').replace(
+            '20000000000000000000000000000001', '20000000000000000000000000000008').replace(
+            '20000000000000000000000000000002', '20000000000000000000000000000009').replace(
+            '2017-03-19 10:59:00', '2017-03-20 10:59:00')
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'accounts.gnucash')
+            with open(filename, 'w') as book_file:
+                book_file.write(xml[:start] + repeated_transaction + '\n' + xml[start:])
+            options = CommandOptions(config_filename=sentinel.config_filename, book_filename=filename)
+            with patch.object(Config, '_load_from_file'):
+                config = Config(sentinel.config_filename)
+            config._config_dict = {'matches': [{'Imbalance-GBP': []}]}
+            with patch.object(options, 'get_config', return_value=config):
+                with patch.object(self.command_handler, '_print_message'):
+                    with patch.object(self.command_handler, '_format_cells') as mock_format_cells:
+                        result = self.command_handler._get_duplicate_split_guids(options)
+
+        assert result == {'20000000000000000000000000000008'}
+        mock_format_cells.assert_any_call(['20/03/2017', 'CARD 1234 TESCO 19/03', '£30.50', 'Imbalance-GBP',
+                                           '19/03/2017 Imbalance-GBP'])
+
+    def test_render_duplicates(self):
+        duplicates = [
+            Mock(split_row=SplitRow(guid='s1', account_guid='a1', date=date(2017, 3, 19),
+                                    value=Fraction(3050, 100), description='CASH 19 MAR'),
+                 original_row=SplitRow(guid='s2', account_guid='a2', date=date(2017, 3, 18),
+                                       value=Fraction(3050, 100), description='CASH 19 MAR')),
+        ]
+        account_names_by_guid = {'a1': 'Imbalance-GBP', 'a2': 'Expenses:Social'}
+        with patch.object(self.command_handler, '_print_message'):
+            with patch.object(self.command_handler, '_format_cells') as mock_format_cells:
+                with patch.object(self.command_handler, '_print_horizontal_line'):
+                    self.command_handler._render_duplicates(duplicates, account_names_by_guid,
+                                                            {'a1': EUR, 'a2': EUR})
+
+        mock_format_cells.assert_has_calls([
+            call(['Date', 'Description', 'Amount', 'Account', 'Duplicate of']),
+            call(['19/03/2017', 'CASH 19 MAR', '€30.50', 'Imbalance-GBP', '18/03/2017 Expenses:Social']),
+        ])
 
     def test_user_accepts_suggestions_returns_true_when_they_enter_yes(self):
         YES = 'y'
@@ -1,7 +1,9 @@
 from unittest import TestCase
-from unittest.mock import sentinel, patch
+from unittest.mock import sentinel, patch, Mock
 import os
 from gnucashcategorizer.config import MatchPattern, Config
+from gnucashcategorizer.normalizer import DescriptionNormalizer
+import yaml
 
 
 class TestMatchPattern(TestCase):
@@ -15,12 +17,28 @@ class TestMatchPattern(TestCase):
     def test_is_match_returns_true_with_wildcard(self):
         assert self.match_pattern.is_match('CASH store FOO')
 
+    def test_literal_prefix(self):
+        assert self.match_pattern.literal_prefix == 'CASH '
+        assert MatchPattern('TESCO', 'foo').literal_prefix == 'TESCO'
+        assert MatchPattern('STORE [0-9]', 'foo').literal_prefix == 'STORE '
+        assert MatchPattern('?AYPAL', 'foo').literal_prefix == ''
+
     def test_is_match_is_case_sensitive(self):
         assert not self.match_pattern.is_match('cash store FOO')
 
     def test_is_match_returns_false_if_not_match(self):
         assert not self.match_pattern.is_match('CASH something')
 
+    def test_is_match_only_matches_whole_description(self):
+        assert not self.match_pattern.is_match('CASH store FOO BAR')
+        assert not self.match_pattern.is_match('THE CASH store FOO')
+
+    def test_is_match_with_character_set(self):
+        match_pattern = MatchPattern(pattern='CARD [0-9]? [!X]*', account_name='foo')
+        assert match_pattern.is_match('CARD 12 TESCO')
+        assert not match_pattern.is_match('CARD 12 XTESCO')
+        assert not match_pattern.is_match('CARD A2 TESCO')
+
     def test_match_patterns_are_equal_if_same_data(self):
         account_name = 'Foo:Bar'
         pattern = 'BAR *'
@@ -28,6 +46,20 @@ class TestMatchPattern(TestCase):
         match_pattern_b = MatchPattern(pattern, account_name)
         assert match_pattern_a == match_pattern_b
 
+    def test_rule_id_is_stable(self):
+        match_pattern_a = MatchPattern(pattern='BAZ *', account_name='Foo:Bar')
+        match_pattern_b = MatchPattern(pattern='BAZ *', account_name='Foo:Bar')
+        assert len(match_pattern_a.rule_id) == 8
+        assert match_pattern_a.rule_id == match_pattern_b.rule_id
+
+    def test_rule_id_differs_for_different_rules(self):
+        rule_ids = {
+            MatchPattern(pattern='BAZ *', account_name='Foo:Bar').rule_id,
+            MatchPattern(pattern='BAZ ?', account_name='Foo:Bar').rule_id,
+            MatchPattern(pattern='BAZ *', account_name='Foo').rule_id,
+        }
+        assert len(rule_ids) == 3
+
     def test_str(self):
         match_pattern = MatchPattern(pattern='BAZ *', account_name='Foo:Bar')
         assert str(match_pattern) == "MatchPattern(pattern='BAZ *', account_name='Foo:Bar')"
@@ -105,6 +137,254 @@ class TestConfig(TestCase):
         ]
         self.assert_get_patterns_for_account_name_returns_patterns('Unlisted account', matches, [])
 
+    def test_get_patterns_for_account_name_normalizes_patterns(self):
+        with patch.object(Config, '_load_from_file'):
+            config = Config(sentinel.filename)
+            config._config_dict = {
+                'normalization': {'casefold': True, 'collapse_whitespace': True},
+                'matches': [
+                    {'Imbalance Account': [
+                        {'Foo:Bar': ['  FOO   BAR *']},
+                    ]},
+                ],
+            }
+
+        assert config.get_patterns_for_account_name('Imbalance Account') == [
+            MatchPattern(pattern='foo bar *', account_name='Foo:Bar'),
+        ]
+
+    def make_config_with_rule_groups(self):
+        with patch.object(Config, '_load_from_file'):
+            config = Config(sentinel.filename)
+        config._config_dict = {
+            'rule_groups': {
+                'merchants': [
+                    {'Expenses:Groceries': ['TESCO', 'SAINSBURYS']},
+                    {'Expenses:Social': ['CASH *']},
+                ],
+            },
+            'matches': [
+                {'Imbalance Account': [
+                    {'Foo:Bar': ['FOOBAZ']},
+                    {'group': 'merchants'},
+                    {'Baz': ['baz baz *']},
+                ]},
+            ],
+        }
+        return config
+
+    def test_get_rules_for_account_name(self):
+        config = self.make_config_with_rule_groups()
+
+        rules = config.get_rules_for_account_name('Imbalance Account')
+
+        assert rules == [MatchPattern('FOOBAZ', 'Foo:Bar'), 'merchants', MatchPattern('baz baz *', 'Baz')]
+        assert [rules[0].position, rules[2].position] == [1, 2]
+        assert config.get_rules_for_account_name('Unlisted account') == []
+
+    def test_get_patterns_for_rule_group(self):
+        config = self.make_config_with_rule_groups()
+
+        patterns = config.get_patterns_for_rule_group('merchants')
+
+        assert patterns == [MatchPattern('TESCO', 'Expenses:Groceries'),
+                            MatchPattern('SAINSBURYS', 'Expenses:Groceries'),
+                            MatchPattern('CASH *', 'Expenses:Social')]
+        assert [pattern.position for pattern in patterns] == [1, 2, 3]
+        assert {pattern.group_name for pattern in patterns} == {'merchants'}
+
+    def test_get_patterns_for_unknown_rule_group(self):
+        config = self.make_config_with_rule_groups()
+
+        try:
+            config.get_patterns_for_rule_group('payees')
+        except ValueError as e:
+            assert str(e) == "There is no rule group 'payees' in the config."
+        else:
+            assert False, 'get_patterns_for_rule_group did not raise ValueError.'
+
+    def test_get_patterns_for_rule_group_referring_to_another_group(self):
+        config = self.make_config_with_rule_groups()
+        config._config_dict['rule_groups']['payees'] = [{'group': 'merchants'}]
+
+        try:
+            config.get_patterns_for_rule_group('payees')
+        except ValueError as e:
+            assert str(e) == "The rule group 'payees' refers to another rule group."
+        else:
+            assert False, 'get_patterns_for_rule_group did not raise ValueError.'
+
+    def test_get_patterns_for_account_name_includes_rule_groups(self):
+        config = self.make_config_with_rule_groups()
+
+        assert [pattern.pattern for pattern in config.get_patterns_for_account_name('Imbalance Account')] == [
+            'FOOBAZ', 'TESCO', 'SAINSBURYS', 'CASH *', 'baz baz *']
+
+    def test_get_normalizer(self):
+        with patch.object(Config, '_load_from_file'):
+            config = Config(sentinel.filename)
+            config._config_dict = {
+                'normalization': {'strip_digits': True, 'casefold': True},
+                'matches': [],
+            }
+
+        normalizer = config.get_normalizer()
+
+        assert isinstance(normalizer, DescriptionNormalizer)
+        assert normalizer.strip_digits
+        assert normalizer.casefold
+        assert not normalizer.strip_references
+        assert not normalizer.collapse_whitespace
+        # The same normalizer is reused, so that its cache is shared
+        assert config.get_normalizer() is normalizer
+
+    def test_get_normalizer_defaults_to_no_normalization(self):
+        with patch.object(Config, '_load_from_file'):
+            config = Config(sentinel.filename)
+            config._config_dict = {'matches': []}
+
+        assert config.get_normalizer().normalize('CARD 1234 TESCO 12/03') == 'CARD 1234 TESCO 12/03'
+
+    def make_config(self, config_dict):
+        """Returns:
+            Config with the config dict, as if read from a file last modified at 100.
+        """
+        with patch.object(Config, '_load_from_file'):
+            config = Config(sentinel.filename)
+        config._filename = sentinel.filename
+        config._last_modified = 100
+        config._config_dict = config_dict
+        return config
+
+    def reload_config(self, old_config_dict, new_config_dict, modified=True):
+        """Reloads a config, as if its file had changed from the old config to the new config.
+
+        Returns:
+            The result of reload_if_changed.
+        """
+        config = self.make_config(old_config_dict)
+
+        with patch('gnucashcategorizer.config.os.stat', return_value=Mock(st_mtime_ns=200 if modified else 100)):
+            with patch.object(config, '_read_file', return_value=new_config_dict) as mock_read:
+                result = config.reload_if_changed()
+
+        if modified:
+            mock_read.assert_called_once_with(sentinel.filename)
+            assert config._config_dict is new_config_dict
+            assert config._last_modified == 200
+        else:
+            assert not mock_read.called
+        return result
+
+    def test_reload_if_changed_returns_changed_account_names(self):
+        old_config_dict = {
+            'matches': [
+                {'Unchanged': [{'Foo': ['FOO']}]},
+                {'Changed': [{'Foo': ['FOO']}]},
+                {'Removed': [{'Foo': ['FOO']}]},
+            ],
+        }
+        new_config_dict = {
+            'matches': [
+                {'Added': [{'Foo': ['FOO']}]},
+                {'Changed': [{'Foo': ['FOO', 'BAR']}]},
+                {'Unchanged': [{'Foo': ['FOO']}]},
+            ],
+        }
+
+        result = self.reload_config(old_config_dict, new_config_dict)
+
+        assert result == {'Added', 'Changed', 'Removed'}
+
+    def test_reload_if_changed_does_nothing_if_file_not_modified(self):
+        config_dict = {'matches': [{'Foo': [{'Bar': ['BAR']}]}]}
+        assert self.reload_config(config_dict, None, modified=False) == set()
+
+    def test_reload_if_changed_with_changed_normalization(self):
+        old_config_dict = {
+            'matches': [{'Foo': [{'Foo': ['FOO']}]}, {'Bar': [{'Bar': ['BAR']}]}],
+        }
+        new_config_dict = {
+            'normalization': {'casefold': True},
+            'matches': [{'Foo': [{'Foo': ['FOO']}]}, {'Bar': [{'Bar': ['BAR']}]}],
+        }
+
+        result = self.reload_config(old_config_dict, new_config_dict)
+
+        # All the patterns are normalized differently
+        assert result == {'Foo', 'Bar'}
+
+    def test_reload_if_changed_with_changed_rule_group(self):
+        old_config_dict = {
+            'rule_groups': {'merchants': [{'Foo': ['FOO']}], 'payees': [{'Bar': ['BAR']}]},
+            'matches': [
+                {'Merchants': [{'group': 'merchants'}]},
+                {'Both': [{'group': 'merchants'}, {'group': 'payees'}]},
+                {'Payees': [{'group': 'payees'}]},
+            ],
+        }
+        new_config_dict = dict(old_config_dict,
+                               rule_groups={'merchants': [{'Foo': ['FOO', 'BAZ']}], 'payees': [{'Bar': ['BAR']}]})
+
+        result = self.reload_config(old_config_dict, new_config_dict)
+
+        assert result == {'Merchants', 'Both'}
+
+    def test_reload_if_changed_keeps_old_config_if_file_is_invalid(self):
+        old_config_dict = {'matches': [{'Foo': [{'Foo': ['FOO']}]}]}
+        config = self.make_config(old_config_dict)
+        apply_changes = Mock()
+
+        for error in [yaml.YAMLError('Bad yaml.'), None]:
+            with patch('gnucashcategorizer.config.os.stat', return_value=Mock(st_mtime_ns=200)):
+                # Invalid yaml, then valid yaml without any matches
+                with patch.object(config, '_read_file', side_effect=error, return_value={'normalization': {}}):
+                    try:
+                        config.reload_if_changed(apply_changes=apply_changes)
+                    except (yaml.YAMLError, KeyError):
+                        assert True
+                    else:
+                        assert False, 'reload_if_changed did not raise an exception.'
+
+            assert config._config_dict is old_config_dict
+            # So the file is read again next time
+            assert config._last_modified == 100
+        assert not apply_changes.called
+
+    def test_reload_if_changed_keeps_old_config_if_changes_cannot_be_applied(self):
+        old_config_dict = {'matches': [{'Foo': [{'Foo': ['FOO']}]}]}
+        new_config_dict = {'normalization': {'casefold': True}, 'matches': [{'Foo': [{'Foo': ['FOO']}]}]}
+        config = self.make_config(old_config_dict)
+        normalizer = config.get_normalizer()
+
+        def apply_changes(account_names):
+            # The new config is in place while the changes are applied
+            assert account_names == {'Foo'}
+            assert config.get_normalizer().normalize('Foo') == 'foo'
+            raise ValueError('Could not apply changes.')
+
+        with patch('gnucashcategorizer.config.os.stat', return_value=Mock(st_mtime_ns=200)):
+            with patch.object(config, '_read_file', return_value=new_config_dict):
+                try:
+                    config.reload_if_changed(apply_changes=apply_changes)
+                except ValueError:
+                    assert True
+                else:
+                    assert False, 'reload_if_changed did not raise ValueError.'
+
+        assert config._config_dict is old_config_dict
+        assert config.get_normalizer() is normalizer
+        assert config._last_modified == 100
+
+    def test_get_duplicate_date_tolerance(self):
+        with patch.object(Config, '_load_from_file'):
+            config = Config(sentinel.filename)
+        config._config_dict = {'duplicates': {'date_tolerance': 5}, 'matches': []}
+        assert config.get_duplicate_date_tolerance() == 5
+
+        config._config_dict = {'matches': []}
+        assert config.get_duplicate_date_tolerance() == Config.DEFAULT_DUPLICATE_DATE_TOLERANCE
+
     def assert_get_only_key_from_dictionary_raises_value_error(self, dictionary):
         try:
             Config._get_only_key_from_dictionary(dictionary)
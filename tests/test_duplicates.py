@@ -0,0 +1,81 @@
+from unittest import TestCase
+from unittest.mock import Mock
+from datetime import date
+from fractions import Fraction
+from gnucashcategorizer.book import SplitRow
+from gnucashcategorizer.duplicates import DuplicateDetector, Duplicate
+from gnucashcategorizer.normalizer import DescriptionNormalizer
+
+
+def make_row(guid, account_guid, day, value, description):
+    return SplitRow(guid=guid, account_guid=account_guid, date=date(2017, 3, day),
+                    value=Fraction(value), description=description)
+
+
+class TestDuplicateDetector(TestCase):
+    def get_duplicates(self, uncategorized_rows, categorized_rows, date_tolerance=2):
+        config = Mock()
+        config.get_duplicate_date_tolerance.return_value = date_tolerance
+        config.get_normalizer.return_value = DescriptionNormalizer(strip_digits=True, collapse_whitespace=True)
+        book = Mock()
+        book.get_accounts.return_value = [Mock(guid='imbalance')]
+
+        def get_split_rows(account_guids=None, exclude_account_guids=None, start_date=None, end_date=None):
+            if account_guids is not None:
+                return iter(uncategorized_rows)
+            self.categorized_date_range = (start_date, end_date)
+            return iter(categorized_rows)
+
+        book.get_split_rows.side_effect = get_split_rows
+        return DuplicateDetector(config=config, book=book).get_duplicates()
+
+    def test_finds_duplicate_of_categorized_split(self):
+        original = make_row('c1', 'groceries', 10, '12.50', 'TESCO 1234')
+        duplicate = make_row('u1', 'imbalance', 11, '12.50', 'TESCO  5678')
+
+        result = self.get_duplicates([duplicate], [original])
+
+        assert result == [Duplicate(duplicate, original)]
+        # Only the categorized splits from around the same dates are loaded
+        assert self.categorized_date_range == (date(2017, 3, 9), date(2017, 3, 13))
+
+    def test_finds_duplicates_among_uncategorized_splits(self):
+        rows = [
+            make_row('u2', 'imbalance', 12, '5', 'CASH'),
+            make_row('u1', 'imbalance', 10, '5', 'CASH'),
+            make_row('u3', 'imbalance', 10, '6', 'CASH'),
+        ]
+
+        result = self.get_duplicates(rows, [])
+
+        # The earliest is the original
+        assert result == [Duplicate(rows[0], rows[1])]
+
+    def test_ignores_splits_outside_date_tolerance(self):
+        rows = [
+            make_row('u1', 'imbalance', 10, '5', 'CASH'),
+            make_row('u2', 'imbalance', 13, '5', 'CASH'),
+        ]
+
+        assert self.get_duplicates(rows, [], date_tolerance=2) == []
+        assert len(self.get_duplicates(rows, [], date_tolerance=3)) == 1
+
+    def test_finds_duplicates_across_bucket_boundaries(self):
+        for day in range(1, 8):
+            rows = [
+                make_row('u1', 'imbalance', day, '5', 'CASH'),
+                make_row('u2', 'imbalance', day + 1, '5', 'CASH'),
+            ]
+            assert len(self.get_duplicates(rows, [], date_tolerance=1)) == 1
+
+    def test_ignores_different_values_and_descriptions(self):
+        rows = [
+            make_row('u1', 'imbalance', 10, '5', 'CASH'),
+            make_row('u2', 'imbalance', 10, '-5', 'CASH'),
+            make_row('u3', 'imbalance', 10, '5', 'CARD'),
+        ]
+
+        assert self.get_duplicates(rows, []) == []
+
+    def test_no_uncategorized_splits(self):
+        assert self.get_duplicates([], []) == []
@@ -0,0 +1,383 @@
+from contextlib import contextmanager
+from unittest import TestCase
+from unittest.mock import patch, sentinel, Mock
+from gnucashcategorizer.config import Config, MatchPattern
+from gnucashcategorizer.matcher import Matcher
+from gnucashcategorizer.book import AccountsNotFound, CommodityMismatch
+from moneyed import EUR, GBP
+
+
+class TestMatcher(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with patch.object(Config, '_load_from_file'):
+            config = Config(sentinel.filename)
+        config._config_dict = {
+            'normalization': {'strip_digits': True, 'collapse_whitespace': True},
+            'matches': [
+                {'Imbalance-GBP': [
+                    {'Expenses:Groceries': ['TESCO', 'STORE ?']},
+                    {'Expenses:Social': ['CASH *']},
+                ]},
+                {'Unresolved': [
+                    {'Income:Salary': ['MYEMPLOYER']},
+                ]},
+            ],
+        }
+        cls.matcher = Matcher(config)
+
+    def test_get_match_returns_first_matching_pattern(self):
+        result = self.matcher.get_match('Imbalance-GBP', 'STORE A')
+        assert result == MatchPattern(pattern='STORE ?', account_name='Expenses:Groceries')
+
+    def test_get_match_normalizes_description(self):
+        result = self.matcher.get_match('Imbalance-GBP', 'TESCO 12/03')
+        assert result == MatchPattern(pattern='TESCO', account_name='Expenses:Groceries')
+
+    def test_get_match_only_uses_patterns_for_account(self):
+        assert self.matcher.get_match('Imbalance-GBP', 'MYEMPLOYER') is None
+        assert self.matcher.get_match('Unresolved', 'MYEMPLOYER') == MatchPattern(pattern='MYEMPLOYER',
+                                                                                  account_name='Income:Salary')
+
+    def test_get_match_returns_none_for_unknown_account(self):
+        assert self.matcher.get_match('Not in config', 'TESCO') is None
+
+    def test_get_uncategorized_account_names(self):
+        assert self.matcher.get_uncategorized_account_names() == ['Imbalance-GBP', 'Unresolved']
+
+    def test_get_patterns(self):
+        assert [pattern.pattern for pattern in self.matcher.get_patterns('Imbalance-GBP')] == [
+            'TESCO', 'STORE ?', 'CASH *']
+        assert self.matcher.get_patterns('Imbalance-EUR') == []
+
+    def test_get_match_caches_matches_per_account(self):
+        pattern = Mock(spec=MatchPattern, account_name='Expenses:Groceries')
+        pattern.is_match.return_value = True
+        config = Mock()
+        config.get_uncategorized_account_names.return_value = ['Imbalance-GBP']
+        config.get_rules_for_account_name.return_value = [pattern]
+        config.get_normalizer.return_value.normalize.side_effect = lambda description: description
+        matcher = Matcher(config)
+
+        assert matcher.get_match('Imbalance-GBP', 'TESCO') == pattern
+        assert matcher.get_match('Imbalance-GBP', 'TESCO') == pattern
+        pattern.is_match.assert_called_once_with('TESCO')
+
+    def test_get_match_ignores_case_and_accents_if_configured(self):
+        with patch.object(Config, '_load_from_file'):
+            config = Config(sentinel.filename)
+        config._config_dict = {
+            'normalization': {'casefold': True, 'strip_accents': True},
+            'matches': [
+                {'Imbalance-GBP': [
+                    {'Expenses:Eating Out': ['CAFÉ *']},
+                ]},
+            ],
+        }
+        matcher = Matcher(config)
+
+        for description in ('CAFÉ NERO', 'Cafe Nero', 'café nero'):
+            assert matcher.get_match('Imbalance-GBP', description) == MatchPattern(pattern='cafe *',
+                                                                                   account_name='Expenses:Eating Out')
+
+    def test_match_cache_is_emptied_when_full(self):
+        matcher = Matcher(self.matcher._config)
+        _, rules_by_account_name = matcher._rule_set
+        rules = rules_by_account_name['Imbalance-GBP']
+        rules.MAX_CACHE_SIZE = 2
+        for description in ('TESCO', 'STORE A', 'CASH AT A'):
+            matcher.get_match('Imbalance-GBP', description)
+
+        assert list(rules._matches_by_description) == ['CASH AT A']
+
+    def test_explain(self):
+        matcher = Matcher(self.matcher._config)
+
+        explanation = matcher.explain('Imbalance-GBP', 'STORE A')
+
+        assert explanation.match_pattern == MatchPattern(pattern='STORE ?', account_name='Expenses:Groceries')
+        assert explanation.position == 2
+        assert explanation.evaluations == 2
+        assert not explanation.cached
+
+    def test_explain_cached_match(self):
+        matcher = Matcher(self.matcher._config)
+        matcher.get_match('Imbalance-GBP', 'CASH AT 1')
+
+        explanation = matcher.explain('Imbalance-GBP', 'CASH AT 2')
+
+        assert explanation.rule_id == MatchPattern(pattern='CASH *', account_name='Expenses:Social').rule_id
+        assert explanation.evaluations == 0
+        assert explanation.cached
+
+    def test_explain_with_rule_timings(self):
+        matcher = Matcher(self.matcher._config)
+        rule_timings = {}
+
+        matcher.explain('Imbalance-GBP', 'STORE A', rule_timings=rule_timings)
+        matcher.explain('Imbalance-GBP', 'TESCO', rule_timings=rule_timings)
+
+        # Only the patterns that were tried are timed
+        assert set(rule_timings) == {MatchPattern('TESCO', 'Expenses:Groceries'),
+                                     MatchPattern('STORE ?', 'Expenses:Groceries')}
+        assert all(seconds >= 0 for seconds in rule_timings.values())
+
+    def test_explain_no_match(self):
+        matcher = Matcher(self.matcher._config)
+
+        explanation = matcher.explain('Imbalance-GBP', 'MYEMPLOYER')
+
+        assert explanation.match_pattern is None
+        assert explanation.rule_id is None
+        assert explanation.position is None
+        assert explanation.evaluations == 3
+
+
+@contextmanager
+def patch_config_file(config, config_dict):
+    """Patches the config's file, as if it had just been changed to the config dict.
+    """
+    config._filename = sentinel.filename
+    config._last_modified = getattr(config, '_last_modified', 0)
+    with patch('gnucashcategorizer.config.os.stat', return_value=Mock(st_mtime_ns=config._last_modified + 1)):
+        with patch.object(config, '_read_file', return_value=config_dict):
+            yield
+
+
+class TestMatcherBinding(TestCase):
+    def setUp(self):
+        with patch.object(Config, '_load_from_file'):
+            self.config = Config(sentinel.filename)
+        self.config._config_dict = {
+            'matches': [
+                {'Imbalance-GBP': [
+                    {'Expenses:Groceries': ['TESCO']},
+                    {'Expenses:Social': ['CASH *']},
+                ]},
+                {'Unresolved': [{'Expenses:Groceries': ['SAINSBURYS']}]},
+            ],
+        }
+        self.accounts_by_name = {name: Mock(currency=GBP) for name in
+                                 ['Imbalance-GBP', 'Unresolved', 'Expenses:Groceries', 'Expenses:Social']}
+        self.book = Mock()
+        self.book.get_accounts_by_name.return_value = self.accounts_by_name
+
+    def test_binds_accounts_in_one_lookup(self):
+        matcher = Matcher(self.config, book=self.book)
+
+        self.book.get_accounts_by_name.assert_called_once_with({
+            'Imbalance-GBP', 'Unresolved', 'Expenses:Groceries', 'Expenses:Social',
+        })
+        assert matcher.get_match('Imbalance-GBP', 'TESCO').account is self.accounts_by_name['Expenses:Groceries']
+        assert matcher.get_match('Unresolved', 'SAINSBURYS').account is self.accounts_by_name['Expenses:Groceries']
+        assert matcher.get_uncategorized_accounts() == [self.accounts_by_name['Imbalance-GBP'],
+                                                        self.accounts_by_name['Unresolved']]
+
+    def test_unknown_accounts_are_reported_up_front(self):
+        self.book.get_accounts_by_name.side_effect = AccountsNotFound(['Expenses:Social'])
+
+        try:
+            Matcher(self.config, book=self.book)
+        except AccountsNotFound as e:
+            assert e.account_names == ['Expenses:Social']
+        else:
+            assert False, 'Matcher did not raise AccountsNotFound.'
+
+    def test_reload_only_binds_changed_accounts(self):
+        matcher = Matcher(self.config, book=self.book)
+        self.book.get_accounts_by_name.reset_mock()
+        new_config_dict = {
+            'matches': [
+                {'Imbalance-GBP': [{'Expenses:Groceries': ['TESCO']}, {'Expenses:Social': ['CASH *']}]},
+                {'Unresolved': [{'Expenses:Social': ['SAINSBURYS']}]},
+            ],
+        }
+
+        with patch_config_file(self.config, new_config_dict):
+            assert matcher.reload() == {'Unresolved'}
+
+        self.book.get_accounts_by_name.assert_called_once_with({'Unresolved', 'Expenses:Social'})
+        assert matcher.get_match('Unresolved', 'SAINSBURYS').account is self.accounts_by_name['Expenses:Social']
+
+    def test_reload_keeps_old_rules_if_new_rules_cannot_be_bound(self):
+        matcher = Matcher(self.config, book=self.book)
+        old_config_dict = self.config._config_dict
+        new_config_dict = {
+            'matches': [
+                {'Imbalance-GBP': [{'Expenses:Groceries': ['TESCO']}, {'Expenses:Social': ['CASH *']}]},
+                {'Unresolved': [{'Expenses:Unknown': ['SAINSBURYS']}]},
+            ],
+        }
+        self.book.get_accounts_by_name.side_effect = AccountsNotFound(['Expenses:Unknown'])
+
+        with patch_config_file(self.config, new_config_dict):
+            with patch('gnucashcategorizer.matcher.logger') as mock_logger:
+                assert matcher.reload() == set()
+
+        assert mock_logger.exception.called
+        assert self.config._config_dict is old_config_dict
+        assert matcher.get_match('Unresolved', 'SAINSBURYS').account is self.accounts_by_name['Expenses:Groceries']
+
+        # Once the accounts are there, the new config is loaded
+        self.book.get_accounts_by_name.side_effect = None
+        self.accounts_by_name['Expenses:Unknown'] = Mock(currency=GBP)
+        with patch_config_file(self.config, new_config_dict):
+            assert matcher.reload() == {'Unresolved'}
+
+        assert self.config._config_dict is new_config_dict
+        assert matcher.get_match('Unresolved', 'SAINSBURYS').account is self.accounts_by_name['Expenses:Unknown']
+
+    def test_patterns_in_other_commodities_are_reported_up_front(self):
+        self.accounts_by_name['Imbalance-GBP'].currency = EUR
+
+        try:
+            Matcher(self.config, book=self.book)
+        except CommodityMismatch as e:
+            assert str(e) == ('Patterns cannot move splits between accounts in different commodities: '
+                              'Imbalance-GBP to Expenses:Groceries, Imbalance-GBP to Expenses:Social.')
+        else:
+            assert False, 'Matcher did not raise CommodityMismatch.'
+
+    def test_patterns_are_not_bound_without_book(self):
+        matcher = Matcher(self.config)
+        assert matcher.get_match('Imbalance-GBP', 'TESCO').account is None
+
+
+class TestMatcherReload(TestCase):
+    def setUp(self):
+        with patch.object(Config, '_load_from_file'):
+            self.config = Config(sentinel.filename)
+        self.config._config_dict = {
+            'matches': [
+                {'Imbalance-GBP': [{'Expenses:Groceries': ['TESCO']}]},
+                {'Unresolved': [{'Income:Salary': ['MYEMPLOYER']}]},
+            ],
+        }
+        self.matcher = Matcher(self.config)
+
+    def reload(self, new_config_dict):
+        with patch_config_file(self.config, new_config_dict):
+            with patch.object(self.config, 'get_rules_for_account_name',
+                              wraps=self.config.get_rules_for_account_name) as mock_get_rules:
+                result = self.matcher.reload()
+        return result, mock_get_rules
+
+    def test_reload_only_recompiles_changed_accounts(self):
+        unresolved_rules = self.matcher._rule_set[1]['Unresolved']
+        self.matcher.get_match('Imbalance-GBP', 'SAINSBURYS')
+
+        result, mock_get_rules = self.reload({
+            'matches': [
+                {'Imbalance-GBP': [{'Expenses:Groceries': ['TESCO', 'SAINSBURYS']}]},
+                {'Unresolved': [{'Income:Salary': ['MYEMPLOYER']}]},
+            ],
+        })
+
+        assert result == {'Imbalance-GBP'}
+        mock_get_rules.assert_called_once_with('Imbalance-GBP')
+        # The cached miss for the changed account was dropped
+        assert self.matcher.get_match('Imbalance-GBP', 'SAINSBURYS') == MatchPattern(
+            pattern='SAINSBURYS', account_name='Expenses:Groceries')
+        # The other account keeps its rules and cache
+        assert self.matcher._rule_set[1]['Unresolved'] is unresolved_rules
+
+    def test_reload_removes_accounts(self):
+        result, _ = self.reload({
+            'matches': [
+                {'Imbalance-GBP': [{'Expenses:Groceries': ['TESCO']}]},
+            ],
+        })
+
+        assert result == {'Unresolved'}
+        assert self.matcher.get_match('Unresolved', 'MYEMPLOYER') is None
+
+    def test_reload_does_nothing_if_unchanged(self):
+        rule_set = self.matcher._rule_set
+
+        with patch.object(self.config, 'reload_if_changed', return_value=set()):
+            assert self.matcher.reload() == set()
+
+        assert self.matcher._rule_set is rule_set
+
+    def test_reload_keeps_unchanged_rule_groups(self):
+        rule_groups = {'merchants': [{'Expenses:Groceries': ['SAINSBURYS']}], 'payroll': [{'Income:Salary': ['ACME']}]}
+        self.reload({
+            'rule_groups': rule_groups,
+            'matches': [
+                {'Imbalance-GBP': [{'group': 'merchants'}]},
+                {'Unresolved': [{'group': 'merchants'}, {'group': 'payroll'}]},
+            ],
+        })
+        merchants = self.matcher._rule_groups_by_name['merchants']
+        self.matcher.get_match('Imbalance-GBP', 'SAINSBURYS')
+
+        result, _ = self.reload({
+            'rule_groups': dict(rule_groups, payroll=[{'Income:Salary': ['ACME', 'ACME LTD']}]),
+            'matches': [
+                {'Imbalance-GBP': [{'group': 'merchants'}]},
+                {'Unresolved': [{'group': 'merchants'}, {'group': 'payroll'}]},
+            ],
+        })
+
+        assert result == {'Unresolved'}
+        # The unchanged group is still shared, and keeps its cache
+        assert self.matcher._rule_groups_by_name['merchants'] is merchants
+        assert self.matcher._rule_set[1]['Unresolved'].rule_groups[0] is merchants
+        assert list(merchants._matches_by_description) == ['SAINSBURYS']
+        assert self.matcher.get_match('Unresolved', 'ACME LTD') == MatchPattern('ACME LTD', 'Income:Salary')
+
+
+class TestMatcherRuleGroups(TestCase):
+    def setUp(self):
+        with patch.object(Config, '_load_from_file'):
+            self.config = Config(sentinel.filename)
+        self.config._config_dict = {
+            'rule_groups': {
+                'merchants': [
+                    {'Expenses:Groceries': ['TESCO', 'SAINSBURYS']},
+                    {'Expenses:Social': ['CASH *']},
+                ],
+            },
+            'matches': [
+                {'Imbalance-GBP': [
+                    {'Expenses:Household': ['TESCO']},
+                    {'group': 'merchants'},
+                ]},
+                {'Unresolved': [
+                    {'group': 'merchants'},
+                    {'Income:Salary': ['MYEMPLOYER']},
+                ]},
+            ],
+        }
+        self.matcher = Matcher(self.config)
+
+    def test_get_match(self):
+        # The account's own patterns take precedence in config order
+        assert self.matcher.get_match('Imbalance-GBP', 'TESCO') == MatchPattern('TESCO', 'Expenses:Household')
+        assert self.matcher.get_match('Unresolved', 'TESCO') == MatchPattern('TESCO', 'Expenses:Groceries')
+        assert self.matcher.get_match('Imbalance-GBP', 'CASH AT 1') == MatchPattern('CASH *', 'Expenses:Social')
+        assert self.matcher.get_match('Unresolved', 'MYEMPLOYER') == MatchPattern('MYEMPLOYER', 'Income:Salary')
+        assert self.matcher.get_match('Imbalance-GBP', 'MYEMPLOYER') is None
+
+    def test_rule_group_is_shared(self):
+        imbalance_rules = self.matcher._rule_set[1]['Imbalance-GBP']
+        unresolved_rules = self.matcher._rule_set[1]['Unresolved']
+
+        assert imbalance_rules.rule_groups == unresolved_rules.rule_groups
+        assert imbalance_rules.rule_groups[0] is unresolved_rules.rule_groups[0]
+        assert imbalance_rules.patterns[1] is unresolved_rules.patterns[0]
+
+    def test_rule_group_is_only_evaluated_once_per_description(self):
+        first = self.matcher.explain('Imbalance-GBP', 'CASH AT 1')
+        second = self.matcher.explain('Unresolved', 'CASH AT 1')
+
+        assert first.evaluations == 4
+        assert (first.position, first.group_name) == (3, 'merchants')
+        # The group's match was cached by the other account
+        assert second.match_pattern is first.match_pattern
+        assert second.evaluations == 0
+        assert not second.cached
+
+    def test_get_patterns(self):
+        assert [(pattern.pattern, pattern.group_name) for pattern in self.matcher.get_patterns('Unresolved')] == [
+            ('TESCO', 'merchants'), ('SAINSBURYS', 'merchants'), ('CASH *', 'merchants'), ('MYEMPLOYER', None)]
@@ -0,0 +1,111 @@
+from unittest import TestCase
+import json
+import os
+import shutil
+import tempfile
+from gnucashcategorizer.config import MatchPattern
+from gnucashcategorizer.matcher import Explanation
+from gnucashcategorizer.metrics import RunMetrics, time_phase
+
+
+class TestRunMetrics(TestCase):
+    def setUp(self):
+        self.tesco = MatchPattern('TESCO', 'Expenses:Groceries')
+        self.cash = MatchPattern('CASH *', 'Expenses:Social')
+        self.metrics = RunMetrics()
+        self.metrics.splits_loaded = 4
+        self.metrics.record_match('Imbalance-GBP', Explanation(self.tesco, evaluations=1, cached=False))
+        self.metrics.record_match('Imbalance-GBP', Explanation(self.tesco, evaluations=0, cached=True))
+        self.metrics.record_match('Imbalance-GBP', Explanation(None, evaluations=7, cached=False))
+        self.metrics.record_match('Unresolved', Explanation(self.cash, evaluations=2, cached=False))
+        self.metrics.count_statement()
+        self.metrics.rule_timings.update({self.tesco: 0.5, self.cash: 1.5})
+
+    def test_as_dict(self):
+        result = self.metrics.as_dict()
+
+        assert result['splits_loaded'] == 4
+        assert result['accounts'] == {
+            'Imbalance-GBP': {'splits': 3, 'matched': 2, 'match_rate': 2 / 3},
+            'Unresolved': {'splits': 1, 'matched': 1, 'match_rate': 1.0},
+        }
+        assert result['sql_statements'] == 1
+        assert result['slowest_rules'] == [
+            {'rule_id': self.cash.rule_id, 'pattern': 'CASH *', 'account': 'Expenses:Social', 'seconds': 1.5},
+            {'rule_id': self.tesco.rule_id, 'pattern': 'TESCO', 'account': 'Expenses:Groceries', 'seconds': 0.5},
+        ]
+
+    def test_patterns_evaluated_histogram_is_cumulative(self):
+        histogram = self.metrics.as_dict()['patterns_evaluated']
+
+        assert histogram['buckets']['0'] == 1
+        assert histogram['buckets']['1'] == 2
+        assert histogram['buckets']['2'] == 3
+        assert histogram['buckets']['5'] == 3
+        assert histogram['buckets']['10'] == 4
+        assert histogram['buckets']['+Inf'] == 4
+        assert histogram['sum'] == 10
+        assert histogram['count'] == 4
+
+    def test_only_slowest_rules_are_included(self):
+        metrics = RunMetrics()
+        metrics.SLOWEST_RULE_COUNT = 1
+        metrics.rule_timings.update({self.tesco: 0.5, self.cash: 1.5})
+
+        assert [rule['pattern'] for rule in metrics.as_dict()['slowest_rules']] == ['CASH *']
+
+    def test_time_phase_adds_up(self):
+        with self.metrics.time_phase('save'):
+            pass
+        with time_phase(self.metrics, 'save'):
+            pass
+
+        assert list(self.metrics.as_dict()['phase_seconds']) == ['save']
+        assert self.metrics.as_dict()['phase_seconds']['save'] >= 0
+
+    def test_time_phase_without_metrics(self):
+        with time_phase(None, 'save'):
+            pass
+
+    def test_time_iteration(self):
+        assert list(self.metrics.time_iteration('load', iter([1, 2, 3]))) == [1, 2, 3]
+        assert 'load' in self.metrics.as_dict()['phase_seconds']
+
+    def test_as_prometheus_text(self):
+        lines = self.metrics.as_prometheus_text().splitlines()
+
+        assert '# TYPE gnucash_categorizer_splits_loaded gauge' in lines
+        assert 'gnucash_categorizer_splits_loaded 4' in lines
+        assert 'gnucash_categorizer_account_matched_splits{account="Imbalance-GBP"} 2' in lines
+        assert '# TYPE gnucash_categorizer_patterns_evaluated histogram' in lines
+        assert 'gnucash_categorizer_patterns_evaluated_bucket{le="1"} 2' in lines
+        assert 'gnucash_categorizer_patterns_evaluated_bucket{le="+Inf"} 4' in lines
+        assert 'gnucash_categorizer_patterns_evaluated_sum 10' in lines
+        assert 'gnucash_categorizer_patterns_evaluated_count 4' in lines
+        assert 'gnucash_categorizer_sql_statements 1' in lines
+        assert 'gnucash_categorizer_rule_seconds{{rule_id="{}",account="Expenses:Social"}} 1.5'.format(
+            self.cash.rule_id) in lines
+
+    def test_prometheus_label_values_are_escaped(self):
+        metrics = RunMetrics()
+        metrics.record_match('Say "hi"\\', Explanation(None, evaluations=0, cached=False))
+
+        assert 'gnucash_categorizer_account_splits{account="Say \\"hi\\"\\\\"} 1' in (
+            metrics.as_prometheus_text().splitlines())
+
+    def test_write(self):
+        directory = tempfile.mkdtemp()
+        try:
+            json_filename = os.path.join(directory, 'metrics.json')
+            prometheus_filename = os.path.join(directory, 'metrics.prom')
+
+            self.metrics.write(json_filename)
+            self.metrics.write(prometheus_filename)
+
+            with open(json_filename) as json_file:
+                assert json.load(json_file)['splits_loaded'] == 4
+            with open(prometheus_filename) as prometheus_file:
+                assert prometheus_file.read() == self.metrics.as_prometheus_text()
+            assert sorted(os.listdir(directory)) == ['metrics.json', 'metrics.prom']
+        finally:
+            shutil.rmtree(directory)
@@ -0,0 +1,73 @@
+from unittest import TestCase
+from unittest.mock import patch
+from gnucashcategorizer.normalizer import DescriptionNormalizer
+
+
+class TestDescriptionNormalizer(TestCase):
+    def test_normalize_does_nothing_by_default(self):
+        normalizer = DescriptionNormalizer()
+        assert normalizer.normalize('CARD 1234  TESCO 12/03') == 'CARD 1234  TESCO 12/03'
+
+    def test_normalize_strips_references(self):
+        normalizer = DescriptionNormalizer(strip_references=True)
+        assert normalizer.normalize('CARD 1234 TESCO REF: AB12CD') == '  TESCO  '
+
+    def test_normalize_strips_custom_references(self):
+        normalizer = DescriptionNormalizer(strip_references=True, reference_patterns=[r'#\w+'])
+        assert normalizer.normalize('TESCO #AB12 REF 99') == 'TESCO   REF 99'
+
+    def test_normalize_strips_digits(self):
+        normalizer = DescriptionNormalizer(strip_digits=True)
+        assert normalizer.normalize('TESCO 12/03 10:15 STORE') == 'TESCO     STORE'
+
+    def test_normalize_collapses_whitespace(self):
+        normalizer = DescriptionNormalizer(collapse_whitespace=True)
+        assert normalizer.normalize('  TESCO \t  STORE ') == 'TESCO STORE'
+
+    def test_normalize_casefolds(self):
+        normalizer = DescriptionNormalizer(casefold=True)
+        assert normalizer.normalize('Tesco STRASSE') == 'tesco strasse'
+
+    def test_normalize_strips_accents(self):
+        normalizer = DescriptionNormalizer(strip_accents=True)
+        assert normalizer.normalize('CAFÉ NAÏVE ﬁne') == 'CAFE NAIVE fine'
+
+    def test_normalize_casefolds_and_strips_accents(self):
+        normalizer = DescriptionNormalizer(casefold=True, strip_accents=True)
+        assert normalizer.normalize('Café') == normalizer.normalize('CAFE') == 'cafe'
+        assert normalizer.normalize('STRAẞE') == 'strasse'
+
+    def test_normalize_casefolds_compatibility_characters(self):
+        normalizer = DescriptionNormalizer(casefold=True, strip_accents=True)
+        assert normalizer.normalize('№ 5 ACME™') == normalizer.normalize('no 5 acmetm') == 'no 5 acmetm'
+
+    def test_normalize_all(self):
+        normalizer = DescriptionNormalizer(strip_references=True, strip_digits=True,
+                                           collapse_whitespace=True, casefold=True)
+        assert normalizer.normalize('CARD 1234 TESCO 12/03') == 'tesco'
+
+    def test_normalize_caches_each_description(self):
+        normalizer = DescriptionNormalizer(casefold=True)
+        with patch.object(normalizer, '_normalize', wraps=normalizer._normalize) as mock_normalize:
+            assert normalizer.normalize('TESCO') == 'tesco'
+            assert normalizer.normalize('TESCO') == 'tesco'
+            assert normalizer.normalize('ASDA') == 'asda'
+
+        assert mock_normalize.call_count == 2
+
+    def test_normalize_empties_full_cache(self):
+        normalizer = DescriptionNormalizer(casefold=True)
+        normalizer.MAX_CACHE_SIZE = 2
+        for description in ('TESCO', 'ASDA', 'LIDL'):
+            normalizer.normalize(description)
+
+        assert normalizer._cache == {'LIDL': 'lidl'}
+
+    def test_normalize_pattern(self):
+        normalizer = DescriptionNormalizer(strip_references=True, strip_digits=True,
+                                           collapse_whitespace=True, casefold=True)
+        assert normalizer.normalize_pattern(' TESCO  STORE 1? * ') == 'tesco store 1? *'
+
+    def test_normalize_pattern_strips_accents(self):
+        normalizer = DescriptionNormalizer(casefold=True, strip_accents=True)
+        assert normalizer.normalize_pattern('CAFÉ [NÉ]* ?') == 'cafe [ne]* ?'
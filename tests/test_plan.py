@@ -0,0 +1,76 @@
+from unittest import TestCase
+from unittest.mock import Mock
+import json
+import os
+import tempfile
+from gnucashcategorizer.plan import Plan, PlanEntry, BookChanged
+
+
+class TestPlanEntry(TestCase):
+    def test_entries_are_equal_if_same_data(self):
+        entry_a = PlanEntry('split', 'old', 'new', 'abcd1234')
+        entry_b = PlanEntry('split', 'old', 'new', 'abcd1234')
+        assert entry_a == entry_b
+
+    def test_as_list(self):
+        entry = PlanEntry(split_guid='split', old_account_guid='old', new_account_guid='new', rule_id='abcd1234')
+        assert entry.as_list() == ['split', 'old', 'new', 'abcd1234']
+
+
+class TestPlan(TestCase):
+    def setUp(self):
+        self.plan = Plan(book_fingerprint='f1ng3rpr1nt',
+                         account_guids=['imbalance'],
+                         entries=[
+                             PlanEntry('split1', 'imbalance', 'groceries', 'abcd1234'),
+                             PlanEntry('split2', 'imbalance', 'salary', 'bcde2345'),
+                         ])
+        handle, self.filename = tempfile.mkstemp(suffix='.json')
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def test_from_suggestions(self):
+        suggestions = [
+            Mock(split=Mock(guid='split1'), old_account=Mock(guid='imbalance'),
+                 new_account=Mock(guid='groceries'), rule_id='abcd1234'),
+            Mock(split=Mock(guid='split2'), old_account=Mock(guid='imbalance'),
+                 new_account=Mock(guid='salary'), rule_id='bcde2345'),
+        ]
+
+        plan = Plan.from_suggestions(suggestions, book_fingerprint='f1ng3rpr1nt', account_guids=['imbalance'])
+
+        assert plan.book_fingerprint == 'f1ng3rpr1nt'
+        assert plan.account_guids == ['imbalance']
+        assert plan.entries == self.plan.entries
+
+    def test_write_and_read(self):
+        self.plan.write(self.filename)
+        plan = Plan.read(self.filename)
+
+        assert plan.book_fingerprint == self.plan.book_fingerprint
+        assert plan.account_guids == self.plan.account_guids
+        assert plan.entries == self.plan.entries
+
+    def test_read_rejects_unknown_version(self):
+        with open(self.filename, 'w') as plan_file:
+            json.dump({'version': 99}, plan_file)
+
+        try:
+            Plan.read(self.filename)
+        except ValueError as e:
+            assert str(e) == '{} is not a version 1 plan file.'.format(self.filename)
+        else:
+            assert False, 'read did not raise ValueError.'
+
+    def test_check_fingerprint_passes_if_unchanged(self):
+        self.plan.check_fingerprint('f1ng3rpr1nt')
+
+    def test_check_fingerprint_raises_book_changed(self):
+        try:
+            self.plan.check_fingerprint('d1ff3r3nt')
+        except BookChanged:
+            assert True
+        else:
+            assert False, 'check_fingerprint did not raise BookChanged.'
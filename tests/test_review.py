@@ -0,0 +1,91 @@
+from unittest import TestCase
+from unittest.mock import Mock
+from datetime import date
+from gnucashcategorizer.review import ReviewList
+
+
+def make_suggestion(description, new_account='Expenses:Groceries', rule_id='aaaa1111'):
+    return Mock(date=date(2017, 3, 1), description=description, old_account='Imbalance-GBP',
+                new_account=new_account, rule_id=rule_id)
+
+
+class TestReviewList(TestCase):
+    def setUp(self):
+        self.suggestions = [
+            make_suggestion('TESCO 1'),
+            make_suggestion('CASH 1', new_account='Expenses:Social', rule_id='bbbb2222'),
+            make_suggestion('TESCO 2'),
+            make_suggestion('CASH 2', new_account='Expenses:Social', rule_id='bbbb2222'),
+        ]
+        self.review_list = ReviewList(self.suggestions)
+
+    def get_shown_suggestions(self, height=10):
+        return [suggestion for suggestion, _, _ in self.review_list.get_rows(height)]
+
+    def test_all_accepted_to_start_with(self):
+        assert self.review_list.get_accepted_suggestions() == self.suggestions
+        assert self.review_list.accepted_count == 4
+
+    def test_toggle(self):
+        self.review_list.move(1)
+        self.review_list.toggle()
+
+        assert self.review_list.get_accepted_suggestions() == [self.suggestions[0]] + self.suggestions[2:]
+
+        self.review_list.toggle()
+        assert self.review_list.get_accepted_suggestions() == self.suggestions
+
+    def test_get_rows_only_returns_rows_that_fit(self):
+        rows = self.review_list.get_rows(height=2)
+
+        assert rows == [(self.suggestions[0], True, True), (self.suggestions[1], True, False)]
+
+    def test_get_rows_scrolls_to_cursor(self):
+        self.review_list.move(3)
+        assert self.get_shown_suggestions(height=2) == self.suggestions[2:]
+
+        self.review_list.move(-2)
+        assert self.get_shown_suggestions(height=2) == self.suggestions[1:3]
+
+    def test_move_stops_at_ends(self):
+        self.review_list.move(-5)
+        assert self.review_list.cursor == 0
+        self.review_list.move(50)
+        assert self.review_list.cursor == 3
+
+    def test_filter(self):
+        self.review_list.set_filter('cash')
+
+        assert self.get_shown_suggestions() == [self.suggestions[1], self.suggestions[3]]
+        assert self.review_list.visible_count == 2
+
+        self.review_list.set_filter('')
+        assert self.get_shown_suggestions() == self.suggestions
+
+    def test_filter_by_account(self):
+        self.review_list.set_filter('social')
+        assert self.get_shown_suggestions() == [self.suggestions[1], self.suggestions[3]]
+
+    def test_set_visible_accepted(self):
+        self.review_list.set_filter('tesco')
+        self.review_list.set_visible_accepted(False)
+
+        assert self.review_list.get_accepted_suggestions() == [self.suggestions[1], self.suggestions[3]]
+
+        self.review_list.set_visible_accepted(True)
+        assert self.review_list.get_accepted_suggestions() == self.suggestions
+
+    def test_set_rule_accepted_includes_filtered_out_suggestions(self):
+        self.review_list.set_filter('CASH 2')
+        self.review_list.set_rule_accepted(False)
+
+        assert self.review_list.get_accepted_suggestions() == [self.suggestions[0], self.suggestions[2]]
+
+    def test_nothing_shown(self):
+        self.review_list.set_filter('nothing matches this')
+
+        assert self.review_list.get_rows(height=10) == []
+        # Nothing happens with no row under the cursor
+        self.review_list.toggle()
+        self.review_list.set_rule_accepted(False)
+        assert self.review_list.accepted_count == 4
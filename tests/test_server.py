@@ -0,0 +1,141 @@
+from unittest import TestCase
+from unittest.mock import Mock, patch
+import json
+import threading
+from http.client import HTTPConnection
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+from gnucashcategorizer.config import MatchPattern
+from gnucashcategorizer.server import Classifier, InvalidRequest, LatencyStats, make_server
+
+
+def get_match(account_name, description):
+    if account_name == 'Imbalance-GBP' and description == 'TESCO':
+        return MatchPattern(pattern='TESCO', account_name='Expenses:Groceries')
+    return None
+
+
+class TestClassifier(TestCase):
+    def setUp(self):
+        with patch('gnucashcategorizer.server.Matcher') as mock_matcher_cls:
+            mock_matcher_cls.return_value.get_match.side_effect = get_match
+            self.classifier = Classifier(config=Mock())
+
+    def test_classify(self):
+        result = self.classifier.classify([
+            {'account': 'Imbalance-GBP', 'description': 'TESCO', 'amount': '12.50'},
+            {'account': 'Imbalance-GBP', 'description': 'SOMETHING ELSE'},
+        ])
+
+        assert result == [
+            {'account': 'Expenses:Groceries',
+             'rule_id': MatchPattern(pattern='TESCO', account_name='Expenses:Groceries').rule_id},
+            {'account': None, 'rule_id': None},
+        ]
+
+    def test_classify_raises_invalid_request(self):
+        for records in [None, [{'account': 'Imbalance-GBP'}], ['TESCO']]:
+            try:
+                self.classifier.classify(records)
+            except InvalidRequest:
+                assert True
+            else:
+                assert False, 'classify did not raise InvalidRequest for {}.'.format(records)
+
+    def test_classify_raises_invalid_request_for_non_strings(self):
+        for account_name, description in [('Imbalance-GBP', None), (None, 'TESCO'), ('Imbalance-GBP', 12.5),
+                                          (1, 'TESCO'), ('Imbalance-GBP', ['TESCO']), ({}, 'TESCO')]:
+            try:
+                self.classifier.classify([{'account': 'Imbalance-GBP', 'description': 'TESCO'},
+                                          {'account': account_name, 'description': description}])
+            except InvalidRequest as e:
+                assert str(e) == 'The account and description of record 1 must be strings.'
+            else:
+                assert False, 'classify did not raise InvalidRequest for {!r}, {!r}.'.format(account_name,
+                                                                                             description)
+
+
+class TestLatencyStats(TestCase):
+    def test_as_dict(self):
+        stats = LatencyStats()
+        assert stats.as_dict() == {'requests': 0, 'mean_latency_ms': 0.0, 'max_latency_ms': 0.0}
+
+        stats.record(0.002)
+        stats.record(0.004)
+
+        result = stats.as_dict()
+        assert result['requests'] == 2
+        assert round(result['mean_latency_ms'], 6) == 3
+        assert round(result['max_latency_ms'], 6) == 4
+
+
+class TestServer(TestCase):
+    # Not unit tests, these make requests to a running server
+    def setUp(self):
+        with patch('gnucashcategorizer.server.Matcher') as mock_matcher_cls:
+            mock_matcher_cls.return_value.get_match.side_effect = get_match
+            self.server = make_server(config=Mock(), host='127.0.0.1', port=0)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def post(self, path, body):
+        request = Request(self.url + path, data=body, headers={'Content-Type': 'application/json'})
+        with urlopen(request) as response:
+            return json.loads(response.read().decode('utf-8'))
+
+    def test_classify(self):
+        body = json.dumps({'records': [{'account': 'Imbalance-GBP', 'description': 'TESCO'}]}).encode('utf-8')
+
+        result = self.post('/classify', body)
+
+        assert result['results'] == [
+            {'account': 'Expenses:Groceries',
+             'rule_id': MatchPattern(pattern='TESCO', account_name='Expenses:Groceries').rule_id},
+        ]
+        assert result['latency_ms'] >= 0
+        with urlopen(self.url + '/stats') as response:
+            assert json.loads(response.read().decode('utf-8'))['requests'] == 1
+
+    def test_bad_request(self):
+        try:
+            self.post('/classify', b'not json')
+        except HTTPError as e:
+            assert e.code == 400
+            assert json.loads(e.read().decode('utf-8')) == {'error': 'The request body must be JSON.'}
+        else:
+            assert False, 'The server did not reject the request.'
+
+    def test_bad_content_length(self):
+        for content_length in ['abc', '-1']:
+            connection = HTTPConnection('127.0.0.1', self.server.server_address[1])
+            connection.putrequest('POST', '/classify')
+            connection.putheader('Content-Length', content_length)
+            connection.endheaders(b'{}')
+            response = connection.getresponse()
+
+            assert response.status == 400
+            assert json.loads(response.read().decode('utf-8')) == {
+                'error': 'The Content-Length header must be a number of bytes.'}
+            connection.close()
+
+    def test_concurrent_requests(self):
+        body = json.dumps({'records': [{'account': 'Imbalance-GBP', 'description': 'TESCO'}] * 50}).encode('utf-8')
+        results = []
+
+        def make_request():
+            results.append(self.post('/classify', body))
+
+        clients = [threading.Thread(target=make_request) for _ in range(8)]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+
+        assert len(results) == 8
+        assert all(len(result['results']) == 50 for result in results)
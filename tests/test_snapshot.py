@@ -0,0 +1,189 @@
+from unittest import TestCase
+from unittest.mock import Mock
+from datetime import date
+from decimal import Decimal
+from fractions import Fraction
+import os
+import tempfile
+from moneyed import Money, GBP, EUR
+from gnucashcategorizer.book import (AccountsNotFound, SplitFilter, fingerprint_rows, OppositeAccountNotDetermined,
+                                     SnapshotRow, SplitRow)
+from gnucashcategorizer.snapshot import SnapshotBook
+
+
+IMBALANCE = 'a' * 32
+CURRENT = 'b' * 32
+GROCERIES = 'c' * 32
+HOLIDAYS = 'd' * 32
+
+
+def make_row(transaction_guid, guid, account_guid, day, value_num, description, quantity_num=None):
+    return SnapshotRow(transaction_guid=transaction_guid, guid=guid, account_guid=account_guid,
+                       date=date(2017, 3, day), value_num=value_num, value_denom=100,
+                       quantity_num=value_num if quantity_num is None else quantity_num, quantity_denom=100,
+                       description=description)
+
+
+class TestSnapshotBook(TestCase):
+    # Not unit tests, these write a snapshot of a mock book and read it back
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, 'accounts.snapshot')
+        book = Mock()
+        book.get_account_names_by_guid.return_value = {
+            IMBALANCE: 'Imbalance-GBP',
+            CURRENT: 'Assets:Current Account',
+            GROCERIES: 'Expenses:Groceries',
+            HOLIDAYS: 'Expenses:Holidays',
+        }
+        book.get_currencies_by_account_guid.return_value = {
+            IMBALANCE: GBP, CURRENT: GBP, GROCERIES: GBP, HOLIDAYS: EUR,
+        }
+        book.get_snapshot_rows.return_value = [
+            make_row('1' * 32, '11' * 16, IMBALANCE, 19, 1050, 'TESCO'),
+            make_row('1' * 32, '12' * 16, CURRENT, 19, -1050, 'TESCO'),
+            make_row('2' * 32, '21' * 16, IMBALANCE, 20, 3000, 'CAFÉ'),
+            make_row('2' * 32, '22' * 16, CURRENT, 20, -1500, 'CAFÉ'),
+            make_row('2' * 32, '23' * 16, GROCERIES, 20, -1500, 'CAFÉ'),
+            make_row('3' * 32, '31' * 16, HOLIDAYS, 21, 2400, 'TESCO', quantity_num=2800),
+            make_row('3' * 32, '32' * 16, IMBALANCE, 21, -2400, 'TESCO'),
+            # A template split of a scheduled transaction, in an account that isn't in the book
+            make_row('4' * 32, '41' * 16, 'e' * 32, 22, 100, None),
+        ]
+        self.split_count = SnapshotBook.write(book, self.filename)
+        self.book = SnapshotBook(self.filename)
+
+    def tearDown(self):
+        del self.book
+        self.directory.cleanup()
+
+    def test_write(self):
+        assert self.split_count == 7
+        # No temporary file is left behind
+        assert os.listdir(self.directory.name) == ['accounts.snapshot']
+
+    def test_is_snapshot_file(self):
+        assert SnapshotBook.is_snapshot_file(self.filename)
+
+    def test_is_snapshot_file_false_for_other_files(self):
+        with tempfile.NamedTemporaryFile(suffix='.gnucash') as sqlite_file:
+            sqlite_file.write(b'SQLite format 3\x00')
+            sqlite_file.flush()
+            assert not SnapshotBook.is_snapshot_file(sqlite_file.name)
+
+    def test_get_account(self):
+        account = self.book.get_account('Expenses:Holidays')
+        assert account.guid == HOLIDAYS
+        assert account.currency == EUR
+        assert str(account) == 'Expenses:Holidays'
+
+    def test_get_account_raises_accounts_not_found(self):
+        try:
+            self.book.get_account('Expenses:Travel')
+        except AccountsNotFound as e:
+            assert e.account_names == ['Expenses:Travel']
+        else:
+            assert False, 'get_account did not raise AccountsNotFound.'
+
+    def test_get_accounts_raises_accounts_not_found(self):
+        try:
+            self.book.get_accounts(['Imbalance-GBP', 'Expenses:Travel'])
+        except AccountsNotFound as e:
+            assert e.account_names == ['Expenses:Travel']
+        else:
+            assert False, 'get_accounts did not raise AccountsNotFound.'
+
+    def test_get_accounts_by_name_reports_all_missing_accounts(self):
+        try:
+            self.book.get_accounts_by_name(['Imbalance-GBP', 'Expenses:Travel', 'Income'])
+        except AccountsNotFound as e:
+            assert e.account_names == ['Expenses:Travel', 'Income']
+        else:
+            assert False, 'get_accounts_by_name did not raise AccountsNotFound.'
+
+    def test_get_split_chunks_from_accounts(self):
+        accounts = self.book.get_accounts(['Imbalance-GBP'])
+
+        chunks = list(self.book.get_split_chunks_from_accounts(accounts, chunk_size=2))
+
+        assert [[split.guid for split in chunk] for chunk in chunks] == [['11' * 16, '21' * 16], ['32' * 16]]
+        split = chunks[0][0]
+        assert split.account.name == 'Imbalance-GBP'
+        assert split.date == date(2017, 3, 19)
+        assert split.description == 'TESCO'
+        assert split.value == Fraction(21, 2)
+        assert split.amount == Money(Decimal('10.50'), GBP)
+        assert split.opposite_account.name == 'Assets:Current Account'
+        assert chunks[0][1].description == 'CAFÉ'
+
+    def test_get_split_chunks_from_accounts_with_split_filter(self):
+        accounts = self.book.get_accounts(['Imbalance-GBP'])
+
+        chunks = list(self.book.get_split_chunks_from_accounts(
+            accounts, chunk_size=10, split_filter=SplitFilter(start_date=date(2017, 3, 20), description_like='tes%')))
+
+        assert [[split.guid for split in chunk] for chunk in chunks] == [['32' * 16]]
+
+    def test_amount_is_in_the_currency_of_the_account(self):
+        [[split]] = self.book.get_split_chunks_from_accounts(self.book.get_accounts(['Expenses:Holidays']),
+                                                             chunk_size=10)
+        assert split.value == Fraction(24)
+        assert split.amount == Money(Decimal('28'), EUR)
+
+    def test_opposite_account_not_determined(self):
+        [[split]] = self.book.get_split_chunks_from_accounts(self.book.get_accounts(['Expenses:Groceries']),
+                                                             chunk_size=10)
+        try:
+            split.opposite_account
+        except OppositeAccountNotDetermined:
+            assert True
+        else:
+            assert False, 'opposite_account did not raise OppositeAccountNotDetermined.'
+
+    def test_get_split_rows(self):
+        rows = list(self.book.get_split_rows(exclude_account_guids=[IMBALANCE, CURRENT],
+                                             end_date=date(2017, 3, 20)))
+
+        assert rows == [SplitRow(guid='23' * 16, account_guid=GROCERIES, date=date(2017, 3, 20),
+                                 value=Fraction(-15), description='CAFÉ')]
+
+    def test_get_account_names_by_guid(self):
+        assert self.book.get_account_names_by_guid()[HOLIDAYS] == 'Expenses:Holidays'
+
+    def test_get_currencies_by_account_guid(self):
+        assert self.book.get_currencies_by_account_guid()[HOLIDAYS] == EUR
+
+    def test_get_fingerprint(self):
+        # The same as the book's fingerprint of the same splits
+        assert self.book.get_fingerprint([IMBALANCE]) == fingerprint_rows([
+            ('11' * 16, IMBALANCE, '1050/100', 'TESCO'),
+            ('21' * 16, IMBALANCE, '3000/100', 'CAFÉ'),
+            ('32' * 16, IMBALANCE, '-2400/100', 'TESCO'),
+        ])
+
+    def test_update_split_accounts_not_supported(self):
+        try:
+            self.book.update_split_accounts([])
+        except NotImplementedError:
+            assert True
+        else:
+            assert False, 'update_split_accounts did not raise NotImplementedError.'
+
+
+class TestSnapshotBookWrite(TestCase):
+    def test_write_unsupported_book(self):
+        book = Mock()
+        book.get_snapshot_rows.side_effect = NotImplementedError('Not supported.')
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'accounts.snapshot')
+            try:
+                SnapshotBook.write(book, filename)
+            except NotImplementedError as e:
+                assert str(e) == 'Not supported.'
+            else:
+                assert False, 'write did not raise NotImplementedError.'
+
+            assert not os.listdir(directory)
+        # The book says it cannot be snapshotted before anything else is read from it
+        assert not book.get_account_names_by_guid.called
+        assert not book.get_currencies_by_account_guid.called
@@ -0,0 +1,178 @@
+from unittest import TestCase
+from unittest.mock import patch, sentinel
+import os
+import shutil
+import tempfile
+from gnucashcategorizer.book import AccountsNotFound
+from gnucashcategorizer.config import Config, MatchPattern
+from gnucashcategorizer.matcher import Matcher
+from gnucashcategorizer.statements import StatementAnnotator, InvalidStatement
+
+
+class TestStatementAnnotator(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with patch.object(Config, '_load_from_file'):
+            config = Config(sentinel.filename)
+        config._config_dict = {
+            'normalization': {'strip_digits': True, 'collapse_whitespace': True, 'casefold': True},
+            'matches': [
+                {'Imbalance-GBP': [
+                    {'Expenses:Groceries': ['TESCO']},
+                    {'Expenses:Social': ['CASH *']},
+                ]},
+            ],
+        }
+        cls.matcher = Matcher(config)
+        cls.tesco_rule_id = MatchPattern('tesco', 'Expenses:Groceries').rule_id
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.annotator = StatementAnnotator(self.matcher, 'Imbalance-GBP')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def annotate(self, input_name, content, output_name, annotator=None):
+        input_filename = os.path.join(self.directory, input_name)
+        output_filename = os.path.join(self.directory, output_name)
+        with open(input_filename, 'w', encoding='utf-8', newline='') as input_file:
+            input_file.write(content)
+        counts = (annotator or self.annotator).annotate(input_filename, output_filename)
+        with open(output_filename, encoding='utf-8', newline='') as output_file:
+            return counts, output_file.read()
+
+    def test_annotate_csv(self):
+        counts, output = self.annotate('statement.csv', (
+            '﻿Date,Description,Amount\r\n'
+            '19/03/2017,TESCO 1234,-12.50\r\n'
+            '20/03/2017,"CASH 20MAR, LONDON",-30.00\r\n'
+            '21/03/2017,UNKNOWN,5.00\r\n'
+        ), 'annotated.csv')
+
+        assert counts == (3, 2)
+        assert output.splitlines() == [
+            'Date,Description,Amount,Suggested Account,Suggested Rule',
+            '19/03/2017,TESCO 1234,-12.50,Expenses:Groceries,{}'.format(self.tesco_rule_id),
+            '20/03/2017,"CASH 20MAR, LONDON",-30.00,Expenses:Social,{}'.format(
+                MatchPattern('cash *', 'Expenses:Social').rule_id),
+            '21/03/2017,UNKNOWN,5.00,,',
+        ]
+
+    def test_annotate_csv_again_overwrites_columns(self):
+        _, output = self.annotate('statement.csv', (
+            'Narrative,Suggested Account,Suggested Rule\r\n'
+            'TESCO,Expenses:Old,abcd1234\r\n'
+            'UNKNOWN,Expenses:Old,abcd1234\r\n'
+        ), 'annotated.csv')
+
+        assert output.splitlines() == [
+            'Narrative,Suggested Account,Suggested Rule',
+            'TESCO,Expenses:Groceries,{}'.format(self.tesco_rule_id),
+            'UNKNOWN,,',
+        ]
+
+    def test_annotate_csv_keeps_bank_account_column(self):
+        _, output = self.annotate('statement.csv', (
+            'Account,Description\r\n'
+            '12345678,TESCO\r\n'
+        ), 'annotated.csv')
+
+        assert output.splitlines() == [
+            'Account,Description,Suggested Account,Suggested Rule',
+            '12345678,TESCO,Expenses:Groceries,{}'.format(self.tesco_rule_id),
+        ]
+
+    def test_annotate_csv_with_description_column(self):
+        annotator = StatementAnnotator(self.matcher, 'Imbalance-GBP', description_column='payee name')
+        counts, _ = self.annotate('statement.csv', 'Memo,Payee Name\r\nCASH 1,TESCO\r\n', 'annotated.csv',
+                                  annotator=annotator)
+
+        assert counts == (1, 1)
+
+    def test_annotate_csv_without_description_column(self):
+        try:
+            self.annotate('statement.csv', 'Date,Amount\r\n19/03/2017,-12.50\r\n', 'annotated.csv')
+        except InvalidStatement:
+            assert True
+        else:
+            assert False, 'annotate did not raise InvalidStatement.'
+
+        # No half written file is left behind
+        assert os.listdir(self.directory) == ['statement.csv']
+
+    def test_annotate_qif(self):
+        counts, output = self.annotate('statement.qif', (
+            '!Account\n'
+            'NCurrent Account\n'
+            'TBank\n'
+            '^\n'
+            '!Type:Bank\n'
+            'D19/03/2017\n'
+            'T-12.50\n'
+            'PTESCO 1234\n'
+            'LImbalance-GBP\n'
+            '^\n'
+            'D20/03/2017\n'
+            'T-30.00\n'
+            'MCASH AT 20MAR\n'
+            '^\n'
+            'D21/03/2017\n'
+            'T-20.00\n'
+            'PTESCO\n'
+            'SExpenses:Groceries\n'
+            '$-10.00\n'
+            'SExpenses:Household\n'
+            '$-10.00\n'
+            '^\n'
+            'D22/03/2017\n'
+            'T5.00\n'
+            'PUNKNOWN\n'
+            '^\n'
+        ), 'annotated.qif')
+
+        assert counts == (4, 2)
+        assert output.split('^\n') == [
+            '!Account\nNCurrent Account\nTBank\n',
+            '!Type:Bank\nD19/03/2017\nT-12.50\nPTESCO 1234\nLExpenses:Groceries\n',
+            'D20/03/2017\nT-30.00\nMCASH AT 20MAR\nLExpenses:Social\n',
+            # Split records are left as they are
+            'D21/03/2017\nT-20.00\nPTESCO\nSExpenses:Groceries\n$-10.00\nSExpenses:Household\n$-10.00\n',
+            'D22/03/2017\nT5.00\nPUNKNOWN\n',
+            '',
+        ]
+
+    def test_annotate_ofx(self):
+        self.annotator.OFX_BLOCK_SIZE = 16
+        counts, output = self.annotate('statement.ofx', (
+            'OFXHEADER:100\nDATA:OFXSGML\n\n'
+            '<OFX><BANKMSGSRSV1><STMTTRNRS><STMTRS><BANKTRANLIST>\n'
+            '<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20170319120000[0:GMT]<TRNAMT>-12.50<FITID>1001'
+            '<NAME>TESCO 1234<MEMO>Groceries &amp; more</STMTTRN>\n'
+            '<STMTTRN>\n<TRNTYPE>DEBIT\n<DTPOSTED>20170320\n<TRNAMT>5.00\n<FITID>1002\n<NAME>UNKNOWN\n</STMTTRN>\n'
+            '</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>\n'
+        ), 'annotated.csv')
+
+        assert counts == (2, 1)
+        assert output.splitlines() == [
+            'Date,Amount,Description,Memo,FITID,Suggested Account,Suggested Rule',
+            '2017-03-19,-12.50,TESCO 1234,Groceries & more,1001,Expenses:Groceries,{}'.format(self.tesco_rule_id),
+            '2017-03-20,5.00,UNKNOWN,,1002,,',
+        ]
+
+    def test_annotate_unknown_format(self):
+        try:
+            self.annotate('statement.txt', 'TESCO\n', 'annotated.txt')
+        except InvalidStatement as e:
+            assert 'expected one of .csv, .ofx, .qfx, .qif' in str(e)
+        else:
+            assert False, 'annotate did not raise InvalidStatement.'
+
+    def test_annotate_unknown_account(self):
+        annotator = StatementAnnotator(self.matcher, 'Imbalance-EUR')
+        try:
+            self.annotate('statement.csv', 'Description\r\nTESCO\r\n', 'annotated.csv', annotator=annotator)
+        except AccountsNotFound as e:
+            assert e.account_names == ['Imbalance-EUR']
+        else:
+            assert False, 'annotate did not raise AccountsNotFound.'
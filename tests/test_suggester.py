@@ -1,12 +1,18 @@
 from unittest import TestCase
-from unittest.mock import Mock, patch, sentinel, call
+from unittest.mock import Mock, PropertyMock, patch, sentinel, call
 from gnucashcategorizer.suggester import Suggester, Suggestion, NoSuggestion
+from gnucashcategorizer.book import OppositeAccountNotDetermined, SplitFilter
+from gnucashcategorizer.matcher import Explanation
+from gnucashcategorizer.metrics import RunMetrics
 
 
 class TestSuggester(TestCase):
     def test_get_suggestions(self):
-        splits = [
-            sentinel.split_1, sentinel.split_2, sentinel.split_3, sentinel.split_4
+        matched_splits = [
+            (sentinel.split_1, sentinel.pattern_1),
+            (sentinel.split_2, sentinel.pattern_2),
+            (sentinel.split_3, None),
+            (sentinel.split_4, sentinel.pattern_4),
         ]
         suggestions = [
             sentinel.suggestion_1,
@@ -15,8 +21,8 @@ class TestSuggester(TestCase):
             sentinel.suggestion_3,
         ]
         suggester = Suggester(book=Mock(), config=Mock())
-        with patch.object(suggester, '_get_uncategorized_splits', return_value=splits):
-            with patch.object(suggester, '_get_suggestion_for_split',
+        with patch.object(suggester, '_get_matched_splits', return_value=matched_splits):
+            with patch.object(suggester, '_get_suggestion_for_match',
                               side_effect=suggestions) as mock_get_suggestion:
                 result = suggester.get_suggestions()
 
@@ -26,10 +32,10 @@ class TestSuggester(TestCase):
             sentinel.suggestion_3,
         ]
         mock_get_suggestion.assert_has_calls([
-            call(sentinel.split_1),
-            call(sentinel.split_2),
-            call(sentinel.split_3),
-            call(sentinel.split_4),
+            call(sentinel.split_1, sentinel.pattern_1),
+            call(sentinel.split_2, sentinel.pattern_2),
+            call(sentinel.split_3, None),
+            call(sentinel.split_4, sentinel.pattern_4),
         ])
         # Test it stored the splits without suggestions so we can access them later
         assert suggester._splits_without_suggestions == [sentinel.split_3]
@@ -52,57 +58,211 @@ class TestSuggester(TestCase):
         else:
             assert False, 'get_splits_without_suggestions failed to raise a RuntimeError.'
 
-    def test_get_uncategorized_splits(self):
+    def test_get_matched_splits(self):
+        splits = [Mock(description='FOO {}'.format(i)) for i in range(5)]
+        chunks = [splits[:2], splits[2:4], splits[4:]]
+        matcher = Mock()
+        matcher.get_match.side_effect = lambda account_name, description: (
+            None if description == 'FOO 3' else (account_name, description))
+        suggester = Suggester(book=Mock(), config=Mock())
+        suggester.MAX_QUEUED_CHUNKS = 1
+
+        with patch.object(suggester, '_get_matcher', return_value=matcher):
+            with patch.object(suggester, '_get_uncategorized_split_chunks', return_value=iter(chunks)):
+                result = suggester._get_matched_splits()
+
+        assert result == [
+            (splits[0], (splits[0].account.name, 'FOO 0')),
+            (splits[1], (splits[1].account.name, 'FOO 1')),
+            (splits[2], (splits[2].account.name, 'FOO 2')),
+            (splits[3], None),
+            (splits[4], (splits[4].account.name, 'FOO 4')),
+        ]
+
+    def test_get_matched_splits_with_explain_sample(self):
+        splits = [Mock(guid='00000000abcd', description='FOO'), Mock(guid='ffffffffabcd', description='BAR')]
+        matcher = Mock()
+        matcher.get_match.return_value = None
+        suggester = Suggester(book=Mock(), config=Mock(), explain_sample=0.5)
+
+        with patch.object(suggester, '_get_matcher', return_value=matcher):
+            with patch.object(suggester, '_get_uncategorized_split_chunks', return_value=iter([splits])):
+                result = suggester._get_matched_splits()
+
+        # Only the first split's guid falls in the sample
+        matcher.explain.assert_called_once_with(splits[0].account.name, 'FOO', rule_timings=None)
+        assert suggester.get_explanations() == [(splits[0], matcher.explain.return_value)]
+        assert result == [(splits[0], matcher.explain.return_value.match_pattern), (splits[1], None)]
+
+    def test_get_matched_splits_with_metrics(self):
+        splits = [Mock(guid='s1', description='FOO'), Mock(guid='s2', description='BAR')]
+        splits[0].account.name = splits[1].account.name = 'Imbalance-GBP'
+        matcher = Mock()
+        matcher.explain.side_effect = [Explanation(sentinel.pattern, evaluations=3, cached=False),
+                                       Explanation(None, evaluations=5, cached=False)]
+        metrics = RunMetrics()
+        suggester = Suggester(book=Mock(), config=Mock(), metrics=metrics)
+
+        with patch.object(suggester, '_get_matcher', return_value=matcher):
+            with patch.object(suggester, '_get_uncategorized_split_chunks', return_value=iter([splits])):
+                result = suggester._get_matched_splits()
+
+        assert result == [(splits[0], sentinel.pattern), (splits[1], None)]
+        matcher.explain.assert_any_call('Imbalance-GBP', 'FOO', rule_timings=metrics.rule_timings)
+        # The explanations are only kept for the sample
+        assert suggester.get_explanations() == []
+        result = metrics.as_dict()
+        assert result['splits_loaded'] == 2
+        assert result['accounts'] == {'Imbalance-GBP': {'splits': 2, 'matched': 1, 'match_rate': 0.5}}
+        assert result['patterns_evaluated']['sum'] == 8
+        assert set(result['phase_seconds']) == {'load', 'match'}
+
+    def test_should_explain(self):
+        assert not Suggester(book=Mock(), config=Mock())._should_explain('00000000abcd')
+        assert Suggester(book=Mock(), config=Mock(), explain_sample=1)._should_explain('ffffffffabcd')
+        suggester = Suggester(book=Mock(), config=Mock(), explain_sample=0.25)
+        assert suggester._should_explain('3fffffffabcd')
+        assert not suggester._should_explain('40000000abcd')
+
+    def test_get_explanations_raises_runtime_error_if_get_suggestions_not_run_first(self):
+        suggester = Suggester(book=Mock(), config=Mock())
+        try:
+            suggester.get_explanations()
+        except RuntimeError:
+            assert True
+        else:
+            assert False, 'get_explanations did not raise RuntimeError.'
+
+    def test_get_matched_splits_leaves_out_skipped_splits(self):
+        splits = [Mock(guid='s1', description='FOO'), Mock(guid='s2', description='BAR')]
+        matcher = Mock()
+        matcher.get_match.return_value = None
+        skip_split_guids = set()
+        suggester = Suggester(book=Mock(), config=Mock(), skip_split_guids=skip_split_guids)
+        # The set can be added to after the suggester is created
+        skip_split_guids.add('s1')
+
+        with patch.object(suggester, '_get_matcher', return_value=matcher):
+            with patch.object(suggester, '_get_uncategorized_split_chunks', return_value=iter([splits])):
+                result = suggester._get_matched_splits()
+
+        assert result == [(splits[1], None)]
+
+    def test_get_matcher_is_only_created_once(self):
+        config, book = Mock(), Mock()
+        suggester = Suggester(book=book, config=config)
+
+        with patch('gnucashcategorizer.suggester.Matcher') as mock_matcher_cls:
+            assert suggester._get_matcher() == mock_matcher_cls.return_value
+            assert suggester._get_matcher() == mock_matcher_cls.return_value
+
+        # The patterns are bound to the book's accounts
+        mock_matcher_cls.assert_called_once_with(config, book=book)
+
+    def test_reload_config(self):
+        suggester = Suggester(book=Mock(), config=Mock())
+        suggester._matcher = Mock()
+        suggester._matcher.reload.return_value = {'Imbalance-GBP'}
+
+        assert suggester.reload_config() == {'Imbalance-GBP'}
+
+    def test_get_matched_splits_reraises_errors_from_matching(self):
+        chunks = [[Mock()], [Mock()], [Mock()]]
+        matcher = Mock()
+        matcher.get_match.side_effect = ValueError('Bad pattern.')
+        suggester = Suggester(book=Mock(), config=Mock())
+        suggester.MAX_QUEUED_CHUNKS = 1
+
+        with patch.object(suggester, '_get_matcher', return_value=matcher):
+            with patch.object(suggester, '_get_uncategorized_split_chunks', return_value=iter(chunks)):
+                try:
+                    suggester._get_matched_splits()
+                except ValueError as e:
+                    assert str(e) == 'Bad pattern.'
+                else:
+                    assert False, '_get_matched_splits failed to raise a ValueError.'
+
+        # It stopped matching after the first error
+        matcher.get_match.assert_called_once_with(chunks[0][0].account.name, chunks[0][0].description)
+
+    def test_get_uncategorized_split_chunks(self):
         book = Mock()
-        book.get_splits_from_accounts.return_value = sentinel.splits
+        book.get_split_chunks_from_accounts.return_value = iter([sentinel.chunk_1, sentinel.chunk_2])
         suggester = Suggester(book=book, config=Mock())
 
         with patch.object(suggester, '_get_uncategorized_accounts', return_value=sentinel.accounts):
-            result = suggester._get_uncategorized_splits()
+            result = list(suggester._get_uncategorized_split_chunks())
 
-        assert result == sentinel.splits
-        book.get_splits_from_accounts.assert_called_once_with(sentinel.accounts)
+        assert result == [sentinel.chunk_1, sentinel.chunk_2]
+        book.get_split_chunks_from_accounts.assert_called_once_with(sentinel.accounts,
+                                                                    chunk_size=Suggester.CHUNK_SIZE,
+                                                                    release=False,
+                                                                    split_filter=None)
 
-    def test_get_uncategorized_accounts(self):
+    def test_get_uncategorized_split_chunks_with_memory_limit(self):
         book = Mock()
-        book.get_accounts.return_value = sentinel.accounts
-        config = Mock()
-        config.get_uncategorized_account_names.return_value = ['Foo', 'Bar']
-        suggester = Suggester(book=book, config=config)
+        book.get_split_chunks_from_accounts.return_value = iter([sentinel.chunk_1])
+        suggester = Suggester(book=book, config=Mock(), memory_limit=60)
+
+        with patch.object(suggester, '_get_uncategorized_accounts', return_value=sentinel.accounts):
+            result = list(suggester._get_uncategorized_split_chunks())
+
+        assert result == [sentinel.chunk_1]
+        # 60MB shared between 6 chunks in memory, at 10KB per split
+        book.get_split_chunks_from_accounts.assert_called_once_with(sentinel.accounts,
+                                                                    chunk_size=1024,
+                                                                    release=True,
+                                                                    split_filter=None)
+
+    def test_get_chunk_size_is_at_least_one(self):
+        suggester = Suggester(book=Mock(), config=Mock(), memory_limit=0)
+        assert suggester._get_chunk_size() == 1
+
+    def test_get_uncategorized_accounts(self):
+        suggester = Suggester(book=Mock(), config=Mock())
+        suggester._matcher = Mock()
+        suggester._matcher.get_uncategorized_accounts.return_value = sentinel.accounts
+
+        assert suggester._get_uncategorized_accounts() == sentinel.accounts
+
+    def test_get_uncategorized_accounts_with_split_filter(self):
+        accounts = [Mock(), Mock()]
+        accounts[0].name, accounts[1].name = 'Imbalance-GBP', 'Unresolved'
+        suggester = Suggester(book=Mock(), config=Mock(), split_filter=SplitFilter(account_names=['Unresolved']))
+        suggester._matcher = Mock()
+        suggester._matcher.get_uncategorized_accounts.return_value = accounts
 
-        result = suggester._get_uncategorized_accounts()
-        assert result == sentinel.accounts
+        assert suggester._get_uncategorized_accounts() == [accounts[1]]
 
-    def test_get_suggestion_for_split_second_pattern_matches(self):
-        config = Mock()
-        pattern_1 = Mock()
-        pattern_1.is_match.return_value = False
-        pattern_2 = Mock()
-        pattern_2.is_match.return_value = True
-        config.get_patterns_for_account_name.return_value = [pattern_1, pattern_2]
+    def test_get_suggestion_for_match(self):
         split = Mock()
         book = Mock()
-        book.get_account.return_value = sentinel.account
-        suggester = Suggester(book=book, config=config)
-        result = suggester._get_suggestion_for_split(split)
+        suggester = Suggester(book=book, config=Mock())
+
+        result = suggester._get_suggestion_for_match(split, Mock(account=sentinel.account))
 
         assert result == Suggestion(split, new_account=sentinel.account)
-        config.get_patterns_for_account_name.assert_called_once_with(split.account.name)
-        pattern_2.is_match.assert_called_once_with(split.description)
-        book.get_account.assert_called_once_with(pattern_2.account_name)
-
-    def test_get_suggestion_for_split_raises_no_suggestion_found_if_no_match(self):
-        config = Mock()
-        pattern_1 = Mock()
-        pattern_1.is_match.return_value = False
-        pattern_2 = Mock()
-        pattern_2.is_match.return_value = False
-        split = Mock()
-        config.get_patterns_for_account_name.return_value = [pattern_1, pattern_2]
+        # The account was bound to the pattern up front, so it is not looked up
+        assert not book.get_account.called
+
+    def test_get_plan(self):
+        book = Mock()
+        suggester = Suggester(book=book, config=Mock())
+
+        with patch.object(suggester, '_get_uncategorized_accounts', return_value=[Mock(guid='a1'), Mock(guid='a2')]):
+            with patch('gnucashcategorizer.suggester.Plan.from_suggestions') as mock_from_suggestions:
+                result = suggester.get_plan(sentinel.suggestions)
 
-        suggester = Suggester(book=Mock(), config=config)
+        assert result == mock_from_suggestions.return_value
+        book.get_fingerprint.assert_called_once_with(['a1', 'a2'])
+        mock_from_suggestions.assert_called_once_with(sentinel.suggestions,
+                                                      book_fingerprint=book.get_fingerprint.return_value,
+                                                      account_guids=['a1', 'a2'])
+
+    def test_get_suggestion_for_match_raises_no_suggestion_found_if_no_match(self):
+        suggester = Suggester(book=Mock(), config=Mock())
         try:
-            suggester._get_suggestion_for_split(split)
+            suggester._get_suggestion_for_match(Mock(), None)
         except NoSuggestion:
             assert True
         else:
@@ -119,6 +279,15 @@ class TestSuggester(TestCase):
 
 
 class TestSuggestion(TestCase):
+    def test_opposite_account(self):
+        split = Mock(opposite_account=sentinel.account)
+        assert Suggestion(split=split, new_account=Mock()).opposite_account == sentinel.account
+
+    def test_opposite_account_is_none_if_not_determined(self):
+        split = Mock()
+        type(split).opposite_account = PropertyMock(side_effect=OppositeAccountNotDetermined)
+        assert Suggestion(split=split, new_account=Mock()).opposite_account is None
+
     def test_str(self):
         split = Mock()
         split.__str__ = Mock(return_value='foo split')
@@ -159,6 +328,14 @@ class TestSuggestion(TestCase):
                                 new_account=Mock())
         assert suggestion.amount == sentinel.amount
 
+    def test_rule_id(self):
+        suggestion = Suggestion(split=Mock(), new_account=Mock(), match_pattern=Mock(rule_id='abcd1234'))
+        assert suggestion.rule_id == 'abcd1234'
+
+    def test_rule_id_is_none_without_match_pattern(self):
+        suggestion = Suggestion(split=Mock(), new_account=Mock())
+        assert suggestion.rule_id is None
+
     def test_old_account(self):
         suggestion = Suggestion(split=Mock(account=sentinel.old_account),
                                 new_account=Mock())
@@ -0,0 +1,119 @@
+from unittest import TestCase
+from unittest.mock import Mock, patch, sentinel
+from gnucashcategorizer.book import UnexpectedRowCount
+from gnucashcategorizer.watcher import Watcher
+
+
+class TestWatcher(TestCase):
+    def setUp(self):
+        self.book = Mock()
+        with patch('gnucashcategorizer.watcher.Suggester') as mock_suggester_cls:
+            self.watcher = Watcher(config=sentinel.config, book=self.book, book_filename='accounts.gnucash',
+                                   poll_interval=sentinel.poll_interval, memory_limit=sentinel.memory_limit,
+                                   split_filter=sentinel.split_filter, journal=Mock())
+        self.mock_suggester_cls = mock_suggester_cls
+        self.suggester = mock_suggester_cls.return_value
+
+    def test_init(self):
+        self.mock_suggester_cls.assert_called_once_with(config=sentinel.config, book=self.book,
+                                                        memory_limit=sentinel.memory_limit,
+                                                        skip_split_guids=self.watcher._seen_split_guids,
+                                                        split_filter=sentinel.split_filter,
+                                                        metrics=None)
+
+    def test_book_has_changed(self):
+        with patch.object(self.watcher, '_get_last_modified', return_value=100):
+            # It has never been categorized
+            assert self.watcher.book_has_changed()
+            self.watcher._last_modified = 100
+            assert not self.watcher.book_has_changed()
+
+        with patch.object(self.watcher, '_get_last_modified', return_value=200):
+            assert self.watcher.book_has_changed()
+
+    def test_categorize_new_splits(self):
+        suggestions = [
+            Mock(split=Mock(guid='s1'), old_account=Mock(guid='o1'), new_account=Mock(guid='a1')),
+            Mock(split=Mock(guid='s2'), old_account=Mock(guid='o2'), new_account=Mock(guid='a2')),
+        ]
+        splits_without_suggestions = [Mock(guid='s3')]
+        self.suggester.get_suggestions.return_value = suggestions
+        self.suggester.get_splits_without_suggestions.return_value = splits_without_suggestions
+
+        journal = self.watcher._journal
+        journal.save_changes.return_value = 'run1'
+        # The book is modified by saving the suggestions
+        with patch.object(self.watcher, '_get_last_modified', side_effect=[100, 200]):
+            result = self.watcher.categorize_new_splits()
+
+        assert result == (suggestions, splits_without_suggestions, 'run1')
+        self.book.refresh.assert_called_once_with()
+        (book, entries), _ = journal.save_changes.call_args
+        assert book == self.book
+        assert [(entry.split_guid, entry.old_account_guid, entry.new_account_guid) for entry in entries] == [
+            ('s1', 'o1', 'a1'), ('s2', 'o2', 'a2')]
+        # The splits that could not be categorized will not be matched again
+        assert self.watcher._seen_split_guids == {'s3'}
+        # Our own changes don't count as the book changing
+        assert self.watcher._last_modified == 200
+
+    def test_categorize_new_splits_without_suggestions(self):
+        self.suggester.get_suggestions.return_value = []
+        self.suggester.get_splits_without_suggestions.return_value = []
+
+        with patch.object(self.watcher, '_get_last_modified', return_value=100):
+            result = self.watcher.categorize_new_splits()
+
+        assert result == ([], [], None)
+        assert not self.watcher._journal.save_changes.called
+        assert self.watcher._last_modified == 100
+
+    def test_categorize_new_splits_that_cannot_be_saved(self):
+        self.suggester.get_suggestions.return_value = [
+            Mock(split=Mock(guid='s1'), old_account=Mock(guid='o1'), new_account=Mock(guid='a1'))]
+        self.suggester.get_splits_without_suggestions.return_value = []
+        self.watcher._journal.save_changes.side_effect = UnexpectedRowCount('Expected to move 1 splits, but 0 could '
+                                                                            'be moved.')
+
+        with patch.object(self.watcher, '_get_last_modified', return_value=100):
+            try:
+                self.watcher.categorize_new_splits()
+            except UnexpectedRowCount:
+                assert True
+            else:
+                assert False, 'categorize_new_splits did not raise UnexpectedRowCount.'
+
+            # They are tried again once the book changes, rather than straight away
+            assert not self.watcher.book_has_changed()
+
+    def test_watch(self):
+        self.suggester.reload_config.return_value = set()
+        with patch.object(self.watcher, 'book_has_changed', side_effect=[True, False, True]):
+            with patch.object(self.watcher, 'categorize_new_splits',
+                              side_effect=[sentinel.result_1, sentinel.result_2]):
+                with patch('gnucashcategorizer.watcher.time.sleep') as mock_sleep:
+                    watching = self.watcher.watch()
+                    results = [next(watching), next(watching)]
+
+        assert results == [sentinel.result_1, sentinel.result_2]
+        mock_sleep.assert_called_with(sentinel.poll_interval)
+        assert mock_sleep.call_count == 2
+
+    def test_defaults(self):
+        with patch('gnucashcategorizer.watcher.Suggester'):
+            watcher = Watcher(config=sentinel.config, book=self.book, book_filename='accounts.gnucash')
+        assert watcher._poll_interval == Watcher.POLL_INTERVAL
+        assert watcher._journal._filename == 'accounts.gnucash.journal'
+
+    def test_watch_matches_all_splits_again_if_config_changes(self):
+        self.suggester.reload_config.return_value = {'Imbalance-GBP'}
+        self.watcher._seen_split_guids.add('s1')
+        self.watcher._last_modified = 100
+
+        with patch.object(self.watcher, '_get_last_modified', return_value=100):
+            with patch.object(self.watcher, 'categorize_new_splits', return_value=sentinel.result):
+                with patch('gnucashcategorizer.watcher.time.sleep'):
+                    result = next(self.watcher.watch())
+
+        assert result == sentinel.result
+        assert self.watcher._seen_split_guids == set()
@@ -0,0 +1,190 @@
+from unittest import TestCase
+from unittest.mock import patch
+from datetime import date
+from decimal import Decimal
+import gzip
+import os
+import shutil
+import tempfile
+from moneyed import Money, GBP, EUR
+from gnucashcategorizer.book import (AccountsNotFound, SplitFilter, fingerprint_rows, OppositeAccountNotDetermined,
+                                     SplitRow)
+from fractions import Fraction
+from gnucashcategorizer.xmlbook import XmlBook, XmlSplit, XmlAccount
+
+
+SAMPLE_BOOK_FILENAME = os.path.join(os.path.dirname(__file__), 'sample_book.xml')
+
+
+class TestXmlBook(TestCase):
+    # Not unit tests, these read from a sample XML book
+    def setUp(self):
+        self.book = XmlBook(SAMPLE_BOOK_FILENAME)
+
+    def test_is_xml_file(self):
+        assert XmlBook.is_xml_file(SAMPLE_BOOK_FILENAME)
+
+    def test_is_xml_file_compressed(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'accounts.gnucash')
+            with open(SAMPLE_BOOK_FILENAME, 'rb') as source, gzip.open(filename, 'wb') as destination:
+                shutil.copyfileobj(source, destination)
+
+            assert XmlBook.is_xml_file(filename)
+            # And it reads the compressed file
+            assert XmlBook(filename).get_account('Expenses:Groceries').guid == '00000000000000000000000000000004'
+
+    def test_is_xml_file_false_for_other_files(self):
+        with tempfile.NamedTemporaryFile(suffix='.gnucash') as sqlite_file:
+            sqlite_file.write(b'SQLite format 3\x00')
+            sqlite_file.flush()
+            assert not XmlBook.is_xml_file(sqlite_file.name)
+
+    def test_get_account(self):
+        account = self.book.get_account('Expenses:Groceries')
+        assert account.guid == '00000000000000000000000000000004'
+        assert account.currency == GBP
+        assert str(account) == 'Expenses:Groceries'
+
+    def test_accounts_are_only_read_and_indexed_once(self):
+        with patch.object(self.book, '_read_accounts', wraps=self.book._read_accounts) as mock_read_accounts:
+            self.book.get_account('Expenses:Groceries')
+            accounts_by_name = self.book._accounts_by_name
+            self.book.get_account('Imbalance-GBP')
+            self.book.get_accounts_by_name(['Imbalance-GBP', 'Expenses:Groceries'])
+
+        mock_read_accounts.assert_called_once_with()
+        assert self.book._accounts_by_name is accounts_by_name
+
+        self.book.refresh()
+        assert self.book._accounts_by_name is None
+
+    def test_get_account_raises_accounts_not_found(self):
+        try:
+            self.book.get_account('Expenses:Travel')
+        except AccountsNotFound as e:
+            assert e.account_names == ['Expenses:Travel']
+        else:
+            assert False, 'get_account did not raise AccountsNotFound.'
+
+    def test_get_accounts_raises_accounts_not_found(self):
+        try:
+            self.book.get_accounts(['Imbalance-GBP', 'Expenses:Travel', 'Income'])
+        except AccountsNotFound as e:
+            assert e.account_names == ['Expenses:Travel', 'Income']
+        else:
+            assert False, 'get_accounts did not raise AccountsNotFound.'
+
+    def test_get_accounts_by_name(self):
+        accounts_by_name = self.book.get_accounts_by_name(['Imbalance-GBP', 'Expenses:Groceries'])
+        assert {name: account.guid for name, account in accounts_by_name.items()} == {
+            'Imbalance-GBP': '00000000000000000000000000000002',
+            'Expenses:Groceries': '00000000000000000000000000000004',
+        }
+
+    def test_get_accounts_by_name_reports_all_missing_accounts(self):
+        try:
+            self.book.get_accounts_by_name(['Imbalance-GBP', 'Expenses:Travel', 'Expenses:Grocreies'])
+        except AccountsNotFound as e:
+            assert e.account_names == ['Expenses:Grocreies', 'Expenses:Travel']
+        else:
+            assert False, 'get_accounts_by_name did not raise AccountsNotFound.'
+
+    def test_get_accounts(self):
+        accounts = self.book.get_accounts(['Imbalance-GBP', 'Current Account'])
+        assert [account.guid for account in accounts] == [
+            '00000000000000000000000000000002',
+            '00000000000000000000000000000005',
+        ]
+
+    def test_get_split_chunks_from_accounts(self):
+        account = self.book.get_account('Imbalance-GBP')
+
+        chunks = list(self.book.get_split_chunks_from_accounts([account], chunk_size=1))
+
+        assert [[split.guid for split in chunk] for chunk in chunks] == [
+            ['20000000000000000000000000000001'],
+            ['20000000000000000000000000000005'],
+        ]
+        split = chunks[0][0]
+        assert split.account is account
+        assert split.date == date(2017, 3, 19)
+        assert split.description == 'CARD 1234 TESCO 19/03'
+        assert split.amount == Money(Decimal('30.50'), GBP)
+
+    def test_get_split_chunks_from_accounts_with_split_filter(self):
+        account = self.book.get_account('Imbalance-GBP')
+
+        chunks = list(self.book.get_split_chunks_from_accounts([account], chunk_size=10,
+                                                               split_filter=SplitFilter(description_like='%tesco%')))
+
+        assert [[split.guid for split in chunk] for chunk in chunks] == [['20000000000000000000000000000001']]
+
+    def test_split_opposite_account(self):
+        account = self.book.get_account('Imbalance-GBP')
+
+        split = next(self.book.get_split_chunks_from_accounts([account], chunk_size=1))[0]
+
+        assert split.opposite_account.name == 'Current Account'
+
+    def test_get_split_rows(self):
+        result = list(self.book.get_split_rows(exclude_account_guids=['00000000000000000000000000000005'],
+                                               start_date=date(2017, 3, 20)))
+
+        assert result == [
+            SplitRow(guid='20000000000000000000000000000003', account_guid='00000000000000000000000000000004',
+                     date=date(2017, 3, 20), value=Fraction(10), description='WEEKLY SHOP'),
+            SplitRow(guid='20000000000000000000000000000005', account_guid='00000000000000000000000000000002',
+                     date=date(2017, 3, 21), value=Fraction(-1500), description='MYEMPLOYER'),
+        ]
+
+    def test_get_account_names_by_guid(self):
+        result = self.book.get_account_names_by_guid()
+        assert result['00000000000000000000000000000004'] == 'Expenses:Groceries'
+        assert len(result) == 4
+
+    def test_get_currencies_by_account_guid(self):
+        result = self.book.get_currencies_by_account_guid()
+        assert result['00000000000000000000000000000004'] == GBP
+        assert len(result) == 4
+
+    def test_get_fingerprint(self):
+        fingerprint = self.book.get_fingerprint(['00000000000000000000000000000002'])
+
+        assert fingerprint == fingerprint_rows([
+            ('20000000000000000000000000000001', '00000000000000000000000000000002', '61/2',
+             'CARD 1234 TESCO 19/03'),
+            ('20000000000000000000000000000005', '00000000000000000000000000000002', '-1500', 'MYEMPLOYER'),
+        ])
+
+    def test_update_split_accounts_is_not_supported(self):
+        try:
+            self.book.update_split_accounts([])
+        except NotImplementedError:
+            assert True
+        else:
+            assert False, 'update_split_accounts did not raise NotImplementedError.'
+
+
+class TestXmlSplit(TestCase):
+    def test_amount(self):
+        account = XmlAccount(guid='a1', name='Foo', currency=GBP)
+        split = XmlSplit(guid='abc', account=account, date=None, description='', value='-150055/100')
+        assert split.amount == Money(Decimal('-1500.55'), GBP)
+
+    def test_amount_uses_quantity_in_account_currency(self):
+        account = XmlAccount(guid='a1', name='Foo', currency=EUR)
+        split = XmlSplit(guid='abc', account=account, date=None, description='', value='-150055/100',
+                         quantity='-180000/100')
+        assert split.amount == Money(Decimal('-1800'), EUR)
+
+    def test_opposite_account_not_determined(self):
+        split = XmlSplit(guid='abc', account=None, date=None, description='', value='1/1',
+                         other_split_accounts=[XmlAccount(guid='a1', name='Foo'), XmlAccount(guid='a2', name='Bar')])
+
+        try:
+            split.opposite_account
+        except OppositeAccountNotDetermined:
+            assert True
+        else:
+            assert False, 'opposite_account did not raise OppositeAccountNotDetermined.'